@@ -1,11 +1,14 @@
 # analysis/main.py
 import logging
+import os
 import threading
 
 import uvicorn
 from fastapi import FastAPI
 
 from module.consumer import start_kafka_consumer
+from module.datastore import STORE
+from module.workers import IngestPool
 from module.ui import router as ui_router
 from module.api import router as api_router
 
@@ -17,10 +20,42 @@ def create_app() -> FastAPI:
 
     @app.on_event("startup")
     def on_startup():
+        snapshot_dir = os.environ.get("SNAPSHOT_DIR", "snapshots")
+        snapshot_interval = float(os.environ.get("SNAPSHOT_INTERVAL", "60"))
+
+        # INGEST_WORKERS > 0: consume in that many processes; STORE here
+        # becomes a replica of their series
+        ingest_workers = int(os.environ.get("INGEST_WORKERS", "0"))
+        if ingest_workers > 0:
+            pool = IngestPool(
+                workers=ingest_workers,
+                snapshot_dir=snapshot_dir,
+                ship_interval=float(os.environ.get("INGEST_SHIP_INTERVAL", "1")),
+                snapshot_interval=snapshot_interval,
+            )
+            pool.start()
+            app.state.ingest_pool = pool
+            return
+
+        # Restore series from the last snapshot before consuming new records
+        try:
+            loaded = STORE.load_snapshot(snapshot_dir)
+            logger.info(f"Loaded {loaded} series from snapshot in {snapshot_dir}")
+        except Exception as e:
+            logger.error(f"Failed to load snapshot from {snapshot_dir}: {e}")
+        if snapshot_interval > 0:
+            STORE.start_snapshots(snapshot_dir, snapshot_interval)
+
         t = threading.Thread(target=start_kafka_consumer, daemon=True)
         t.start()
         logger.info("Kafka consumer thread started")
 
+    @app.on_event("shutdown")
+    def on_shutdown():
+        pool = getattr(app.state, "ingest_pool", None)
+        if pool is not None:
+            pool.stop()
+
     # UI at "/"
     app.include_router(ui_router)
 
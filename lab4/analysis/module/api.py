@@ -1,13 +1,17 @@
 # analysis/module/api.py
-from typing import Any, Dict
+from typing import Any, Dict, List, Optional, Tuple
 
-from fastapi import APIRouter
-from fastapi.responses import JSONResponse
+from fastapi import APIRouter, Request
+from fastapi.responses import JSONResponse, Response, StreamingResponse
+import json
 import os
 import logging
+import threading
+import time
 from fastapi import HTTPException
 from .kafka_producer import KafkaProducerClient
-from .datastore import HISTORY, UNITS
+from .broadcast import BROADCAST, Point
+from .datastore import STORE, SeriesKey
 
 router = APIRouter()
 logger = logging.getLogger(__name__)
@@ -21,17 +25,17 @@ def get_producer(retries: int = 1, delay: float = 2.0):
     return _producer
 
   brokers = os.environ.get("KAFKA_BROKERS", "localhost:9094")
+  codec = os.environ.get("KAFKA_CODEC", "json")
   last_exc = None
   for _ in range(retries):
     try:
-      _producer = KafkaProducerClient(broker_addr=brokers)
+      _producer = KafkaProducerClient(broker_addr=brokers, codec=codec)
       return _producer
     except Exception as e:
       last_exc = e
       logger.error(f"Failed to create Kafka producer for {brokers}: {e}")
       time_to_sleep = delay
       try:
-        import time
         time.sleep(time_to_sleep)
       except Exception:
         pass
@@ -40,11 +44,43 @@ def get_producer(retries: int = 1, delay: float = 2.0):
   raise HTTPException(status_code=503, detail=f"Kafka unavailable: {last_exc}")
 
 
+_version_lock = threading.Lock()
+_last_version = 0
+
+
+def next_command_version() -> int:
+  """Monotonic command version: epoch milliseconds, strictly increasing."""
+  global _last_version
+  with _version_lock:
+    _last_version = max(_last_version + 1, time.time_ns() // 1_000_000)
+    return _last_version
+
+
+# points -> (series key -> version, series key -> JSON-encoded entry).
+# Only series whose version changed since the last request are rebuilt;
+# the whole entry is rebuilt once series were removed (STORE.generation).
+_metrics_cache: Dict[int, Tuple[int, Dict[SeriesKey, int], Dict[SeriesKey, str]]] = {}
+_metrics_cache_lock = threading.Lock()
+_METRICS_CACHE_SIZE = 4
+
+
 @router.get("/metrics", response_class=JSONResponse)
-def api_metrics():
+def api_metrics(points: int = 15, since: Optional[int] = None):
     """
+    `points`: number of most recent values returned per series; "ts"
+    holds their sample times (Unix epoch ns) so clients can merge
+    overlapping responses and stream events without duplicates.
+    avg/min/max/variance cover the last AGGREGATE_WINDOW points and are
+    maintained on ingest; ewma covers the whole series.
+
+    `since`: the `cursor` of a previous response. Only series with points
+    appended after it are returned, each with just those new values (at
+    most `points`), and `"delta": true`. A cursor from before the last
+    restart gets a full response instead.
+
     Returns:
     {
+      "cursor": 1718000000000123,
       "hosts": {
         "hostname": {
           "metrics": {
@@ -56,33 +92,162 @@ def api_metrics():
       }
     }
     """
-    hosts: Dict[str, Dict[str, Any]] = {}
+    points = max(1, points)
 
-    for (host, metric_name), dq in HISTORY.items():
-        if not dq:
-            continue
-
-        values = [p["value"] for p in dq]
-        avg = sum(values) / len(values)
-        mx = max(values)
-        latest = values[-1]
-        unit = UNITS.get((host, metric_name), "")
-
-        h = hosts.setdefault(host, {"metrics": {}})
-        h["metrics"][metric_name] = {
-            "values": values,
-            "avg": avg,
-            "max": mx,
-            "latest": latest,
-            "unit": unit,
-        }
+    if since is not None and since >= STORE.boot_seq:
+        return _metrics_delta(since, points)
+
+    with _metrics_cache_lock:
+        # Read before changed(): a drop in between is caught by the next request
+        generation = STORE.generation
+        cached = _metrics_cache.get(points)
+        if cached is None or cached[0] != generation:
+            # Dropped hosts must disappear, and one that comes back restarts
+            # at version 0, which could match a stale cached version
+            if cached is None and len(_metrics_cache) >= _METRICS_CACHE_SIZE:
+                _metrics_cache.pop(next(iter(_metrics_cache)))
+            cached = _metrics_cache[points] = (generation, {}, {})
+        _generation, versions, entries = cached
+
+        cursor, changes = STORE.changed(versions, points)
+        for key, version, unit, ts, values, agg in changes:
+            versions[key] = version
+            entries[key] = _entry_json(ts, values, unit, agg)
 
-    return JSONResponse({"hosts": hosts})
+        hosts: Dict[str, List[str]] = {}
+        for (host, metric_name), entry in entries.items():
+            hosts.setdefault(host, []).append(f"{json.dumps(metric_name)}:{entry}")
+
+    return _metrics_response(cursor, hosts, delta=False)
+
+
+def _metrics_delta(since: int, points: int) -> Response:
+    cursor, changes = STORE.since(since, points)
+    hosts: Dict[str, List[str]] = {}
+    for (host, metric_name), unit, ts, values, agg in changes:
+        hosts.setdefault(host, []).append(
+            f"{json.dumps(metric_name)}:{_entry_json(ts, values, unit, agg)}"
+        )
+    return _metrics_response(cursor, hosts, delta=True)
+
+
+def _entry_json(ts, values, unit: str, agg: Dict[str, Any]) -> str:
+    return json.dumps({
+        "ts": ts.tolist(),
+        "values": values.tolist(),
+        "avg": agg["avg"],
+        "min": agg["min"],
+        "max": agg["max"],
+        "variance": agg["variance"],
+        "ewma": agg["ewma"],
+        "count": agg["count"],
+        "latest": values[-1],
+        "unit": unit,
+    })
+
+
+def _metrics_response(cursor: int, hosts: Dict[str, List[str]], delta: bool) -> Response:
+    body = ",".join(
+        f'{json.dumps(host)}:{{"metrics":{{{",".join(metrics)}}}}}' for host, metrics in hosts.items()
+    )
+    delta_field = '"delta":true,' if delta else ""
+    return Response(
+        content=f'{{"cursor":{cursor},{delta_field}"hosts":{{{body}}}}}',
+        media_type="application/json",
+    )
+
+
+@router.get("/history", response_class=JSONResponse)
+def api_history(host: str, metric: str, span: float = 3600, points: int = 300):
+    """
+    Long-range view of one series: the last `span` seconds, served from
+    the coarsest rollup tier (1m / 5m / 1h by default) whose retention
+    covers the span and that still gives at least `points` buckets, or
+    from raw points for short spans. When no tier is fine enough and raw
+    points do not reach back far enough, the finest covering tier is used.
+
+    Returns:
+    {
+      "host": "...", "metric": "cpu", "unit": "%",
+      "step": 300,             # bucket seconds, 0 = raw points
+      "ts": [...],             # bucket start / point time, Unix epoch ns
+      "min": [...], "max": [...], "avg": [...], "count": [...]
+    }
+    """
+    history = STORE.history((host, metric), max(1.0, span), max(1, points))
+    if history is None:
+        raise HTTPException(status_code=404, detail=f"No series {host}/{metric}")
+    history.update(host=host, metric=metric)
+    return JSONResponse(history)
+
+
+# Seconds between SSE keep-alive comments when no points arrive
+_STREAM_HEARTBEAT = float(os.environ.get("STREAM_HEARTBEAT", "15"))
+
+
+@router.get("/stream")
+async def api_stream(request: Request, hosts: str = "", metrics: str = ""):
+    """
+    Server-Sent Events stream of newly ingested points.
+
+    `hosts` / `metrics`: optional comma-separated filters; a metric name
+    also matches its sub-series ("diskio" -> "diskio.read").
+    Slow clients get only the latest point per series (coalesced).
+
+    Each event:
+    {
+      "cursor": 1718000000000123,
+      "hosts": {"hostname": {"metrics": {"cpu": {"ts": ..., "value": ..., "unit": "%"}}}}
+    }
+    "ts" is the sample time in Unix epoch ns. `cursor` can be passed to
+    `/api/metrics?since=` to backfill after a reconnect.
+    """
+    sub = BROADCAST.subscribe(
+        hosts=[h.strip() for h in hosts.split(",") if h.strip()],
+        metrics=[m.strip() for m in metrics.split(",") if m.strip()],
+    )
+
+    async def events():
+        try:
+            yield "retry: 2000\n\n"
+            while not await request.is_disconnected():
+                batch = await sub.next_batch(_STREAM_HEARTBEAT)
+                if not batch:
+                    yield ": keep-alive\n\n"
+                    continue
+                yield f"data: {_stream_event(STORE.seq, batch)}\n\n"
+        finally:
+            BROADCAST.unsubscribe(sub)
+
+    return StreamingResponse(
+        events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+def _stream_event(cursor: int, batch: Dict[SeriesKey, Point]) -> str:
+    hosts: Dict[str, Dict[str, Any]] = {}
+    for (host, metric_name), (ts, value, unit) in batch.items():
+        host_metrics = hosts.setdefault(host, {"metrics": {}})["metrics"]
+        host_metrics[metric_name] = {"ts": ts, "value": value, "unit": unit}
+    return json.dumps({"cursor": cursor, "hosts": hosts})
 
 
 @router.post("/send-commands")
 async def send_commands(payload: dict):
+    """
+    Body: {"metrics": [...], "hosts": [...], "groups": [...],
+           "labels": {"zone": "a"}, "ttl": 300}
+    Without hosts/groups/labels the command goes to every agent.
+    `ttl` (seconds) is optional; when it runs out agents go back to
+    their default metrics.
+    """
     metrics = payload.get("metrics", [])
+    hosts = payload.get("hosts") or []
+    groups = payload.get("groups") or []
+    labels = payload.get("labels") or {}
+    ttl = payload.get("ttl")
 
     if not metrics:
         return JSONResponse(
@@ -98,10 +263,19 @@ async def send_commands(payload: dict):
       logger.error("Cannot obtain Kafka producer: %s", e.detail)
       raise
 
+    message = {
+      "version": next_command_version(),
+      "metrics": metrics,
+      "target": {"hosts": hosts, "groups": groups, "labels": labels},
+      "issued_at": time.time(),
+    }
+    if ttl:
+      message["ttl"] = ttl
+
     try:
-      prod.send_message(topic="commands", message=metrics)
+      prod.send_message(topic="commands", message=message)
     except Exception as e:
       logger.exception("Failed to send commands to Kafka: %s", e)
       raise HTTPException(status_code=503, detail=str(e))
 
-    return JSONResponse({"status": "ok", "sent": metrics})
+    return JSONResponse({"status": "ok", "sent": message})
@@ -0,0 +1,154 @@
+# analysis/module/broadcast.py
+import asyncio
+import logging
+import os
+import threading
+from typing import Dict, FrozenSet, Iterable, List, Optional, Tuple
+
+from .datastore import SeriesKey
+
+# (timestamp ns, value, unit)
+Point = Tuple[int, float, str]
+
+DEFAULT_MAX_PENDING = int(os.environ.get("STREAM_MAX_PENDING", "1000"))
+
+
+class Subscriber:
+    """
+    One live-stream client. Points are written from the Kafka consumer
+    thread and read from the event loop.
+
+    The queue is coalescing: it keeps only the latest point per series,
+    so a slow client gets fewer, newer updates instead of an ever-growing
+    backlog. At most `max_pending` distinct series wait at once; points
+    for further series are dropped until the client catches up.
+    """
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        hosts: FrozenSet[str] = frozenset(),
+        metrics: FrozenSet[str] = frozenset(),
+        max_pending: int = DEFAULT_MAX_PENDING,
+    ) -> None:
+        self.hosts = hosts
+        self.metrics = metrics
+        self.max_pending = max_pending
+        self.coalesced = 0
+        self.dropped = 0
+        self._loop = loop
+        self._event = asyncio.Event()
+        self._pending: Dict[SeriesKey, Point] = {}
+        self._lock = threading.Lock()
+
+    def wants(self, metric: str) -> bool:
+        """Metric filter; "diskio" also matches "diskio.read"."""
+        if not self.metrics:
+            return True
+        return metric in self.metrics or metric.split(".", 1)[0] in self.metrics
+
+    def offer(self, key: SeriesKey, point: Point) -> None:
+        with self._lock:
+            was_empty = not self._pending
+            if key in self._pending:
+                self.coalesced += 1
+            elif len(self._pending) >= self.max_pending:
+                self.dropped += 1
+                return
+            self._pending[key] = point
+        if was_empty:
+            # Wake the reader once per batch, not once per point
+            self._loop.call_soon_threadsafe(self._event.set)
+
+    async def next_batch(self, timeout: float) -> Dict[SeriesKey, Point]:
+        """Pending points (possibly empty after `timeout` seconds)."""
+        try:
+            await asyncio.wait_for(self._event.wait(), timeout)
+        except asyncio.TimeoutError:
+            return {}
+        self._event.clear()
+        with self._lock:
+            batch, self._pending = self._pending, {}
+        return batch
+
+
+class Broadcaster:
+    """
+    Fans ingested points out to live-stream subscribers.
+
+    Subscribers filtered by host are indexed by host, so a point is only
+    offered to clients that asked for its host (plus unfiltered ones).
+    The subscriber lists are copied on subscribe/unsubscribe, so
+    `publish` reads them without taking a lock and costs nothing when
+    nobody is listening.
+    """
+
+    def __init__(self) -> None:
+        self.logger = logging.getLogger(__name__)
+        self._lock = threading.Lock()
+        self._all: Tuple[Subscriber, ...] = ()
+        self._by_host: Dict[str, Tuple[Subscriber, ...]] = {}
+
+    def subscribe(
+        self,
+        hosts: Iterable[str] = (),
+        metrics: Iterable[str] = (),
+        max_pending: Optional[int] = None,
+    ) -> Subscriber:
+        """Must be called from the event loop that will read the subscriber."""
+        sub = Subscriber(
+            asyncio.get_running_loop(),
+            frozenset(hosts),
+            frozenset(metrics),
+            max_pending or DEFAULT_MAX_PENDING,
+        )
+        with self._lock:
+            if sub.hosts:
+                for host in sub.hosts:
+                    self._by_host[host] = self._by_host.get(host, ()) + (sub,)
+            else:
+                self._all = self._all + (sub,)
+        self.logger.info(f"[Stream] Subscriber added (hosts={sorted(sub.hosts)}, metrics={sorted(sub.metrics)})")
+        return sub
+
+    def unsubscribe(self, sub: Subscriber) -> None:
+        with self._lock:
+            if sub.hosts:
+                for host in sub.hosts:
+                    remaining = tuple(s for s in self._by_host.get(host, ()) if s is not sub)
+                    if remaining:
+                        self._by_host[host] = remaining
+                    else:
+                        self._by_host.pop(host, None)
+            else:
+                self._all = tuple(s for s in self._all if s is not sub)
+        self.logger.info(
+            f"[Stream] Subscriber removed (coalesced={sub.coalesced}, dropped={sub.dropped})"
+        )
+
+    def publish(self, host: str, metric: str, ts: int, value: float, unit: str) -> None:
+        subs = self._all
+        targeted = self._by_host.get(host)
+        if targeted:
+            subs = subs + targeted
+        if not subs:
+            return
+        key = (host, metric)
+        point = (ts, value, unit)
+        for sub in subs:
+            if sub.wants(metric):
+                sub.offer(key, point)
+
+    def publish_batch(self, batch: Dict[SeriesKey, Tuple[str, List[Tuple[int, float]]]]) -> None:
+        """Publish a datastore batch ({key: (unit, [(ts, value), ...])})."""
+        if not self._all and not self._by_host:
+            return
+        for (host, metric), (unit, points) in batch.items():
+            for ts, value in points:
+                self.publish(host, metric, ts, value, unit)
+
+    def __len__(self) -> int:
+        return len(self._all) + len({id(s) for subs in self._by_host.values() for s in subs})
+
+
+BROADCAST = Broadcaster()
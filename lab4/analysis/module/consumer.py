@@ -1,61 +1,197 @@
 import ast
+import json
 import logging
-from typing import Dict, Any
-from .datastore import HISTORY, UNITS
+import math
+from typing import Callable, Dict, Any, List, Optional, Tuple
+from .broadcast import BROADCAST
+from .datastore import STORE, SeriesKey, parse_ts
 import os
 from module.kafka_consumer import KafkaConsumerClient
 
 logger = logging.getLogger(__name__)
 
+# (host, metric) -> (unit, [(series name, value)]) of the last sample
+# received, repeated when an agent reports the metric as "unchanged" (deadband)
+_last_points: Dict[SeriesKey, Tuple[str, List[Tuple[str, float]]]] = {}
+
 
 def process_message(msg: Dict[str, Any]):
     """
     Handles analytics messages from monitor agent.
 
-    Structure:
+    Single sample (CommandStream):
     {
-      "timestamp": "...",
+      "timestamp_ns": 1700000000000000000,
       "hostname": "...",
       "metric": "diskio",
-      "value": "{'read': 0.0, 'write': 200.0}",
+      "value": {"read": 0.0, "write": 200.0},
       "unit": "kB/s"
     }
+
+    "value" is a number or a dict of numbers; older agents send the
+    stringified repr instead (see decode_legacy_value).
+
+    Batched tick (BatchStream):
+    {
+      "timestamp_ns": 1700000000000000000,
+      "hostname": "...",
+      "samples": [{"metric": "cpu", "value": 12.5, "unit": "%"}, ...]
+    }
+    Samples replayed from an agent spool carry their own "timestamp_ns".
+    Older agents send a "timestamp" string instead (see parse_ts).
+
+    A batch may also list "unchanged": ["memory", ...], metrics the agent
+    left out because they stayed within its deadband. They are
+    forward-filled: the last received value is stored again at the tick
+    time, so aggregates, rollups and charts see a regular series.
     """
+    process_batch([msg])
 
-    logger.info(msg)
 
-    ts = msg.get("timestamp")
+def process_batch(msgs: List[Dict[str, Any]]):
+    """
+    Handles the records of one Kafka poll: points are grouped by series
+    and written to the datastore under a single lock acquisition.
+    """
+    batch: Dict[SeriesKey, Tuple[str, List[Tuple[int, float]]]] = {}
+    debug = logger.isEnabledFor(logging.DEBUG)
+
+    for msg in msgs:
+        if not isinstance(msg, dict):
+            continue
+        if debug:
+            logger.debug(msg)
+        # A malformed record only loses itself, not the rest of the poll
+        try:
+            _add_record(msg, batch)
+        except Exception as e:
+            logger.error(f"Skipping malformed record from {msg.get('hostname')}: {e}")
+
+    if not batch:
+        return
+    STORE.append_batch(batch)
+    BROADCAST.publish_batch(batch)
+
+
+def _add_record(msg: Dict[str, Any], batch: Dict[SeriesKey, Tuple[str, List[Tuple[int, float]]]]) -> None:
+    """
+    Add the points of one record to `batch`. Everything is checked here,
+    before the batch is written: a record that raises adds nothing, and
+    a malformed sample is skipped on its own.
+    """
+    ts = _checked_ts(msg.get("timestamp_ns") or parse_ts(msg.get("timestamp")))
     host = msg.get("hostname", "unknown")
-    metric = msg.get("metric", "unknown")
-    raw_value = msg.get("value", 0)
-    unit = msg.get("unit", "")
+    if not isinstance(host, str):
+        raise ValueError(f"hostname {host!r:.50} is not a string")
+
+    samples = msg.get("samples")
+    if samples is None:
+        samples = (msg,)
+    for sample in samples:
+        try:
+            metric = sample.get("metric", "unknown")
+            unit = sample.get("unit", "")
+            if not isinstance(metric, str) or not isinstance(unit, str):
+                raise ValueError("metric and unit must be strings")
+            replayed = sample is not msg and ("timestamp_ns" in sample or "timestamp" in sample)
+            sample_ts = _checked_ts(_sample_ts(sample, ts)) if replayed else ts
+            points = _sample_points(metric, sample.get("value", 0))
+            if not all(math.isfinite(value) for _name, value in points):
+                raise ValueError("non-finite value")
+        except Exception as e:
+            logger.warning(f"Skipping malformed sample from {host}: {sample!r:.200} ({e})")
+            continue
+        if points and not replayed:
+            _last_points[(host, metric)] = (unit, points)
+        for name, value in points:
+            key = (host, name)
+            entry = batch.get(key)
+            if entry is None:
+                entry = batch[key] = (unit, [])
+            entry[1].append((sample_ts, value))
 
-    # ----- Try numeric metric -----
+    for metric in msg.get("unchanged", ()):
+        last = _last_points.get((host, metric))
+        if last is None:
+            # Not seen since this process started: repeat what the store
+            # (restored from a snapshot) holds. Unknown there too: cached as
+            # empty and filled again from the next keyframe
+            last = _last_points[(host, metric)] = STORE.latest_points(host, metric) or ("", [])
+        unit, points = last
+        for name, value in points:
+            key = (host, name)
+            entry = batch.get(key)
+            if entry is None:
+                entry = batch[key] = (unit, [])
+            entry[1].append((ts, value))
+
+
+def _checked_ts(ts: Any) -> int:
+    """`ts` if it is an epoch-ns int the store can hold, else ValueError."""
+    if not isinstance(ts, int) or isinstance(ts, bool) or not 0 < ts < 2**63:
+        raise ValueError(f"invalid timestamp {ts!r:.50}")
+    return ts
+
+
+def _sample_ts(sample: Dict[str, Any], default: int) -> int:
+    """Own timestamp of a spool-replayed sample, else the tick's."""
+    if "timestamp_ns" in sample:
+        return sample["timestamp_ns"]
+    if "timestamp" in sample:
+        return parse_ts(sample["timestamp"])
+    return default
+
+
+def _sample_points(metric: str, raw_value: Any) -> List[Tuple[str, float]]:
+    """[(series name, value)] for one sample; a dict value gives one series per key."""
+    # Typed payloads arrive as native JSON numbers / objects.
+    # Only old agents still send stringified Python reprs.
+    if isinstance(raw_value, str):
+        raw_value = decode_legacy_value(raw_value)
+        if raw_value is None:
+            return []
+
+    # ----- Numeric metric -----
+    if isinstance(raw_value, (int, float)) and not isinstance(raw_value, bool):
+        return [(metric, float(raw_value))]
+
+    # ----- Dict metric -----
+    if isinstance(raw_value, dict):
+        return [
+            (f"{metric}.{subkey}", float(subval))
+            for subkey, subval in raw_value.items()
+            if isinstance(subval, (int, float)) and not isinstance(subval, bool)
+        ]
+    return []
+
+
+def decode_legacy_value(raw_value: str) -> Any:
+    """
+    Compatibility decoder for string payloads from older agents:
+    "12.5" -> 12.5, "{'read': 0.0, 'write': 200.0}" -> dict.
+    Returns None for non-numeric payloads ("Error", "None", "alive", ...).
+    """
     try:
-        v = float(raw_value)
-        key = (host, metric)
-        HISTORY[key].append({"ts": ts, "value": v})
-        UNITS[key] = unit
-        return
-    except (ValueError, TypeError):
+        return float(raw_value)
+    except ValueError:
         pass
 
-    # ----- Try dict metric -----
-    if isinstance(raw_value, str) and raw_value.strip().startswith("{"):
+    text = raw_value.strip()
+    if not text.startswith("{"):
+        return None
+
+    # Plugin dicts only hold str keys and numbers, so swapping quotes is
+    # enough for json; literal_eval is the last resort.
+    try:
+        parsed = json.loads(text.replace("'", '"'))
+    except ValueError:
         try:
-            parsed = ast.literal_eval(raw_value)
-            if isinstance(parsed, dict):
-                for subkey, subval in parsed.items():
-                    try:
-                        v = float(subval)
-                    except:
-                        continue
-                    metric_name = f"{metric}.{subkey}"
-                    key = (host, metric_name)
-                    HISTORY[key].append({"ts": ts, "value": v})
-                    UNITS[key] = unit
+            parsed = ast.literal_eval(text)
         except Exception as e:
             logger.warning(f"Parse error: {raw_value} ({e})")
+            return None
+
+    return parsed if isinstance(parsed, dict) else None
 
 
 
@@ -63,11 +199,38 @@ def process_message(msg: Dict[str, Any]):
 logger = logging.getLogger(__name__)
 
 
-def start_kafka_consumer():
+def _drop_hosts(hosts, on_dropped: Optional[Callable[[List[SeriesKey]], None]] = None):
+    # Their partitions now belong to another consumer, which rebuilds their state
+    dropped = STORE.drop_hosts(hosts)
+    for key in [key for key in _last_points if key[0] in hosts]:
+        del _last_points[key]
+    logger.info(f"Dropped {len(dropped)} series of {len(hosts)} host(s) after rebalance")
+    if on_dropped is not None and dropped:
+        on_dropped(dropped)
+
+
+def start_kafka_consumer(
+    on_dropped: Optional[Callable[[List[SeriesKey]], None]] = None,
+    on_assigned: Optional[Callable[[], None]] = None,
+):
+    """
+    :param on_dropped: called with the keys of series dropped because their
+        partitions moved to another consumer (ingest workers forget them)
+    :param on_assigned: called after each partition assignment, once the
+        series of hosts this consumer does not own have been dropped
+    """
     import time
     brokers = os.environ.get("KAFKA_BROKERS", "localhost:9092")
     logger.info(f"Using Kafka brokers: {brokers}")
     
+    # KAFKA_BATCH_SIZE > 0: poll() batches with manual offset commits;
+    # 0 falls back to one callback per record with auto-commit
+    batch_size = int(os.environ.get("KAFKA_BATCH_SIZE", "500"))
+    # Records of a host share one partition as long as the server's
+    # KAFKA_KEY_FIELDS include hostname; otherwise a host is spread over
+    # partitions and must not be dropped when one of them moves
+    host_affinity = os.environ.get("KAFKA_HOST_AFFINITY", "1").lower() not in ("0", "false", "no")
+
     # Retry connecting to Kafka indefinitely (analysis should keep trying until Kafka is ready)
     retry_delay = 5
     attempt = 0
@@ -81,8 +244,14 @@ def start_kafka_consumer():
                 brokers=brokers,
                 group_id="analysis-group",
                 auto_offset_reset="earliest",
-                enable_auto_commit=True,
+                enable_auto_commit=batch_size <= 0,
+                on_hosts_lost=(lambda hosts: _drop_hosts(hosts, on_dropped)) if host_affinity else None,
+                on_assigned=on_assigned,
             )
+            if host_affinity:
+                # Series restored from a snapshot may belong to hosts whose
+                # partitions moved elsewhere while this process was down
+                consumer.claim_hosts({key[0] for key in STORE.keys()})
             logger.info("[Kafka] Consumer connected successfully!")
             break
         except Exception as e:
@@ -90,6 +259,9 @@ def start_kafka_consumer():
             time.sleep(retry_delay)
     
     try:
-        consumer.start_consuming(process_message)
+        if batch_size > 0:
+            consumer.start_consuming_batches(process_batch, max_records=batch_size)
+        else:
+            consumer.start_consuming(process_message)
     except KeyboardInterrupt:
         logger.info("Shutting down consumer...")
@@ -1,11 +1,967 @@
 # analysis/module/datastore.py
-from collections import defaultdict, deque
-from typing import Any, Dict, Deque, Tuple
+import logging
+import mmap
+import os
+import struct
+import threading
+import time
+from array import array
+from bisect import bisect_left
+from collections import deque
+from typing import Any, Collection, Dict, List, Optional, Tuple, Union
 
-# (hostname, metric) -> deque
-HISTORY: Dict[Tuple[str, str], Deque[Dict[str, Any]]] = defaultdict(
-    lambda: deque(maxlen=15)
-)
+logger = logging.getLogger(__name__)
+
+SeriesKey = Tuple[str, str]  # (hostname, metric)
+
+# Default number of points kept per series (SERIES_RETENTION overrides it)
+DEFAULT_RETENTION = 3600
+# Number of lock stripes in SeriesStore (STORE_SHARDS overrides it)
+DEFAULT_SHARDS = 16
+# Rolling aggregates cover the last AGGREGATE_WINDOW points
+AGGREGATE_WINDOW = int(os.environ.get("AGGREGATE_WINDOW", "15"))
+EWMA_ALPHA = float(os.environ.get("EWMA_ALPHA", "0.3"))
+
+
+def parse_tiers(spec: str) -> Tuple[Tuple[int, int], ...]:
+    """"60:1440,300:2016" -> ((60, 1440), (300, 2016)), finest first."""
+    tiers = []
+    for part in spec.split(","):
+        if ":" in part:
+            step, capacity = part.split(":", 1)
+            tiers.append((int(step), int(capacity)))
+    return tuple(sorted(tiers))
+
+
+# Rollup tiers as step seconds:bucket count. Default: 1m for a day,
+# 5m for a week, 1h for 30 days (~170 kB per series)
+ROLLUP_TIERS = parse_tiers(os.environ.get("ROLLUP_TIERS", "60:1440,300:2016,3600:720"))
+
+# Timestamps are Unix epoch nanoseconds (int64) throughout the store
+NS_PER_SECOND = 1_000_000_000
+
+_SNAPSHOT_MAGIC_V1 = b"MSNAP001"  # float64 seconds, no tiers
+_SNAPSHOT_MAGIC_V2 = b"MSNAP002"  # float64 seconds
+_SNAPSHOT_MAGIC = b"MSNAP003"
+_SNAPSHOT_FILE = "series.snap"
+_U8 = struct.Struct("<B")
+_U16 = struct.Struct("<H")
+_U32 = struct.Struct("<I")
+_TIER_HEADER_V2 = struct.Struct("<IId")  # step, capacity, newest bucket start (seconds)
+_TIER_HEADER = struct.Struct("<IIq")  # step, capacity, newest bucket start (ns)
+
+
+class RollingStats:
+    """
+    Aggregates over the last `window` points, updated in O(1) amortised
+    per append: sum / sum of squares, min and max through monotonic
+    deques, plus an EWMA over the whole series.
+    """
+
+    __slots__ = ("window", "alpha", "_window", "_min", "_max", "_n", "sum", "sumsq", "ewma")
+
+    def __init__(self, window: int = AGGREGATE_WINDOW, alpha: float = EWMA_ALPHA) -> None:
+        self.window = max(1, window)
+        self.alpha = alpha
+        self._window: deque = deque()
+        self._min: deque = deque()  # (index, value), values increasing
+        self._max: deque = deque()  # (index, value), values decreasing
+        self._n = 0
+        self.sum = 0.0
+        self.sumsq = 0.0
+        self.ewma: Optional[float] = None
+
+    def push(self, value: float) -> None:
+        idx = self._n
+        self._n += 1
+
+        self._window.append(value)
+        self.sum += value
+        self.sumsq += value * value
+        if len(self._window) > self.window:
+            old = self._window.popleft()
+            self.sum -= old
+            self.sumsq -= old * old
+
+        while self._min and self._min[-1][1] >= value:
+            self._min.pop()
+        self._min.append((idx, value))
+        while self._max and self._max[-1][1] <= value:
+            self._max.pop()
+        self._max.append((idx, value))
+        expired = idx - self.window
+        if self._min[0][0] <= expired:
+            self._min.popleft()
+        if self._max[0][0] <= expired:
+            self._max.popleft()
+
+        self.ewma = value if self.ewma is None else self.alpha * value + (1 - self.alpha) * self.ewma
+
+    def summary(self) -> Dict[str, Any]:
+        count = len(self._window)
+        if not count:
+            return {"count": 0}
+        avg = self.sum / count
+        # Running sums can drift slightly below zero for constant series
+        variance = max(0.0, self.sumsq / count - avg * avg)
+        return {
+            "count": count,
+            "sum": self.sum,
+            "avg": avg,
+            "min": self._min[0][1],
+            "max": self._max[0][1],
+            "variance": variance,
+            "ewma": self.ewma,
+        }
+
+
+class Rollup:
+    """
+    One downsampling tier of a series: min/max/sum/count per `step`-second
+    bucket for the last `capacity` buckets. Bucket starts are epoch ns.
+
+    Slots are indexed by bucket time (start // step_ns % capacity) rather
+    than by arrival order, so late points (e.g. replayed from an agent
+    spool) land in their own bucket, and stale slots are recognised by
+    their start time. Columns are preallocated on creation.
+    """
+
+    __slots__ = (
+        "step", "step_ns", "capacity", "newest", "head", "starts", "mins", "maxs", "sums", "counts",
+    )
+
+    def __init__(self, step: int, capacity: int) -> None:
+        self.step = step
+        self.step_ns = step * NS_PER_SECOND
+        self.capacity = capacity
+        self.newest = 0  # start of the newest bucket
+        self.head = 0  # slot of the newest bucket
+        zeros = bytes(8 * capacity)
+        self.starts = array("q", zeros)  # 0 = empty slot
+        self.mins = array("d", zeros)
+        self.maxs = array("d", zeros)
+        self.sums = array("d", zeros)
+        self.counts = array("q", zeros)
+
+    def add(self, ts: int, value: float) -> None:
+        start = ts - ts % self.step_ns
+        if start != self.newest:
+            self.merge(start, value, value, value, 1)
+            return
+        # Fast path: most points land in the current bucket
+        idx = self.head
+        if value < self.mins[idx]:
+            self.mins[idx] = value
+        if value > self.maxs[idx]:
+            self.maxs[idx] = value
+        self.sums[idx] += value
+        self.counts[idx] += 1
+
+    def merge(
+        self, start: int, vmin: float, vmax: float, vsum: float, count: int, replace: bool = False
+    ) -> None:
+        """Fold a (partial) bucket into the tier; `replace` overwrites it instead."""
+        if start <= self.newest - self.step_ns * self.capacity:
+            return  # older than the tier's retention
+        idx = start // self.step_ns % self.capacity
+        if replace or self.starts[idx] != start:
+            self.starts[idx] = start
+            self.mins[idx] = vmin
+            self.maxs[idx] = vmax
+            self.sums[idx] = vsum
+            self.counts[idx] = count
+        else:
+            if vmin < self.mins[idx]:
+                self.mins[idx] = vmin
+            if vmax > self.maxs[idx]:
+                self.maxs[idx] = vmax
+            self.sums[idx] += vsum
+            self.counts[idx] += count
+        if start > self.newest:
+            self.newest = start
+            self.head = idx
+
+    def buckets(self, since: int) -> Dict[str, List[Union[int, float]]]:
+        """Non-empty buckets starting at or after `since`, oldest first."""
+        out: Dict[str, List[Union[int, float]]] = {"ts": [], "min": [], "max": [], "avg": [], "count": []}
+        if not self.newest:
+            return out
+        step = self.step_ns
+        oldest = self.newest - step * (self.capacity - 1)
+        start = max(oldest, -(-since // step) * step)
+        while start <= self.newest:
+            idx = start // step % self.capacity
+            if self.starts[idx] == start:
+                count = self.counts[idx]
+                out["ts"].append(start)
+                out["min"].append(self.mins[idx])
+                out["max"].append(self.maxs[idx])
+                out["avg"].append(self.sums[idx] / count)
+                out["count"].append(count)
+            start += step
+        return out
+
+    def slots_since(self, since: int) -> List[Tuple[int, float, float, float, int]]:
+        """Raw (start, min, max, sum, count) of the buckets touched at or after `since`."""
+        if not self.newest:
+            return []
+        step = self.step_ns
+        start = max(self.newest - step * (self.capacity - 1), since - since % step)
+        out = []
+        while start <= self.newest:
+            idx = start // step % self.capacity
+            if self.starts[idx] == start:
+                out.append((start, self.mins[idx], self.maxs[idx], self.sums[idx], self.counts[idx]))
+            start += step
+        return out
+
+    def to_bytes(self) -> List[bytes]:
+        return [
+            _TIER_HEADER.pack(self.step, self.capacity, self.newest),
+            self.starts.tobytes(),
+            self.mins.tobytes(),
+            self.maxs.tobytes(),
+            self.sums.tobytes(),
+            self.counts.tobytes(),
+        ]
+
+
+class FrozenStats:
+    """Stand-in for RollingStats on a replica: holds a summary computed elsewhere."""
+
+    __slots__ = ("window", "_summary")
+
+    def __init__(self, summary: Dict[str, Any]) -> None:
+        self.window = AGGREGATE_WINDOW
+        self._summary = summary
+
+    def push(self, value: float) -> None:
+        pass
+
+    def summary(self) -> Dict[str, Any]:
+        return self._summary
+
+
+class Series:
+    """
+    One (host, metric) series: columnar ring buffers of int64 timestamps
+    (epoch ns), values and the store sequence number of each point.
+    The arrays grow until `capacity` points and then wrap around,
+    overwriting the oldest point. `version` is bumped on every append so
+    readers can tell which series changed. Each point is also folded into
+    the series' rollup tiers.
+
+    Points normally arrive in time order, so the ring is sorted by time
+    and `points_since` can binary-search it. A point older than the newest
+    one (a spool replay) records its sequence number in `late_seq`; the
+    ring is known to be sorted again once that point is the oldest left.
+    """
+
+    __slots__ = (
+        "unit", "capacity", "ts", "values", "seqs", "start", "stats", "version", "rollups", "newest",
+        "restored", "late_seq",
+    )
+
+    def __init__(
+        self, capacity: int, unit: str = "", tiers: Tuple[Tuple[int, int], ...] = ROLLUP_TIERS
+    ) -> None:
+        self.unit = unit
+        self.capacity = capacity
+        self.ts = array("q")
+        self.values = array("d")
+        self.seqs = array("q")
+        self.start = 0  # index of the oldest point once the ring is full
+        self.stats = RollingStats()
+        self.version = 0
+        self.rollups = [Rollup(step, capacity) for step, capacity in tiers]
+        self.newest = 0  # newest timestamp seen (points can arrive late)
+        self.restored = False  # loaded from a snapshot
+        self.late_seq = 0  # sequence number of the last out-of-order point
+
+    def __len__(self) -> int:
+        return len(self.values)
+
+    @property
+    def last_seq(self) -> int:
+        return self.seqs[self.start - 1] if self.seqs else 0
+
+    @property
+    def in_order(self) -> bool:
+        """True when the ring is sorted by timestamp."""
+        return not self.seqs or self.seqs[self.start] >= self.late_seq
+
+    def append(self, ts: int, value: float, seq: int = 0) -> None:
+        self.stats.push(value)
+        self.version += 1
+        for rollup in self.rollups:
+            rollup.add(ts, value)
+        self._put(ts, value, seq)
+
+    def extend(self, points: List[Tuple[int, float]], seq: int) -> int:
+        """
+        Append points in order, numbering them from `seq` + 1; same result
+        as calling append() per point with hot lookups bound once.
+        :return: sequence number of the last point
+        """
+        push = self.stats.push
+        adds = [rollup.add for rollup in self.rollups]
+        put = self._put
+        for ts, value in points:
+            seq += 1
+            push(value)
+            for add in adds:
+                add(ts, value)
+            put(ts, value, seq)
+        self.version += len(points)
+        return seq
+
+    def replicate(self, ts: array, values: array, seq: int) -> int:
+        """
+        Append points into the rings only; aggregates and rollups come
+        from the owning worker (see SeriesStore.apply_changes).
+        :return: sequence number of the last point
+        """
+        put = self._put
+        for t, value in zip(ts, values):
+            seq += 1
+            put(t, value, seq)
+        self.version += len(values)
+        return seq
+
+    def _put(self, ts: int, value: float, seq: int) -> None:
+        """Write one point into the rings (over the oldest once full) and track ordering."""
+        if ts >= self.newest:
+            self.newest = ts
+        else:
+            self.late_seq = seq
+        if len(self.values) < self.capacity:
+            self.ts.append(ts)
+            self.values.append(value)
+            self.seqs.append(seq)
+            return
+        self.ts[self.start] = ts
+        self.values[self.start] = value
+        self.seqs[self.start] = seq
+        self.start = (self.start + 1) % self.capacity
+
+    def tail(self, n: Optional[int] = None) -> Tuple[array, array]:
+        """Last `n` points (all when None) in chronological order; O(n)."""
+        size = len(self.values)
+        if n is None or n > size:
+            n = size
+        return self._last(self.ts, n), self._last(self.values, n)
+
+    def window(self, n: int, skip: int = 0) -> Tuple[array, array]:
+        """Last `n` points before the newest `skip` ones, in chronological order."""
+        if not skip:
+            return self.tail(n)
+        ts, values = self.tail(n + skip)
+        return ts[:-skip], values[:-skip]
+
+    def covers(self, since: int) -> bool:
+        """True when the ring still holds every point from `since` on (nothing older was overwritten)."""
+        return len(self.values) < self.capacity or self.ts[self.start] <= since
+
+    def points_since(self, since: int) -> Tuple[array, array]:
+        """
+        Points with a timestamp at or after `since`, in time order. A sorted
+        ring is binary-searched (O(log n) plus the copy); otherwise the
+        points are filtered and sorted.
+        """
+        ts, values = self.ts, self.values
+        if not self.in_order:
+            points = sorted((p for p in zip(ts, values) if p[0] >= since), key=lambda p: p[0])
+            return array("q", [t for t, _ in points]), array("d", [v for _, v in points])
+        start, size = self.start, len(ts)
+        if start == 0:
+            i = bisect_left(ts, since)
+            return ts[i:], values[i:]
+        # Wrapped ring: ts[start:] holds the older points, ts[:start] the newer ones
+        i = bisect_left(ts, since, start, size)
+        if i < size:
+            return ts[i:] + ts[:start], values[i:] + values[:start]
+        i = bisect_left(ts, since, 0, start)
+        return ts[i:start], values[i:start]
+
+    def count_since(self, seq: int) -> int:
+        """Number of newest points whose sequence number is greater than `seq`."""
+        size = len(self.seqs)
+        count = 0
+        idx = self.start - 1
+        while count < size and self.seqs[idx] > seq:
+            count += 1
+            idx -= 1
+        return count
+
+    def latest(self) -> Optional[float]:
+        if not self.values:
+            return None
+        return self.values[self.start - 1]
+
+    def _last(self, column: array, n: int) -> array:
+        if n <= 0:
+            return array(column.typecode)
+        if self.start == 0:
+            return column[len(column) - n:]
+        if n <= self.start:
+            return column[self.start - n:self.start]
+        return column[len(column) - (n - self.start):] + column[:self.start]
 
-# (hostname, metric) -> unit string
-UNITS: Dict[Tuple[str, str], str] = {}
+
+def parse_ts(ts: Union[str, float, int, None]) -> int:
+    """
+    Legacy agent timestamp -> epoch ns. Newer agents send "timestamp_ns"
+    and never get here; older ones send "%Y-%m-%d %H:%M:%S" local time
+    (one tick shares one string, so the last result is cached). Numbers
+    are epoch seconds.
+    """
+    if isinstance(ts, (int, float)):
+        return int(ts * NS_PER_SECOND)
+    if not ts:
+        return time.time_ns()
+    if ts == _ts_cache[0]:
+        return _ts_cache[1]
+    try:
+        value = int(time.mktime(time.strptime(ts, "%Y-%m-%d %H:%M:%S"))) * NS_PER_SECOND
+    except ValueError:
+        value = time.time_ns()
+    _ts_cache[:] = [ts, value]
+    return value
+
+
+_ts_cache: list = [None, 0]
+
+
+class _Shard:
+    __slots__ = ("lock", "series")
+
+    def __init__(self) -> None:
+        self.lock = threading.Lock()
+        self.series: Dict[SeriesKey, Series] = {}
+
+
+class SeriesStore:
+    """
+    In-memory store of all series, lock-striped: series are spread over
+    `shards` dicts by key hash, each with its own lock, so ingest threads
+    writing different series do not contend and readers hold one shard
+    lock at a time.
+
+    Readers stay consistent through the global sequence number: a point
+    gets its number while its shard lock is held, so every point numbered
+    up to a cursor read *before* a scan is visible to that scan. `changed`
+    and `since` leave out points numbered after their cursor; those come
+    with the next call.
+
+    `save_snapshot` writes every series into a single memory-mapped segment
+    file; `load_snapshot` maps it back at startup, which is much faster
+    than rebuilding the history from Kafka.
+    """
+
+    def __init__(
+        self,
+        retention: int = DEFAULT_RETENTION,
+        tiers: Tuple[Tuple[int, int], ...] = ROLLUP_TIERS,
+        shards: int = DEFAULT_SHARDS,
+    ) -> None:
+        self.retention = retention
+        self.tiers = tiers
+        self._shards = [_Shard() for _ in range(max(1, shards))]
+        # Global sequence number of the last appended point. It starts at
+        # the boot time in microseconds, so cursors handed out by an
+        # earlier process are always older than anything in this one.
+        self._seq = int(time.time() * 1_000_000)
+        self._seq_lock = threading.Lock()
+        self.boot_seq = self._seq
+        # Bumped whenever series are removed, so caches keyed by series
+        # versions (e.g. /api/metrics) know to forget keys
+        self.generation = 0
+
+    @property
+    def seq(self) -> int:
+        return self._seq
+
+    def _shard(self, key: SeriesKey) -> _Shard:
+        return self._shards[hash(key) % len(self._shards)]
+
+    def _reserve(self, count: int) -> int:
+        """Reserve `count` sequence numbers (caller holds a shard lock). :return: the one before them"""
+        with self._seq_lock:
+            first = self._seq
+            self._seq += count
+            return first
+
+    def _get_or_create(self, shard: _Shard, key: SeriesKey, unit: str) -> Series:
+        series = shard.series.get(key)
+        if series is None:
+            series = shard.series[key] = Series(self.retention, unit, self.tiers)
+        series.unit = unit
+        return series
+
+    def _by_shard(self, items):
+        """Group (key, ...) items by shard."""
+        grouped: Dict[int, list] = {}
+        for item in items:
+            grouped.setdefault(hash(item[0]) % len(self._shards), []).append(item)
+        return [(self._shards[i], group) for i, group in grouped.items()]
+
+    def append(self, host: str, metric: str, ts: int, value: float, unit: str = "") -> None:
+        key = (host, metric)
+        shard = self._shard(key)
+        with shard.lock:
+            series = self._get_or_create(shard, key, unit)
+            series.append(ts, value, self._reserve(1) + 1)
+
+    def append_batch(self, batch: Dict[SeriesKey, Tuple[str, List[Tuple[int, float]]]]) -> int:
+        """
+        Append many points with one lock acquisition per shard.
+        :param batch: {(host, metric): (unit, [(ts ns, value), ...])}
+        :return: number of points appended
+        """
+        appended = 0
+        for shard, items in self._by_shard(batch.items()):
+            with shard.lock:
+                seq = self._reserve(sum(len(points) for _key, (_unit, points) in items))
+                for key, (unit, points) in items:
+                    seq = self._get_or_create(shard, key, unit).extend(points, seq)
+                    appended += len(points)
+        return appended
+
+    def tails(self, n: Optional[int] = None) -> List[Tuple[SeriesKey, str, array, array]]:
+        """[(key, unit, timestamps, values)] with the last `n` points of every series."""
+        out = []
+        for shard in self._shards:
+            with shard.lock:
+                out.extend(
+                    (key, series.unit, *series.tail(n))
+                    for key, series in shard.series.items()
+                    if len(series)
+                )
+        return out
+
+    def latest_points(self, host: str, metric: str) -> Optional[Tuple[str, List[Tuple[str, float]]]]:
+        """
+        Unit and last stored value of `metric` of `host` as [(series name, value)]:
+        the series itself, or every `metric.<key>` series of a dict metric.
+        None when the store has no point of it.
+        """
+        key = (host, metric)
+        shard = self._shard(key)
+        with shard.lock:
+            series = shard.series.get(key)
+            if series is not None and len(series):
+                return series.unit, [(metric, series.latest())]
+        prefix = f"{metric}."
+        unit, points = "", []
+        for shard in self._shards:
+            with shard.lock:
+                for (series_host, name), series in shard.series.items():
+                    if series_host == host and name.startswith(prefix) and len(series):
+                        unit = series.unit
+                        points.append((name, series.latest()))
+        return (unit, sorted(points)) if points else None
+
+    def changed(
+        self, seen: Dict[SeriesKey, int], n: int
+    ) -> Tuple[int, List[Tuple[SeriesKey, int, str, array, array, Dict[str, Any]]]]:
+        """
+        Series whose version (as of the returned cursor) differs from
+        `seen[key]`: (cursor, [(key, version, unit, timestamps, values, aggregates)])
+        with the last n points of each.
+        Unchanged series cost one dict lookup each.
+        """
+        cursor = self._seq
+        changes = []
+        for shard in self._shards:
+            with shard.lock:
+                for key, series in shard.series.items():
+                    newer = series.count_since(cursor) if series.last_seq > cursor else 0
+                    # version counts points, so this is the version as of `cursor`
+                    version = series.version - newer
+                    if seen.get(key) == version or len(series) <= newer:
+                        continue
+                    ts, values = series.window(n, newer)
+                    changes.append((key, version, series.unit, ts, values, series.stats.summary()))
+        return cursor, changes
+
+    def since(
+        self, cursor: int, n: int
+    ) -> Tuple[int, List[Tuple[SeriesKey, str, array, array, Dict[str, Any]]]]:
+        """
+        Points appended after `cursor` (up to the returned cursor), at most
+        the last `n` per series: (new cursor, [(key, unit, timestamps,
+        values, aggregates)]). Series without new points are skipped in O(1).
+        """
+        upto = self._seq
+        changes = []
+        for shard in self._shards:
+            with shard.lock:
+                for key, series in shard.series.items():
+                    if series.last_seq <= cursor:
+                        continue
+                    newer = series.count_since(upto) if series.last_seq > upto else 0
+                    count = series.count_since(cursor) - newer
+                    if count <= 0:
+                        continue
+                    ts, values = series.window(min(n, count), newer)
+                    changes.append((key, series.unit, ts, values, series.stats.summary()))
+        return upto, changes
+
+    def history(self, key: SeriesKey, span: float, points: int) -> Optional[Dict[str, Any]]:
+        """
+        The last `span` seconds of a series (ending at its newest point).
+        Only sources whose retention covers the span are considered: the
+        coarsest rollup tier that still yields at least `points` buckets,
+        else raw points, else the finest tier that covers the span. When
+        nothing covers it, the tier with the longest retention is used.
+        The cost depends on `points`, not on `span`.
+        Returns {"step", "unit", "ts", "min", "max", "avg", "count"} with
+        "ts" in epoch ns; step 0 means raw points. None when the series is
+        unknown.
+        """
+        shard = self._shard(key)
+        with shard.lock:
+            series = shard.series.get(key)
+            if series is None or not len(series):
+                return None
+            since = series.newest - int(span * NS_PER_SECOND)
+
+            covering = [r for r in series.rollups if r.step * r.capacity >= span]
+            fine_enough = [r for r in covering if span / r.step >= points]
+            rollup = None
+            if fine_enough:
+                rollup = max(fine_enough, key=lambda r: r.step)
+            elif not series.covers(since):
+                if covering:
+                    rollup = min(covering, key=lambda r: r.step)
+                elif series.rollups:
+                    rollup = max(series.rollups, key=lambda r: r.step * r.capacity)
+            if rollup is not None:
+                out = rollup.buckets(since)
+                out.update(step=rollup.step, unit=series.unit)
+                return out
+
+            ts, values = series.points_since(since)
+        vals = values.tolist()
+        return {
+            "step": 0,
+            "unit": series.unit,
+            "ts": ts.tolist(),
+            "min": vals,
+            "max": vals,
+            "avg": vals,
+            "count": [1] * len(vals),
+        }
+
+    # ---- replication (scale-out ingest, see module/workers.py) ----
+
+    def export_changes(
+        self, shipped: Dict[SeriesKey, int], resync: Collection[SeriesKey] = ()
+    ) -> List[Tuple[Any, ...]]:
+        """
+        Everything a replica needs to catch up with series whose version
+        differs from `shipped[key]`:
+        [(key, unit, version, mode, ts bytes, values bytes, aggregates,
+          [(step, [(start, min, max, sum, count), ...]), ...])]
+
+        Only new points and the rollup buckets they touched are included
+        (mode "delta"). The first time a series restored from a snapshot
+        is shipped it carries the whole ring with mode "merge": the
+        snapshot may be older than the replica, so only points newer than
+        the replica's are taken. A series this worker started from scratch
+        (e.g. a host that moved here in a rebalance) extends the replica's
+        copy. Series in `resync` (the replica failed to apply them) carry
+        the whole ring with mode "full" and replace the replica's copy.
+        """
+        changes = []
+        for shard in self._shards:
+            with shard.lock:
+                for key, series in shard.series.items():
+                    last = None if key in resync else shipped.get(key)
+                    if last is not None and last > series.version:
+                        # dropped and recreated since it was shipped: a new series
+                        last = None
+                    if last == series.version or not len(series):
+                        continue
+                    if key in resync:
+                        mode = "full"
+                    elif last is None and series.restored:
+                        mode = "merge"
+                    else:
+                        mode = "delta"
+                    ts, values = series.tail(None if last is None else series.version - last)
+                    if not len(ts):
+                        continue
+                    oldest = min(ts)
+                    changes.append((
+                        key,
+                        series.unit,
+                        series.version,
+                        mode,
+                        ts.tobytes(),
+                        values.tobytes(),
+                        series.stats.summary(),
+                        [(rollup.step, rollup.slots_since(oldest)) for rollup in series.rollups],
+                    ))
+        return changes
+
+    def apply_changes(
+        self, changes: List[Tuple[Any, ...]]
+    ) -> Dict[SeriesKey, Tuple[str, List[Tuple[int, float]]]]:
+        """
+        Apply export_changes() output from a worker to this (replica) store.
+        :return: the new points as {key: (unit, [(ts, value), ...])} for BROADCAST
+        """
+        new_points: Dict[SeriesKey, Tuple[str, List[Tuple[int, float]]]] = {}
+        for shard, items in self._by_shard(changes):
+            with shard.lock:
+                decoded = []
+                for key, unit, _version, mode, ts_bytes, values_bytes, summary, tiers in items:
+                    ts, values = array("q"), array("d")
+                    ts.frombytes(ts_bytes)
+                    values.frombytes(values_bytes)
+                    decoded.append((key, unit, mode, ts, values, summary, tiers))
+                seq = self._reserve(sum(len(item[4]) for item in decoded))
+
+                for key, unit, mode, ts, values, summary, tiers in decoded:
+                    series = shard.series.get(key)
+                    if series is not None and mode == "merge":
+                        # Restored on the worker from a snapshot older than
+                        # this copy: keep ours, take only what is newer
+                        newest = series.newest
+                        kept = [i for i, t in enumerate(ts) if t > newest]
+                        ts = array("q", [ts[i] for i in kept])
+                        values = array("d", [values[i] for i in kept])
+                        for rollup in series.rollups:
+                            for t, value in zip(ts, values):
+                                rollup.add(t, value)
+                        tiers = []
+                    elif series is None or mode == "full":
+                        replaced = Series(self.retention, unit, self.tiers)
+                        if series is not None:
+                            replaced.version = series.version  # keep versions moving forward
+                        series = shard.series[key] = replaced
+                    series.unit = unit
+                    seq = series.replicate(ts, values, seq)
+                    series.stats = FrozenStats(summary)
+
+                    by_step = {rollup.step: rollup for rollup in series.rollups}
+                    for step, slots in tiers:
+                        rollup = by_step.get(step)
+                        if rollup is None:
+                            continue
+                        for slot in slots:
+                            rollup.merge(*slot, replace=True)
+
+                    new_points[key] = (unit, list(zip(ts, values)))
+        return new_points
+
+    def drop_hosts(self, hosts) -> List[SeriesKey]:
+        """Remove every series of `hosts`. :return: keys of the removed series"""
+        hosts = set(hosts)
+        dropped: List[SeriesKey] = []
+        for shard in self._shards:
+            with shard.lock:
+                for key in [key for key in shard.series if key[0] in hosts]:
+                    del shard.series[key]
+                    dropped.append(key)
+        if dropped:
+            with self._seq_lock:
+                self.generation += 1
+        return dropped
+
+    def keys(self) -> List[SeriesKey]:
+        out: List[SeriesKey] = []
+        for shard in self._shards:
+            with shard.lock:
+                out.extend(shard.series)
+        return out
+
+    def __len__(self) -> int:
+        return sum(len(shard.series) for shard in self._shards)
+
+    # ---- snapshots ----
+
+    def save_snapshot(self, directory: str) -> str:
+        """
+        Write all series to `<directory>/series.snap` (via a temp file and
+        rename, so a crash never leaves a half-written snapshot).
+
+        Layout: magic, u32 series count, then per series
+        u16+host, u16+metric, u16+unit, u32 n, n int64 ts (epoch ns),
+        n float64 values, u8 tier count and per tier: u32 step, u32 capacity,
+        int64 newest, capacity int64 starts, float64 mins/maxs/sums and
+        int64 counts. Older formats (float64 epoch seconds) still load.
+        """
+        items = []
+        for shard in self._shards:
+            with shard.lock:
+                items.extend(
+                    (key, series.unit, *series.tail(), [r.to_bytes() for r in series.rollups])
+                    for key, series in shard.series.items()
+                )
+
+        chunks: List[bytes] = [_SNAPSHOT_MAGIC, _U32.pack(len(items))]
+        for (host, metric), unit, ts, values, rollups in items:
+            for text in (host, metric, unit):
+                raw = text.encode("utf-8")
+                chunks.append(_U16.pack(len(raw)))
+                chunks.append(raw)
+            chunks.append(_U32.pack(len(values)))
+            chunks.append(ts.tobytes())
+            chunks.append(values.tobytes())
+            chunks.append(_U8.pack(len(rollups)))
+            for tier in rollups:
+                chunks.extend(tier)
+        size = sum(len(c) for c in chunks)
+
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, _SNAPSHOT_FILE)
+        tmp = path + ".tmp"
+        with open(tmp, "w+b") as f:
+            f.truncate(size)
+            with mmap.mmap(f.fileno(), size) as mm:
+                offset = 0
+                for chunk in chunks:
+                    mm[offset:offset + len(chunk)] = chunk
+                    offset += len(chunk)
+                mm.flush()
+        os.replace(tmp, path)
+        return path
+
+    def load_snapshot(self, directory: str) -> int:
+        """Load `<directory>/series.snap` if present. :return: number of series loaded"""
+        path = os.path.join(directory, _SNAPSHOT_FILE)
+        if not os.path.exists(path) or os.path.getsize(path) < len(_SNAPSHOT_MAGIC) + _U32.size:
+            return 0
+
+        loaded: Dict[SeriesKey, Series] = {}
+        with open(path, "rb") as f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mm:
+            view = memoryview(mm)
+            try:
+                magic = bytes(view[:len(_SNAPSHOT_MAGIC)])
+                if magic not in (_SNAPSHOT_MAGIC, _SNAPSHOT_MAGIC_V2, _SNAPSHOT_MAGIC_V1):
+                    logger.warning(f"[SeriesStore] {path} is not a snapshot, ignoring it")
+                    return 0
+                offset = len(_SNAPSHOT_MAGIC)
+                (count,) = _U32.unpack_from(view, offset)
+                offset += _U32.size
+
+                for _ in range(count):
+                    texts = []
+                    for _field in range(3):
+                        (length,) = _U16.unpack_from(view, offset)
+                        offset += _U16.size
+                        texts.append(bytes(view[offset:offset + length]).decode("utf-8"))
+                        offset += length
+                    host, metric, unit = texts
+                    (n,) = _U32.unpack_from(view, offset)
+                    offset += _U32.size
+
+                    series = Series(self.retention, unit, self.tiers)
+                    if magic == _SNAPSHOT_MAGIC:
+                        series.ts.frombytes(view[offset:offset + 8 * n])
+                    else:
+                        seconds = array("d")
+                        seconds.frombytes(view[offset:offset + 8 * n])
+                        series.ts.extend(int(t * NS_PER_SECOND) for t in seconds)
+                    offset += 8 * n
+                    series.values.frombytes(view[offset:offset + 8 * n])
+                    offset += 8 * n
+                    restored = set()
+                    if magic != _SNAPSHOT_MAGIC_V1:
+                        offset, restored = self._load_rollups(view, offset, series, magic == _SNAPSHOT_MAGIC)
+                    if any(b < a for a, b in zip(series.ts, series.ts[1:])):
+                        # Older stores kept late points in arrival order
+                        points = sorted(zip(series.ts, series.values), key=lambda p: p[0])
+                        series.ts = array("q", [t for t, _ in points])
+                        series.values = array("d", [v for _, v in points])
+                    for rollup in series.rollups:
+                        # Tiers missing from the snapshot are rebuilt from raw points
+                        if rollup.step not in restored:
+                            for t, value in zip(series.ts, series.values):
+                                rollup.add(t, value)
+                    if n > self.retention:
+                        # Retention was lowered since the snapshot was taken
+                        del series.ts[:n - self.retention]
+                        del series.values[:n - self.retention]
+                    series.newest = series.ts[-1] if series.ts else 0
+                    series.restored = True
+                    for value in series.values[-series.stats.window:]:
+                        series.stats.push(value)
+                    series.version = len(series.values)
+                    series.seqs.extend([self._seq] * len(series.values))
+                    loaded[(host, metric)] = series
+            finally:
+                view.release()
+
+        for shard, items in self._by_shard(loaded.items()):
+            with shard.lock:
+                for key, series in items:
+                    # Points ingested since startup win over the snapshot
+                    shard.series.setdefault(key, series)
+        return count
+
+    @staticmethod
+    def _load_rollups(view: memoryview, offset: int, series: Series, ns: bool) -> Tuple[int, set]:
+        """
+        Read the tiers of one series into `series.rollups` (matched by step).
+        `ns` is False for MSNAP002, whose bucket starts are float64 seconds.
+        """
+        by_step = {rollup.step: rollup for rollup in series.rollups}
+        restored = set()
+        header = _TIER_HEADER if ns else _TIER_HEADER_V2
+        (tier_count,) = _U8.unpack_from(view, offset)
+        offset += _U8.size
+        for _ in range(tier_count):
+            step, capacity, newest = header.unpack_from(view, offset)
+            offset += header.size
+            columns = []
+            for typecode in ("q" if ns else "d") + "dddq":
+                column = array(typecode)
+                column.frombytes(view[offset:offset + 8 * capacity])
+                offset += 8 * capacity
+                columns.append(column)
+            rollup = by_step.get(step)
+            if rollup is None:
+                continue  # tier no longer configured
+            if not ns:
+                columns[0] = array("q", [int(start) * NS_PER_SECOND for start in columns[0]])
+                newest = int(newest) * NS_PER_SECOND
+            if rollup.capacity == capacity:
+                rollup.starts, rollup.mins, rollup.maxs, rollup.sums, rollup.counts = columns
+                rollup.newest = newest
+                rollup.head = newest // rollup.step_ns % capacity
+                restored.add(step)
+                continue
+            starts, mins, maxs, sums, counts = columns
+            # Capacity changed: replay oldest first so the capacity check keeps the newest buckets
+            for i in sorted((i for i in range(capacity) if starts[i]), key=starts.__getitem__):
+                rollup.merge(starts[i], mins[i], maxs[i], sums[i], counts[i])
+            restored.add(step)
+        return offset, restored
+
+    def start_snapshots(self, directory: str, interval: float) -> threading.Thread:
+        """Save a snapshot every `interval` seconds on a daemon thread."""
+
+        def loop():
+            while True:
+                time.sleep(interval)
+                try:
+                    start = time.monotonic()
+                    self.save_snapshot(directory)
+                    logger.debug(
+                        f"[SeriesStore] Snapshot of {len(self)} series in {time.monotonic() - start:.3f}s"
+                    )
+                except Exception as e:
+                    logger.error(f"[SeriesStore] Snapshot failed: {e}")
+
+        t = threading.Thread(target=loop, name="series-snapshot", daemon=True)
+        t.start()
+        return t
+
+
+STORE = SeriesStore(
+    int(os.environ.get("SERIES_RETENTION", DEFAULT_RETENTION)),
+    shards=int(os.environ.get("STORE_SHARDS", DEFAULT_SHARDS)),
+)
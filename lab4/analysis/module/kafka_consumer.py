@@ -1,18 +1,31 @@
 from __future__ import annotations
 
-import json
-from typing import Any, Dict, Callable
-from kafka import KafkaConsumer
+from typing import Any, Dict, Callable, Iterable, List, Optional, Set, Tuple
+from kafka import ConsumerRebalanceListener, KafkaConsumer
+from kafka.partitioner.default import murmur2
 import logging
 
+from .serializer import deserialize
+
 
 class KafkaConsumerClient:
     """
     Wrapper around kafka-python KafkaConsumer.
     Features:
-    - JSON deserialization
+    - JSON / msgpack deserialization (auto-detected per record)
     - consumer groups
-    - callback processing
+    - callback processing, per record or per poll() batch
+
+    Records are decoded here rather than by a kafka-python
+    value_deserializer, so one malformed record is skipped instead of
+    failing the whole poll.
+
+    Producers key records by hostname, so each host lives on one
+    partition. The client remembers which hosts it has seen on each
+    partition; when a rebalance moves partitions to another consumer,
+    `on_hosts_lost` is called with their hosts so per-host state can be
+    dropped. Hosts restored from a snapshot (see claim_hosts) are checked
+    against the first assignment the same way.
     """
 
     def __init__(
@@ -22,17 +35,36 @@ class KafkaConsumerClient:
         group_id: str = "default-group",
         auto_offset_reset: str = "latest",
         enable_auto_commit: bool = True,
+        consumer: Optional[KafkaConsumer] = None,
+        on_hosts_lost: Optional[Callable[[Set[str]], None]] = None,
+        on_assigned: Optional[Callable[[], None]] = None,
     ):
+        """
+        :param consumer: pre-built consumer (benchmarks); brokers/group are ignored
+        :param on_hosts_lost: called with the hosts of partitions taken away by a rebalance
+        :param on_assigned: called after every assignment, once lost hosts are reported
+        """
         self.topic = topic
+        self.enable_auto_commit = enable_auto_commit
+        self.on_hosts_lost = on_hosts_lost
+        self.on_assigned = on_assigned
+        self._running = True
+        # (topic, partition) -> hostnames seen on it
+        self._hosts: Dict[Tuple[str, int], Set[str]] = {}
+        self._assigned: Set[Tuple[str, int]] = set()
+        # Hosts held before any of their records arrived, placed at the next assignment
+        self._claimed: Set[str] = set()
 
+        if consumer is not None:
+            self.consumer = consumer
+            return
         self.consumer = KafkaConsumer(
-            topic,
             bootstrap_servers=brokers,
             group_id=group_id,
             auto_offset_reset=auto_offset_reset,  # "earliest" or "latest"
             enable_auto_commit=enable_auto_commit,
-            value_deserializer=lambda v: json.loads(v.decode("utf-8")),
         )
+        self.consumer.subscribe([topic], listener=_RebalanceListener(self))
 
     def start_consuming(self, callback: Callable[[Dict[str, Any]], None]):
         """
@@ -43,11 +75,124 @@ class KafkaConsumerClient:
 
         for message in self.consumer:
             try:
-                value = message.value  # already JSON dict
+                value = deserialize(message.value)
+                self._track((message.topic, message.partition), value)
                 callback(value)
             except Exception as e:
                 logging.error(f"[Kafka] Error processing message: {e}")
 
+    def start_consuming_batches(
+        self,
+        callback: Callable[[List[Dict[str, Any]]], None],
+        max_records: int = 500,
+        timeout_ms: int = 1000,
+    ):
+        """
+        Consume in batches until stop(): poll() up to `max_records`
+        records, decode them, hand the list to `callback`, then commit
+        the offsets (unless auto-commit is on). Undecodable records are
+        skipped. When `callback` raises, the batch is logged and committed
+        anyway: it may already be partly written, and replaying it would
+        duplicate those points (callbacks reject bad records one by one).
+        """
+        logging.info(f"[Kafka] Starting batch consumer for topic: {self.topic} (max {max_records} records)")
+
+        while self._running:
+            polled = self.consumer.poll(timeout_ms=timeout_ms, max_records=max_records)
+            if not polled:
+                continue
+
+            values = []
+            for tp, records in polled.items():
+                for record in records:
+                    try:
+                        value = deserialize(record.value)
+                        self._track(tp, value)
+                        values.append(value)
+                    except Exception as e:
+                        logging.error(f"[Kafka] Skipping undecodable record at offset {record.offset}: {e}")
+
+            try:
+                callback(values)
+            except Exception as e:
+                logging.error(f"[Kafka] Error processing batch of {len(values)} records, skipping it: {e}")
+
+            if not self.enable_auto_commit:
+                try:
+                    self.consumer.commit()
+                except Exception as e:
+                    logging.error(f"[Kafka] Offset commit failed: {e}")
+
+    def claim_hosts(self, hosts: Iterable[str]) -> None:
+        """
+        Hosts whose series are already held (restored from a snapshot).
+        At the next assignment, those whose partition went to another
+        consumer are reported through `on_hosts_lost`.
+        """
+        self._claimed |= set(hosts)
+
+    def _partition_of(self, host: str, partitions: List[int]) -> int:
+        """Partition of a host's records (the producer's murmur2 of the hostname)."""
+        return partitions[(murmur2(host.encode("utf-8")) & 0x7FFFFFFF) % len(partitions)]
+
+    def _track(self, tp, value: Any) -> None:
+        if isinstance(value, dict) and value.get("hostname"):
+            self._hosts.setdefault(tuple(tp), set()).add(value["hostname"])
+
+    def _partitions_revoked(self, revoked) -> None:
+        logging.info(f"[Kafka] Partitions revoked: {sorted(tuple(tp) for tp in revoked)}")
+        if not self.enable_auto_commit:
+            # Hand over exactly what has been processed
+            try:
+                self.consumer.commit()
+            except Exception as e:
+                logging.error(f"[Kafka] Offset commit on revoke failed: {e}")
+
+    def _partitions_assigned(self, assigned) -> None:
+        assigned = {tuple(tp) for tp in assigned}
+        logging.info(f"[Kafka] Partitions assigned: {sorted(assigned)}")
+        lost = self._assigned - assigned
+        self._assigned = assigned
+        hosts: Set[str] = set()
+        for tp in lost:
+            hosts |= self._hosts.pop(tp, set())
+        partitions = sorted(self.consumer.partitions_for_topic(self.topic) or ()) if self._claimed else []
+        if partitions:
+            for host in self._claimed:
+                tp = (self.topic, self._partition_of(host, partitions))
+                if tp in assigned:
+                    self._hosts.setdefault(tp, set()).add(host)
+                else:
+                    hosts.add(host)
+            self._claimed = set()
+        if hosts and self.on_hosts_lost is not None:
+            logging.info(f"[Kafka] {len(hosts)} host(s) moved to another consumer")
+            self.on_hosts_lost(hosts)
+        if self.on_assigned is not None:
+            self.on_assigned()
+
+    def stop(self):
+        """Make start_consuming_batches return after the current poll."""
+        self._running = False
+
     def close(self):
         """Close consumer cleanly."""
+        self._running = False
         self.consumer.close()
+
+
+class _RebalanceListener(ConsumerRebalanceListener):
+    """
+    Eager rebalances revoke every partition before assigning the new set,
+    so hosts are only dropped for partitions missing from the new
+    assignment, not on every revoke.
+    """
+
+    def __init__(self, client: KafkaConsumerClient):
+        self.client = client
+
+    def on_partitions_revoked(self, revoked):
+        self.client._partitions_revoked(revoked)
+
+    def on_partitions_assigned(self, assigned):
+        self.client._partitions_assigned(assigned)
@@ -0,0 +1,82 @@
+"""
+Kafka value serializers for the `monitor_metrics` and `commands` topics.
+
+Framed records start with MAGIC followed by a one-byte codec id. Records
+without the magic byte are legacy JSON, so a consumer reads both formats
+during a rolling upgrade. The "json" codec keeps writing unframed JSON so
+that old consumers keep working until every consumer is upgraded; then
+producers can switch to "msgpack".
+"""
+from __future__ import annotations
+
+import json
+from typing import Any, Callable, Dict
+
+try:
+    import msgpack
+except Exception:
+    msgpack = None
+
+# 0xA5 can never start a UTF-8 JSON document.
+MAGIC = 0xA5
+
+CODEC_JSON = 0x01
+CODEC_MSGPACK = 0x02
+
+
+def _json_encode(value: Any) -> bytes:
+    return json.dumps(value, separators=(",", ":")).encode("utf-8")
+
+
+def _json_decode(data: bytes) -> Any:
+    return json.loads(data)
+
+
+def _msgpack_encode(value: Any) -> bytes:
+    return msgpack.packb(value, use_bin_type=True)
+
+
+def _msgpack_decode(data: bytes) -> Any:
+    return msgpack.unpackb(data, raw=False)
+
+
+_DECODERS: Dict[int, Callable[[bytes], Any]] = {
+    CODEC_JSON: _json_decode,
+    CODEC_MSGPACK: _msgpack_decode,
+}
+
+
+def get_serializer(codec: str = "json") -> Callable[[Any], bytes]:
+    """
+    Return a kafka-python `value_serializer` for the given codec name.
+    :param codec: "json" (legacy, unframed) or "msgpack" (framed)
+    """
+    codec = (codec or "json").lower()
+
+    if codec == "json":
+        return _json_encode
+
+    if codec == "msgpack":
+        if msgpack is None:
+            raise RuntimeError("msgpack codec requested but msgpack is not installed")
+        header = bytes((MAGIC, CODEC_MSGPACK))
+        return lambda value: header + _msgpack_encode(value)
+
+    raise ValueError(f"Unknown Kafka codec: {codec}")
+
+
+def deserialize(data: bytes) -> Any:
+    """kafka-python `value_deserializer` that auto-detects the record format."""
+    if data is None:
+        return None
+
+    if len(data) >= 2 and data[0] == MAGIC:
+        decoder = _DECODERS.get(data[1])
+        if decoder is None:
+            raise ValueError(f"Unknown codec id in Kafka record: {data[1]:#x}")
+        if data[1] == CODEC_MSGPACK and msgpack is None:
+            raise RuntimeError("received a msgpack record but msgpack is not installed")
+        return decoder(data[2:])
+
+    # Legacy record: plain JSON
+    return _json_decode(data)
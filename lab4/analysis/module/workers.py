@@ -0,0 +1,190 @@
+# analysis/module/workers.py
+import logging
+import multiprocessing
+import os
+import queue
+import threading
+import time
+from typing import Dict, List, Optional, Set
+
+from .broadcast import BROADCAST
+from .datastore import STORE, SeriesKey
+
+logger = logging.getLogger(__name__)
+
+
+def run_worker(
+    worker_id: int,
+    changes_queue,
+    resync_queue,
+    snapshot_dir: str,
+    ship_interval: float,
+    snapshot_interval: float,
+    parent_pid: int,
+):
+    """
+    Entry point of an ingest worker process.
+
+    The worker joins the `analysis-group` consumer group like the
+    in-process consumer does, so Kafka gives it its own share of the
+    `monitor_metrics` partitions. It keeps a full SeriesStore (raw rings,
+    aggregates, rollups) and every `ship_interval` seconds puts
+    (worker_id, changes since the last shipment) on `changes_queue` for
+    the API process. Keys the API process could not apply come back on
+    `resync_queue` and are shipped again in full.
+    """
+    logging.basicConfig(
+        level=logging.INFO,
+        format=f"%(asctime)s - worker-{worker_id} - %(levelname)s - %(message)s",
+    )
+    from .consumer import start_kafka_consumer
+
+    worker_dir = os.path.join(snapshot_dir, f"worker-{worker_id}")
+    try:
+        loaded = STORE.load_snapshot(worker_dir)
+        logger.info(f"Loaded {loaded} series from snapshot in {worker_dir}")
+    except Exception as e:
+        logger.error(f"Failed to load snapshot from {worker_dir}: {e}")
+    if snapshot_interval > 0:
+        STORE.start_snapshots(worker_dir, snapshot_interval)
+
+    # series the consumer dropped in a rebalance; if their host comes back
+    # they start again from version 0 and must not be compared with `shipped`
+    dropped: "queue.SimpleQueue[List[SeriesKey]]" = queue.SimpleQueue()
+    # Nothing is shipped before the first assignment: restored series of
+    # hosts owned by another worker are dropped then, not sent to the API
+    assigned = threading.Event()
+    threading.Thread(target=start_kafka_consumer, args=(dropped.put, assigned.set), daemon=True).start()
+
+    # key -> version last put on the queue
+    shipped: Dict[SeriesKey, int] = {}
+    # keys the replica failed to apply, shipped in full next round
+    resync: Set[SeriesKey] = set()
+    while os.getppid() == parent_pid:
+        time.sleep(ship_interval)
+        if not assigned.is_set():
+            continue
+        try:
+            while True:
+                for key in dropped.get_nowait():
+                    shipped.pop(key, None)
+        except queue.Empty:
+            pass
+        try:
+            while True:
+                resync.update(resync_queue.get_nowait())
+        except queue.Empty:
+            pass
+        if resync:
+            logger.warning(f"[Worker {worker_id}] Resyncing {len(resync)} series with the API process")
+        try:
+            changes = STORE.export_changes(shipped, resync)
+            if not changes:
+                continue
+            changes_queue.put((worker_id, changes), timeout=ship_interval)
+        except queue.Full:
+            # API process is behind: the changes are re-exported (coalesced) next round
+            logger.warning(f"[Worker {worker_id}] Changes queue full, deferring {len(changes)} series")
+            continue
+        except Exception as e:
+            # keep shipping: nothing was marked shipped, so this round is retried
+            logger.error(f"[Worker {worker_id}] Failed to ship changes: {e}")
+            continue
+        shipped.update((change[0], change[2]) for change in changes)
+        resync.clear()
+
+    logger.info(f"[Worker {worker_id}] Parent process exited, stopping")
+
+
+class IngestPool:
+    """
+    Scale-out ingest: `workers` processes each consume a subset of the
+    Kafka partitions into their own SeriesStore, so ingest is not bound
+    by the API process's GIL. The API process's STORE becomes a replica
+    fed with the workers' deltas (new points, aggregates and touched
+    rollup buckets; see SeriesStore.export_changes), so applying them
+    costs a few array writes per changed series.
+
+    Each series should be consumed by a single worker, i.e. records of
+    one host should land in one partition.
+    """
+
+    def __init__(
+        self,
+        workers: int,
+        snapshot_dir: str = "snapshots",
+        ship_interval: float = 1.0,
+        snapshot_interval: float = 60.0,
+        queue_size: int = 64,
+    ) -> None:
+        self.workers = workers
+        self.snapshot_dir = snapshot_dir
+        self.ship_interval = ship_interval
+        self.snapshot_interval = snapshot_interval
+        # spawn: never fork a process that already runs threads
+        self._ctx = multiprocessing.get_context("spawn")
+        self.queue = self._ctx.Queue(maxsize=queue_size)
+        # Per worker: keys whose changes could not be applied here
+        self._resync = [self._ctx.Queue() for _ in range(workers)]
+        self._processes: List[Optional[multiprocessing.process.BaseProcess]] = [None] * workers
+        self._running = False
+
+    def start(self) -> None:
+        self._running = True
+        for worker_id in range(self.workers):
+            self._spawn(worker_id)
+        threading.Thread(target=self._receive, name="ingest-receiver", daemon=True).start()
+        logger.info(f"[IngestPool] Started {self.workers} ingest worker(s)")
+
+    def stop(self) -> None:
+        self._running = False
+        for process in self._processes:
+            if process is not None and process.is_alive():
+                process.terminate()
+        for process in self._processes:
+            if process is not None:
+                process.join(timeout=5)
+
+    def _spawn(self, worker_id: int) -> None:
+        process = self._ctx.Process(
+            target=run_worker,
+            args=(
+                worker_id,
+                self.queue,
+                self._resync[worker_id],
+                self.snapshot_dir,
+                self.ship_interval,
+                self.snapshot_interval,
+                os.getpid(),
+            ),
+            name=f"ingest-worker-{worker_id}",
+            daemon=True,
+        )
+        process.start()
+        self._processes[worker_id] = process
+
+    def _receive(self) -> None:
+        while self._running:
+            try:
+                worker_id, changes = self.queue.get(timeout=1.0)
+            except queue.Empty:
+                changes = None
+
+            if changes:
+                try:
+                    BROADCAST.publish_batch(STORE.apply_changes(changes))
+                except Exception as e:
+                    # The worker already counts these versions as shipped:
+                    # ask for the whole series again so the replica converges
+                    logger.error(
+                        f"[IngestPool] Failed to apply {len(changes)} series changes from worker {worker_id}, "
+                        f"requesting a resync: {e}"
+                    )
+                    self._resync[worker_id].put([change[0] for change in changes])
+
+            for worker_id, process in enumerate(self._processes):
+                if self._running and process is not None and not process.is_alive():
+                    logger.warning(
+                        f"[IngestPool] Worker {worker_id} exited with {process.exitcode}, restarting"
+                    )
+                    self._spawn(worker_id)
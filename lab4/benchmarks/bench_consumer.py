@@ -0,0 +1,104 @@
+"""
+Analysis consumer throughput: one callback per record vs poll() batches.
+
+Records are a generated fixture of agent BatchStream ticks (msgpack
+framed, as the server produces them) served by an in-memory stand-in
+for KafkaConsumer, so no broker is needed. Each run ingests into a
+fresh SeriesStore; the best of 3 runs is reported.
+
+Usage: python benchmarks/bench_consumer.py [records]
+"""
+import os
+import sys
+import time
+from collections import namedtuple
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "analysis"))
+
+from module import consumer  # noqa: E402
+from module.datastore import SeriesStore  # noqa: E402
+from module.kafka_consumer import KafkaConsumerClient  # noqa: E402
+from module.serializer import get_serializer, msgpack  # noqa: E402
+
+Record = namedtuple("Record", "topic partition offset value")
+
+HOSTS = 200
+
+
+def make_fixture(count, codec):
+    encode = get_serializer(codec)
+    records = []
+    for i in range(count):
+        tick = {
+            "timestamp_ns": (1_700_000_000 + (i // HOSTS) * 5) * 1_000_000_000,
+            "hostname": f"worker-node-{i % HOSTS:03d}",
+            "samples": [
+                {"metric": "cpu", "value": i % 100 + 0.5, "unit": "%"},
+                {"metric": "memory", "value": 43.21, "unit": "%"},
+                {"metric": "diskio", "value": {"read": 12.5, "write": 200.25}, "unit": "kB/s"},
+                {"metric": "network", "value": {"rx": 1.75, "tx": 0.5}, "unit": "kB/s"},
+                {"metric": "process_count", "value": 312, "unit": "N/A"},
+            ],
+        }
+        records.append(Record("monitor_metrics", i % 3, i // 3, encode(tick)))
+    return records
+
+
+class FixtureConsumer:
+    """Just enough of KafkaConsumer: iteration, poll(), commit()."""
+
+    def __init__(self, records):
+        self.records = records
+        self.pos = 0
+        self.commits = 0
+        self.client = None
+
+    def __iter__(self):
+        return iter(self.records)
+
+    def poll(self, timeout_ms=0, max_records=500):
+        chunk = self.records[self.pos:self.pos + max_records]
+        self.pos += len(chunk)
+        if not chunk:
+            self.client.stop()
+            return {}
+        return {("monitor_metrics", 0): chunk}
+
+    def commit(self):
+        self.commits += 1
+
+    def close(self):
+        pass
+
+
+def run(records, batch_size):
+    consumer.STORE = SeriesStore(retention=3600)
+    fixture = FixtureConsumer(records)
+    client = KafkaConsumerClient("monitor_metrics", enable_auto_commit=batch_size <= 0, consumer=fixture)
+    fixture.client = client
+
+    start = time.perf_counter()
+    if batch_size > 0:
+        client.start_consuming_batches(consumer.process_batch, max_records=batch_size, timeout_ms=0)
+    else:
+        client.start_consuming(consumer.process_message)
+    elapsed = time.perf_counter() - start
+
+    points = sum(len(values) for *_, values in consumer.STORE.tails())
+    return elapsed, points, fixture.commits
+
+
+def main():
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 50_000
+    codec = "msgpack" if msgpack is not None else "json"
+    records = make_fixture(count, codec)
+    print(f"{count} records ({codec}, {HOSTS} hosts, 7 points each)")
+    print(f"{'mode':<22}{'records/s':>12}{'points/s':>12}{'commits':>9}")
+
+    for label, batch_size in [("per-record", 0), ("poll batch=100", 100), ("poll batch=500", 500)]:
+        elapsed, points, commits = min(run(records, batch_size) for _ in range(3))
+        print(f"{label:<22}{count / elapsed:>12,.0f}{points / elapsed:>12,.0f}{commits:>9}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+"""
+Agent BatchStream over a real gRPC channel: bytes on the wire and server
+CPU per configuration of message compression.
+
+A sink server (this script with --serve, in a subprocess so its CPU time
+can be measured on its own) accepts BatchStream and only parses the
+frames. The agent side streams pre-built MetricBatch messages through a
+local TCP relay that counts the bytes in each direction, i.e. including
+HTTP/2 framing and keepalive pings. Two workloads:
+  live    one tick per message (5 metrics, as collected)
+  replay  spool replay: 100 ticks merged into one message, each sample
+          with its own timestamp
+
+Usage: python benchmarks/bench_grpc_channel.py [messages]
+"""
+import os
+import socket
+import subprocess
+import sys
+import threading
+import time
+from concurrent import futures
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+import grpc  # noqa: E402
+
+from generated.monitor_pb2 import CommandResponse, MetricBatch  # noqa: E402
+from generated.monitor_pb2_grpc import (  # noqa: E402
+    MonitorServiceServicer,
+    MonitorServiceStub,
+    add_MonitorServiceServicer_to_server,
+)
+from module.grpc_options import parse_compression, server_options  # noqa: E402
+
+REPLAY_TICKS = 100
+
+
+def make_tick(i, timestamp_ns=0):
+    samples = [
+        CommandResponse(metric="cpu", double_value=(i * 7.3) % 100, unit="%", timestamp_ns=timestamp_ns),
+        CommandResponse(metric="memory", double_value=43.21 + i % 3 * 0.01, unit="%", timestamp_ns=timestamp_ns),
+        CommandResponse(
+            metric="diskio", fields={"read": i % 50 * 1.5, "write": 200.25}, unit="kB/s", timestamp_ns=timestamp_ns
+        ),
+        CommandResponse(
+            metric="network", fields={"rx": i % 20 * 0.25, "tx": 0.5}, unit="kB/s", timestamp_ns=timestamp_ns
+        ),
+        CommandResponse(metric="process_count", int_value=312 + i % 4, unit="N/A", timestamp_ns=timestamp_ns),
+    ]
+    return samples
+
+
+def make_workload(kind, count):
+    start_ns = 1_700_000_000 * 1_000_000_000
+    if kind == "live":
+        return [
+            MetricBatch(timestamp_ns=start_ns + i * 5_000_000_000, hostname="worker-node-017", samples=make_tick(i))
+            for i in range(count)
+        ]
+    batches = []
+    for b in range(count):
+        samples = []
+        for t in range(REPLAY_TICKS):
+            i = b * REPLAY_TICKS + t
+            samples.extend(make_tick(i, start_ns + i * 5_000_000_000))
+        batches.append(MetricBatch(timestamp_ns=start_ns, hostname="worker-node-017", samples=samples))
+    return batches
+
+
+# ---- sink server (subprocess) ----
+
+class SinkService(MonitorServiceServicer):
+    def BatchStream(self, request_iterator, context):
+        frames = 0
+        for batch in request_iterator:
+            frames += len(batch.samples) > 0
+        print(f"done {frames} {time.process_time():.6f}", flush=True)
+        return iter(())
+
+
+def serve(port):
+    server = grpc.server(futures.ThreadPoolExecutor(max_workers=4), options=server_options())
+    add_MonitorServiceServicer_to_server(SinkService(), server)
+    server.add_insecure_port(f"127.0.0.1:{port}")
+    server.start()
+    print(f"ready {time.process_time():.6f}", flush=True)
+    server.wait_for_termination()
+
+
+# ---- byte-counting relay ----
+
+class Relay:
+    def __init__(self, target_port):
+        self.target_port = target_port
+        self.listener = socket.socket()
+        self.listener.bind(("127.0.0.1", 0))
+        self.listener.listen(8)
+        self.port = self.listener.getsockname()[1]
+        self.up = 0  # agent -> server
+        self.down = 0  # server -> agent
+        self._lock = threading.Lock()
+        threading.Thread(target=self._accept, daemon=True).start()
+
+    def reset(self):
+        with self._lock:
+            self.up = self.down = 0
+
+    def _accept(self):
+        while True:
+            client, _ = self.listener.accept()
+            upstream = socket.create_connection(("127.0.0.1", self.target_port))
+            threading.Thread(target=self._pipe, args=(client, upstream, "up"), daemon=True).start()
+            threading.Thread(target=self._pipe, args=(upstream, client, "down"), daemon=True).start()
+
+    def _pipe(self, src, dst, direction):
+        try:
+            while True:
+                data = src.recv(65536)
+                if not data:
+                    break
+                with self._lock:
+                    setattr(self, direction, getattr(self, direction) + len(data))
+                dst.sendall(data)
+        except OSError:
+            pass
+        finally:
+            for sock in (src, dst):
+                try:
+                    sock.shutdown(socket.SHUT_RDWR)
+                except OSError:
+                    pass
+
+
+def run(relay, server, batches, compression):
+    """:return: (bytes agent -> server, seconds, sink CPU time at the end of the stream)"""
+    relay.reset()
+    channel = grpc.insecure_channel(f"127.0.0.1:{relay.port}", compression=parse_compression(compression))
+    grpc.channel_ready_future(channel).result(timeout=10)
+    stub = MonitorServiceStub(channel)
+
+    start = time.perf_counter()
+    for _ in stub.BatchStream(iter(batches)):
+        pass
+    elapsed = time.perf_counter() - start
+
+    cpu = float(server.stdout.readline().split()[-1])
+    channel.close()
+    time.sleep(0.1)  # let the relay count the last frames
+    return relay.up, elapsed, cpu
+
+
+def main():
+    if len(sys.argv) > 2 and sys.argv[1] == "--serve":
+        serve(int(sys.argv[2]))
+        return
+
+    count = int(sys.argv[1]) if len(sys.argv) > 1 else 5000
+    with socket.socket() as probe:
+        probe.bind(("127.0.0.1", 0))
+        port = probe.getsockname()[1]
+    server = subprocess.Popen(
+        [sys.executable, os.path.abspath(__file__), "--serve", str(port)], stdout=subprocess.PIPE, text=True
+    )
+    try:
+        # The sink prints its CPU time once ready and after every stream
+        ready = server.stdout.readline().split()
+        assert ready and ready[0] == "ready", ready
+        cpu_before = float(ready[-1])
+        relay = Relay(port)
+
+        print(f"{'workload':<9}{'compression':<13}{'raw B/msg':>10}{'wire B/msg':>11}{'ratio':>7}"
+              f"{'msg/s':>9}{'server CPU us/msg':>19}")
+        for kind, messages in (("live", count), ("replay", max(1, count // REPLAY_TICKS))):
+            batches = make_workload(kind, messages)
+            raw = sum(b.ByteSize() for b in batches) / messages
+            for compression in ("none", "gzip", "deflate"):
+                wire, elapsed, cpu = run(relay, server, batches, compression)
+                print(f"{kind:<9}{compression:<13}{raw:>10,.0f}{wire / messages:>11,.0f}{raw * messages / wire:>7.2f}"
+                      f"{messages / elapsed:>9,.0f}{(cpu - cpu_before) / messages * 1e6:>19,.1f}")
+                cpu_before = cpu
+    finally:
+        server.terminate()
+        server.wait()
+
+
+if __name__ == "__main__":
+    main()
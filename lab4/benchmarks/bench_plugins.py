@@ -0,0 +1,60 @@
+"""
+Per-call cost of the CPU / RAM / process-count collectors.
+
+Compares the /proc readers against the subprocess fallbacks
+(`top -bn1`, `free -m`, `ps aux`) that the plugins used before.
+
+Usage: python benchmarks/bench_plugins.py [iterations]
+"""
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "client"))
+
+from module.plugins._cpu import CPUCommandPlugin, CPUPlugin  # noqa: E402
+from module.plugins._process_count import ProcessCountCommandPlugin, ProcessCountPlugin  # noqa: E402
+from module.plugins._ram import RAMCommandPlugin, RAMPlugin  # noqa: E402
+
+
+PAIRS = [
+    ("cpu", CPUCommandPlugin, CPUPlugin),
+    ("memory", RAMCommandPlugin, RAMPlugin),
+    ("process_count", ProcessCountCommandPlugin, ProcessCountPlugin),
+]
+
+
+def bench(plugin, iterations):
+    plugin.initialize()
+    value = plugin.run()
+
+    cpu_start = time.process_time()
+    start = time.perf_counter()
+    for _ in range(iterations):
+        plugin.run()
+    wall = (time.perf_counter() - start) / iterations
+    cpu = (time.process_time() - cpu_start) / iterations
+    return wall, cpu, value
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 50
+
+    print(f"per call, {iterations} iterations (cpu = agent process CPU time, excludes children)")
+    for name, command_cls, proc_cls in PAIRS:
+        print(name)
+        for label, cls in (("subprocess", command_cls), ("/proc", proc_cls)):
+            plugin = cls()
+            if label == "/proc" and not plugin.use_proc:
+                print(f"  {label:<11} unavailable on this host")
+                continue
+            try:
+                wall, cpu, value = bench(plugin, iterations)
+            except FileNotFoundError as e:
+                print(f"  {label:<11} unavailable: {e}")
+                continue
+            print(f"  {label:<11} wall {wall * 1e6:>10,.1f} us  cpu {cpu * 1e6:>10,.1f} us  value={value}")
+
+
+if __name__ == "__main__":
+    main()
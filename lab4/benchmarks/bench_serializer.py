@@ -0,0 +1,88 @@
+"""
+Encode/decode throughput and bytes per record for the Kafka value codecs.
+
+Compares the original path (json.dumps(v).encode() / json.loads(v.decode()))
+against the codecs in server/module/serializer.py.
+
+Usage: python benchmarks/bench_serializer.py [iterations]
+"""
+import json
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "server"))
+
+from module.serializer import deserialize, get_serializer, msgpack  # noqa: E402
+
+
+SINGLE = {
+    "timestamp": "2024-01-01 12:00:00",
+    "hostname": "worker-node-017",
+    "metric": "diskio",
+    "value": {"read": 12.5, "write": 200.25},
+    "unit": "kB/s",
+}
+
+BATCH = {
+    "timestamp": "2024-01-01 12:00:00",
+    "hostname": "worker-node-017",
+    "samples": [
+        {"metric": "cpu", "value": 12.5, "unit": "%"},
+        {"metric": "memory", "value": 43.21, "unit": "%"},
+        {"metric": "diskio", "value": {"read": 12.5, "write": 200.25}, "unit": "kB/s"},
+        {"metric": "network", "value": {"rx": 1.75, "tx": 0.5}, "unit": "kB/s"},
+        {"metric": "process_count", "value": 312, "unit": "N/A"},
+    ],
+}
+
+COMMANDS = ["cpu", "memory", "diskio", "network"]
+
+
+def legacy_encode(v):
+    return json.dumps(v).encode("utf-8")
+
+
+def legacy_decode(v):
+    return json.loads(v.decode("utf-8"))
+
+
+def bench(name, encode, decode, record, iterations):
+    start = time.perf_counter()
+    for _ in range(iterations):
+        data = encode(record)
+    enc_s = time.perf_counter() - start
+
+    start = time.perf_counter()
+    for _ in range(iterations):
+        decode(data)
+    dec_s = time.perf_counter() - start
+
+    assert decode(data) == record
+    print(
+        f"  {name:<14} {len(data):>6} B/rec"
+        f"  encode {iterations / enc_s:>11,.0f} rec/s"
+        f"  decode {iterations / dec_s:>11,.0f} rec/s"
+    )
+
+
+def main():
+    iterations = int(sys.argv[1]) if len(sys.argv) > 1 else 100_000
+
+    codecs = [
+        ("json (legacy)", legacy_encode, legacy_decode),
+        ("json", get_serializer("json"), deserialize),
+    ]
+    if msgpack is not None:
+        codecs.append(("msgpack", get_serializer("msgpack"), deserialize))
+    else:
+        print("msgpack not installed, skipping msgpack codec")
+
+    for label, record in (("single sample", SINGLE), ("batched tick", BATCH), ("commands", COMMANDS)):
+        print(f"{label} ({iterations:,} iterations)")
+        for name, encode, decode in codecs:
+            bench(name, encode, decode, record, iterations)
+
+
+if __name__ == "__main__":
+    main()
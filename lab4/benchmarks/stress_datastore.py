@@ -0,0 +1,152 @@
+"""
+Concurrency stress test for the analysis SeriesStore.
+
+Writer threads append increasing counters to overlapping series (single
+appends and batches) while reader threads:
+  - follow `since()` cursors and check that every series arrives complete,
+    in order and without duplicates;
+  - poll `changed()` and check that versions never go backwards and that
+    each window is consistent with its version;
+  - take `tails()` / `history()` snapshots.
+Any exception in a thread (e.g. "dictionary changed size during
+iteration") or broken invariant fails the run with exit code 1.
+
+Usage: python benchmarks/stress_datastore.py [seconds] [shards]
+"""
+import os
+import random
+import sys
+import threading
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), "..", "analysis"))
+
+from module.datastore import SeriesStore  # noqa: E402
+
+WRITERS = 4
+HOSTS = 50
+METRICS = ["cpu", "memory", "diskio.read", "diskio.write"]
+BATCH = 20
+
+
+class Stress:
+    def __init__(self, seconds, shards):
+        self.store = SeriesStore(retention=1_000_000, tiers=((60, 60),), shards=shards)
+        self.deadline = time.monotonic() + seconds
+        self.errors = []
+        self.appended = 0
+        self.lock = threading.Lock()
+        # Every key is written by exactly one writer, so its values are 1, 2, 3, ...
+        keys = [(f"host-{h:03d}", m) for h in range(HOSTS) for m in METRICS]
+        self.keys_by_writer = [keys[i::WRITERS] for i in range(WRITERS)]
+
+    def fail(self, message):
+        with self.lock:
+            self.errors.append(message)
+
+    def running(self):
+        return not self.errors and time.monotonic() < self.deadline
+
+    def guard(self, fn):
+        def run():
+            try:
+                fn()
+            except Exception as e:
+                self.fail(f"{threading.current_thread().name}: {type(e).__name__}: {e}")
+        return run
+
+    def writer(self, keys):
+        counters = {key: 0 for key in keys}
+        count = 0
+        while self.running():
+            if random.random() < 0.5:
+                key = random.choice(keys)
+                counters[key] += 1
+                self.store.append(*key, time.time_ns(), float(counters[key]), "%")
+                count += 1
+            else:
+                batch = {}
+                for key in random.sample(keys, min(BATCH, len(keys))):
+                    points = []
+                    for _ in range(random.randint(1, 3)):
+                        counters[key] += 1
+                        points.append((time.time_ns(), float(counters[key])))
+                    batch[key] = ("%", points)
+                count += self.store.append_batch(batch)
+        with self.lock:
+            self.appended += count
+
+    def since_reader(self):
+        cursor = 0
+        last = {}
+        while self.running():
+            cursor, changes = self.store.since(cursor, 10**9)
+            for key, _unit, _ts, values, _agg in changes:
+                expected = last.get(key, 0.0) + 1
+                if values[0] != expected or any(b != a + 1 for a, b in zip(values, values[1:])):
+                    self.fail(f"since(): {key} expected {expected}, got {list(values[:5])}...")
+                    return
+                last[key] = values[-1]
+        # Drain: after writers stop the reader must have seen everything
+        time.sleep(0.2)
+        _cursor, changes = self.store.since(cursor, 10**9)
+        for key, _unit, _ts, values, _agg in changes:
+            last[key] = values[-1]
+        for key, _unit, _ts, values in self.store.tails(1):
+            if last.get(key) != values[-1]:
+                self.fail(f"since(): {key} ended at {last.get(key)}, store has {values[-1]}")
+
+    def changed_reader(self):
+        seen = {}
+        while self.running():
+            _cursor, changes = self.store.changed(seen, 5)
+            for key, version, _unit, _ts, values, _agg in changes:
+                if version < seen.get(key, 0):
+                    self.fail(f"changed(): {key} version went back {seen[key]} -> {version}")
+                # Values are counters, so the newest value equals the version
+                if values[-1] != version:
+                    self.fail(f"changed(): {key} version {version} but newest value {values[-1]}")
+                seen[key] = version
+
+    def snapshot_reader(self):
+        while self.running():
+            self.store.tails(15)
+            key = (f"host-{random.randrange(HOSTS):03d}", random.choice(METRICS))
+            self.store.history(key, 3600, 10)
+            len(self.store)
+
+    def run(self):
+        threads = [
+            threading.Thread(target=self.guard(lambda keys=keys: self.writer(keys)), name=f"writer-{i}")
+            for i, keys in enumerate(self.keys_by_writer)
+        ]
+        threads += [
+            threading.Thread(target=self.guard(self.since_reader), name="since-reader"),
+            threading.Thread(target=self.guard(self.changed_reader), name="changed-reader"),
+            threading.Thread(target=self.guard(self.snapshot_reader), name="snapshot-reader"),
+        ]
+        start = time.monotonic()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        return time.monotonic() - start
+
+
+def main():
+    seconds = float(sys.argv[1]) if len(sys.argv) > 1 else 5.0
+    shards = [int(sys.argv[2])] if len(sys.argv) > 2 else [1, 16]
+    failed = False
+    for count in shards:
+        stress = Stress(seconds, count)
+        elapsed = stress.run()
+        status = "OK" if not stress.errors else "FAILED"
+        print(f"shards={count:<3} {stress.appended / elapsed:>10,.0f} appends/s  {status}")
+        for error in stress.errors[:10]:
+            print(f"  {error}")
+        failed = failed or bool(stress.errors)
+    sys.exit(1 if failed else 0)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,9 +1,14 @@
 from module.plugins.manager import PlugingManager
 from module.grpc_client import GRPCClient
 from module.config_manager import ConfigManager
+from module.collection import MetricCollector
+from module.balancer import DnsResolver, EtcdResolver, ServerBalancer, StaticResolver, parse_addresses
+from module.deadband import Deadband, parse_tolerances
+from module.grpc_options import channel_options, parse_compression
+from module.reconnect import DecorrelatedJitter, ReconnectManager
+from module.spool import SampleBuffer, Spool
 import logging
 import os
-import time
 
 def main():
     logging.basicConfig(
@@ -12,29 +17,110 @@ def main():
     logging.info("Starting monitor agent...")
 
     config_manager = ConfigManager()
-    grpc_addr = os.environ.get('GRPC_ADDR', 'localhost:50051')
-    retry_interval = int(os.environ.get('RETRY_INTERVAL', '5'))
-
-    while True:
-        try:
-            logging.info(f"Connecting to gRPC server at {grpc_addr}...")
-            grpc_client = GRPCClient(
-                address=grpc_addr,
-                plugin_manager=PlugingManager(),
-                config_manager=config_manager,
-            )
-            grpc_client.run()
-            
-            # Nếu run() kết thúc bình thường (không phải exception)
-            logging.warning("gRPC connection closed. Reconnecting...")
-            
-        except KeyboardInterrupt:
-            logging.info("Shutting down gracefully...")
-            break
-        except Exception as e:
-            logging.error(f"Error occurred: {e}. Retrying in {retry_interval} seconds...")
-        
-        time.sleep(retry_interval)
+    # Một hoặc nhiều server, cách nhau dấu phẩy, ví dụ "server-a:50051,server-b:50051"
+    grpc_addrs = parse_addresses(os.environ.get('GRPC_ADDR', 'localhost:50051'))
+    # Danh sách replica động: key/prefix etcd (GRPC_SERVERS_ETCD_KEY) hoặc tên DNS
+    # (GRPC_SERVERS_DNS, ví dụ headless Service "monitor-server-headless:50051");
+    # không đặt thì dùng GRPC_ADDR. Làm mới mỗi GRPC_RESOLVE_INTERVAL giây.
+    servers_etcd_key = os.environ.get('GRPC_SERVERS_ETCD_KEY', '')
+    servers_dns = os.environ.get('GRPC_SERVERS_DNS', '')
+    resolve_interval = float(os.environ.get('GRPC_RESOLVE_INTERVAL', '30'))
+    # Backoff kết nối lại: ngẫu nhiên trong [RETRY_INTERVAL, 3 * lần trước], tối đa RETRY_MAX_INTERVAL
+    retry_interval = float(os.environ.get('RETRY_INTERVAL', '1'))
+    retry_max_interval = float(os.environ.get('RETRY_MAX_INTERVAL', '60'))
+    batch_mode = os.environ.get('BATCH_MODE', 'auto').lower()
+    # Host groups used by the server to target commands, e.g. "gpu,rack-a"
+    groups = [g.strip() for g in os.environ.get('AGENT_GROUPS', '').split(',') if g.strip()]
+    # Labels used by label selectors, e.g. "zone=a,tier=web"
+    labels = dict(
+        pair.split('=', 1) for pair in os.environ.get('AGENT_LABELS', '').split(',') if '=' in pair
+    )
+    # Plugin chạy song song; plugin quá PLUGIN_TIMEOUT giây sinh sample "Timeout"
+    plugin_workers = int(os.environ.get('PLUGIN_WORKERS', '4'))
+    plugin_timeout = float(os.environ.get('PLUGIN_TIMEOUT', '2'))
+    # Độ lệch lịch giữa các agent, theo phần của interval (0 = không lệch)
+    schedule_jitter = float(os.environ.get('SCHEDULE_JITTER', '1'))
+    # Deadband theo metric, ví dụ "memory=0.5,process_count=0" (rỗng = tắt);
+    # mỗi metric vẫn được gửi đầy đủ ít nhất mỗi KEYFRAME_INTERVAL giây
+    tolerances = parse_tolerances(os.environ.get('DEADBAND', ''))
+    deadband = Deadband(
+        tolerances, keyframe_interval=float(os.environ.get('KEYFRAME_INTERVAL', '60'))
+    ) if tolerances else None
+    # Nén message (none/gzip/deflate) và keepalive của channel gRPC
+    compression = parse_compression(os.environ.get('GRPC_COMPRESSION', 'none'))
+    options = channel_options()
+    # Backoff nội bộ của channel không được dài hơn backoff của vòng kết nối lại
+    options.append(('grpc.max_reconnect_backoff_ms', int(retry_max_interval * 1000)))
+
+    # Spool trên đĩa giữ sample khi mất kết nối server, replay khi kết nối lại
+    spool = Spool(
+        directory=os.environ.get('SPOOL_DIR', 'spool'),
+        segment_bytes=int(float(os.environ.get('SPOOL_SEGMENT_MB', '4')) * 1024 * 1024),
+        max_bytes=int(float(os.environ.get('SPOOL_MAX_MB', '256')) * 1024 * 1024),
+        policy=os.environ.get('SPOOL_POLICY', 'drop_oldest').lower(),
+    )
+    buffer = SampleBuffer(
+        spool,
+        replay_batch=int(os.environ.get('SPOOL_REPLAY_BATCH', '100')),
+        replay_rate=float(os.environ.get('SPOOL_REPLAY_RATE', '2')),
+        # Batch đã gửi chỉ coi là tới server sau chừng này giây (> keepalive time + timeout)
+        inflight_window=float(os.environ.get('SPOOL_INFLIGHT_SECONDS', '60')),
+    )
+
+    # Collector chạy suốt đời agent, không phụ thuộc vào kết nối gRPC
+    collector = MetricCollector(
+        plugin_manager=PlugingManager(),
+        config_manager=config_manager,
+        sink=buffer,
+        plugin_workers=plugin_workers,
+        plugin_timeout=plugin_timeout,
+        jitter=schedule_jitter,
+    )
+    collector.start()
+
+    if servers_etcd_key:
+        resolver = EtcdResolver(config_manager, servers_etcd_key)
+    elif servers_dns:
+        resolver = DnsResolver(servers_dns)
+    else:
+        resolver = StaticResolver(grpc_addrs)
+    # Consistent hashing theo hostname: kết nối lại luôn về cùng một replica
+    balancer = ServerBalancer(
+        resolver,
+        fallback=grpc_addrs,
+        refresh_interval=resolve_interval,
+        failure_ttl=retry_max_interval,
+    )
+    grpc_addr = balancer.pick()
+
+    # Một client cho cả đời agent; channel chỉ được mở lại khi đổi replica
+    logging.info(f"Connecting to gRPC server at {grpc_addr} (servers: {balancer.servers})...")
+    grpc_client = GRPCClient(
+        address=grpc_addr,
+        collector=collector,
+        buffer=buffer,
+        config_manager=config_manager,
+        batch_mode=batch_mode,
+        groups=groups,
+        labels=labels,
+        deadband=deadband,
+        options=options,
+        compression=compression,
+    )
+    reconnect = ReconnectManager(
+        grpc_client, DecorrelatedJitter(retry_interval, retry_max_interval), balancer=balancer
+    )
+
+    try:
+        reconnect.run_forever()
+    except KeyboardInterrupt:
+        logging.info("Shutting down gracefully...")
+    finally:
+        reconnect.stop()
+        buffer.go_offline()
+        collector.stop()
+        grpc_client.close()
+        spool.close()
 
 if __name__ == "__main__":
     main()
\ No newline at end of file
@@ -0,0 +1,249 @@
+import bisect
+import hashlib
+import json
+import logging
+import socket
+import threading
+import time
+from typing import Callable, Dict, Iterable, List, Optional
+
+
+def _hash(key: str) -> int:
+    # md5 chỉ dùng để rải đều, không phải bảo mật; ổn định giữa các process
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+
+class HashRing:
+    """
+    Consistent hashing: mỗi server có `vnodes` điểm trên vòng, agent thuộc
+    về server đầu tiên theo chiều kim đồng hồ tính từ hash(hostname).
+    Thêm hoặc bớt một server trong N chỉ chuyển khoảng 1/N agent; các
+    agent còn lại giữ nguyên server.
+    """
+
+    def __init__(self, nodes: Iterable[str] = (), vnodes: int = 100) -> None:
+        self.vnodes = vnodes
+        self.nodes = sorted(set(nodes))
+        points = sorted((_hash(f"{node}#{i}"), node) for node in self.nodes for i in range(vnodes))
+        self._hashes = [h for h, _ in points]
+        self._owners = [node for _, node in points]
+
+    def candidates(self, key: str) -> List[str]:
+        """Các server theo thứ tự ưu tiên cho `key` (server chính trước, rồi các server dự phòng)."""
+        if not self._hashes:
+            return []
+        start = bisect.bisect(self._hashes, _hash(key))
+        ordered: List[str] = []
+        for i in range(len(self._owners)):
+            node = self._owners[(start + i) % len(self._owners)]
+            if node not in ordered:
+                ordered.append(node)
+                if len(ordered) == len(self.nodes):
+                    break
+        return ordered
+
+    def get(self, key: str) -> Optional[str]:
+        candidates = self.candidates(key)
+        return candidates[0] if candidates else None
+
+
+def parse_addresses(value: str) -> List[str]:
+    """"a:50051, b:50051" -> ["a:50051", "b:50051"]"""
+    return [addr.strip() for addr in value.split(",") if addr.strip()]
+
+
+class StaticResolver:
+    """Danh sách server cố định (GRPC_ADDR có thể là nhiều địa chỉ, cách nhau dấu phẩy)."""
+
+    def __init__(self, addresses: Iterable[str]) -> None:
+        self.addresses = sorted(set(addresses))
+
+    def resolve(self) -> Optional[List[str]]:
+        return list(self.addresses)
+
+    def __str__(self) -> str:
+        return ",".join(self.addresses)
+
+
+class DnsResolver:
+    """
+    Phân giải một tên DNS ra mọi địa chỉ IP, ví dụ headless Service của
+    k8s ("monitor-server-headless:50051") trả về IP của mọi pod server
+    đang ready.
+    """
+
+    def __init__(self, target: str) -> None:
+        host, _, port = target.rpartition(":")
+        self.host = host.strip("[]")
+        self.port = int(port)
+
+    def resolve(self) -> Optional[List[str]]:
+        try:
+            infos = socket.getaddrinfo(self.host, self.port, proto=socket.IPPROTO_TCP)
+        except OSError as e:
+            logging.getLogger(__name__).warning(f"DNS lookup of {self.host} failed: {e}")
+            return None
+        addresses = set()
+        for family, _, _, _, sockaddr in infos:
+            ip = sockaddr[0]
+            addresses.add(f"[{ip}]:{self.port}" if family == socket.AF_INET6 else f"{ip}:{self.port}")
+        return sorted(addresses)
+
+    def __str__(self) -> str:
+        return f"dns:{self.host}:{self.port}"
+
+
+class EtcdResolver:
+    """
+    Đọc danh sách server từ etcd, qua client etcd của ConfigManager.
+    Key có thể là một key chứa JSON list (["10.0.0.5:50051", ...]) hoặc
+    một prefix ("/monitor/servers/") với mỗi server một key, value là
+    "host:port" (server đăng ký kèm lease thì tự biến mất khi chết).
+    """
+
+    def __init__(self, config_manager, key: str) -> None:
+        self.config_manager = config_manager
+        self.key = key
+
+    def resolve(self) -> Optional[List[str]]:
+        client = self.config_manager.client
+        if client is None:
+            # etcd chưa kết nối được: giữ danh sách cũ
+            return None
+        try:
+            if self.key.endswith("/"):
+                values = [value.decode() for value, _ in client.get_prefix(self.key)]
+            else:
+                value, _ = client.get(self.key)
+                values = json.loads(value.decode()) if value else []
+        except Exception as e:
+            logging.getLogger(__name__).warning(f"Reading servers from etcd key {self.key} failed: {e}")
+            return None
+        return sorted({addr.strip() for addr in values if addr and addr.strip()})
+
+    def __str__(self) -> str:
+        return f"etcd:{self.key}"
+
+
+class ServerBalancer:
+    """
+    Chọn server cho agent này trong các replica: consistent hashing theo
+    hostname, nên kết nối lại vẫn về đúng replica cũ.
+
+    Danh sách server được làm mới mỗi `refresh_interval` giây. Khi replica
+    được thêm/bớt mà server chính của agent đổi, `on_rebalance` được gọi
+    (GRPCClient ngắt stream hiện tại để kết nối sang server mới). Server
+    kết nối thất bại bị bỏ qua trong `failure_ttl` giây, agent dùng server
+    kế tiếp trên vòng; hết thời gian đó, agent chỉ quay về server chính
+    khi mở được kết nối TCP tới nó.
+    Resolver trả về danh sách rỗng/None thì giữ danh sách cũ, rồi đến
+    `fallback`.
+    """
+
+    def __init__(
+        self,
+        resolver,
+        key: str = None,
+        fallback: Iterable[str] = (),
+        refresh_interval: float = 30.0,
+        failure_ttl: float = 60.0,
+        vnodes: int = 100,
+        on_rebalance: Optional[Callable[[str], None]] = None,
+    ) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.resolver = resolver
+        self.key = key or socket.gethostname()
+        self.fallback = sorted(set(fallback))
+        self.refresh_interval = refresh_interval
+        self.failure_ttl = failure_ttl
+        self.vnodes = vnodes
+        self.on_rebalance = on_rebalance
+
+        self._lock = threading.Lock()
+        self._ring = HashRing(self.fallback, vnodes)
+        self._failed: Dict[str, float] = {}
+        self.current: Optional[str] = None
+        # Server đã báo rebalance sang, để không báo lại khi agent còn đang backoff
+        self._signalled: Optional[str] = None
+        self._stop = threading.Event()
+        self._thread = None
+        self.refresh()
+
+    @property
+    def servers(self) -> List[str]:
+        return list(self._ring.nodes)
+
+    def refresh(self) -> bool:
+        """Phân giải lại danh sách server. :return: True nếu danh sách thay đổi"""
+        servers = self.resolver.resolve() or self.servers or self.fallback
+        with self._lock:
+            if servers == self._ring.nodes:
+                return False
+            old = self._ring.nodes
+            self._ring = HashRing(servers, self.vnodes)
+            for addr in list(self._failed):
+                if addr not in servers:
+                    del self._failed[addr]
+        self.logger.info(f"Servers from {self.resolver}: {old} -> {servers}")
+        return True
+
+    def pick(self) -> Optional[str]:
+        """Server để kết nối lần tới: server đầu tiên trên vòng chưa bị đánh dấu lỗi."""
+        now = time.monotonic()
+        with self._lock:
+            candidates = self._ring.candidates(self.key)
+            healthy = [addr for addr in candidates if self._failed.get(addr, 0) <= now]
+            chosen = (healthy or candidates or [None])[0]
+            self.current = chosen
+            self._signalled = None
+        return chosen
+
+    def mark_failed(self, address: str) -> None:
+        with self._lock:
+            self._failed[address] = time.monotonic() + self.failure_ttl
+
+    def mark_ok(self, address: str) -> None:
+        with self._lock:
+            self._failed.pop(address, None)
+
+    def start(self) -> None:
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._refresh_loop, daemon=True)
+            self._thread.start()
+
+    def stop(self) -> None:
+        self._stop.set()
+
+    def _preferred(self) -> Optional[str]:
+        now = time.monotonic()
+        with self._lock:
+            for addr in self._ring.candidates(self.key):
+                if self._failed.get(addr, 0) <= now:
+                    return addr
+        return None
+
+    def _reachable(self, address: str, timeout: float = 1.0) -> bool:
+        host, _, port = address.rpartition(":")
+        try:
+            socket.create_connection((host.strip("[]"), int(port)), timeout=timeout).close()
+            return True
+        except (OSError, ValueError):
+            return False
+
+    def _refresh_loop(self) -> None:
+        while not self._stop.wait(self.refresh_interval):
+            try:
+                self.refresh()
+                preferred = self._preferred()
+                if preferred is None or self.current is None or preferred in (self.current, self._signalled):
+                    continue
+                if preferred in self._failed and not self._reachable(preferred):
+                    # Server chính từng lỗi và vẫn chưa lên: ở lại server dự phòng
+                    self.mark_failed(preferred)
+                    continue
+                self._signalled = preferred
+                self.logger.info(f"Rebalancing: {self.current} -> {preferred}")
+                if self.on_rebalance is not None:
+                    self.on_rebalance(preferred)
+            except Exception as e:
+                self.logger.error(f"Server refresh failed: {e}")
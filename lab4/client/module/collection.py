@@ -0,0 +1,343 @@
+import heapq
+import logging
+import math
+import socket
+import threading
+import time
+import zlib
+from concurrent import futures
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from generated.monitor_pb2 import CommandResponse, MetricBatch
+
+# Giá trị đặc biệt khi plugin không trả kết quả kịp deadline
+TIMEOUT_VALUE = "Timeout"
+
+
+def set_sample_value(sample: CommandResponse, raw_val) -> None:
+    """Ghi giá trị plugin vào field typed tương ứng thay vì str(raw_val)."""
+    if isinstance(raw_val, bool):
+        sample.int_value = int(raw_val)
+    elif isinstance(raw_val, int):
+        sample.int_value = raw_val
+    elif isinstance(raw_val, float):
+        sample.double_value = raw_val
+    elif isinstance(raw_val, dict):
+        try:
+            for key, sub_val in raw_val.items():
+                sample.fields[str(key)] = float(sub_val)
+        except (TypeError, ValueError):
+            sample.fields.clear()
+            sample.value = str(raw_val)
+    else:
+        sample.value = str(raw_val)
+
+
+class CollectionScheduler:
+    """
+    Chạy các plugin song song trên một thread pool.
+
+    Mỗi plugin có deadline riêng (`plugin.timeout`, mặc định `timeout`).
+    Plugin trễ deadline sinh ra sample "Timeout" thay vì chặn cả tick, nên
+    một tick chỉ tốn thời gian bằng plugin chậm nhất (tối đa là deadline).
+    Plugin vẫn đang chạy từ tick trước sẽ không bị submit lại: tick đó
+    nhận luôn sample "Timeout", tránh dồn thread bị treo trong pool.
+    """
+
+    def __init__(self, plugin_manager, max_workers: int = 4, timeout: float = 2.0) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.plugin_manager = plugin_manager
+        self.timeout = timeout
+        self._executor = futures.ThreadPoolExecutor(
+            max_workers=max_workers, thread_name_prefix="plugin"
+        )
+        # metric -> future của lần chạy chưa xong
+        self._running: Dict[str, futures.Future] = {}
+
+    def collect(self, metrics: List[str]) -> List[Tuple[str, Any, str]]:
+        """
+        Thu thập `metrics` song song.
+        :return: [(metric, value, unit)] theo đúng thứ tự `metrics`
+        """
+        start = time.monotonic()
+        jobs = []
+        for metric_name in metrics:
+            plugin = self.plugin_manager.get_plugin(metric_name)
+            if plugin is None:
+                jobs.append((metric_name, None, "N/A", 0.0))
+                continue
+
+            unit = getattr(plugin, "unit", "N/A")
+            deadline = start + (getattr(plugin, "timeout", None) or self.timeout)
+            future = self._running.get(metric_name)
+            if future is not None and not future.done():
+                self.logger.warning(f"Plugin [{metric_name}] is still running, skipping this tick")
+                jobs.append((metric_name, None, unit, None))
+                continue
+
+            future = self._executor.submit(self._run_plugin, metric_name, plugin)
+            self._running[metric_name] = future
+            jobs.append((metric_name, future, unit, deadline))
+
+        results = []
+        for metric_name, future, unit, deadline in jobs:
+            if deadline is None:
+                results.append((metric_name, TIMEOUT_VALUE, unit))
+            elif future is None:
+                results.append((metric_name, "Metric not found", unit))
+            else:
+                results.append((metric_name, self._wait(metric_name, future, deadline), unit))
+        return results
+
+    def _wait(self, metric_name: str, future: futures.Future, deadline: float) -> Any:
+        try:
+            value = future.result(timeout=max(0.0, deadline - time.monotonic()))
+        except futures.TimeoutError:
+            self.logger.warning(f"Plugin [{metric_name}] missed its deadline")
+            return TIMEOUT_VALUE
+        self._running.pop(metric_name, None)
+        return value
+
+    def _run_plugin(self, metric_name: str, plugin) -> Any:
+        try:
+            # Chạy logic thu thập (có thể tốn thời gian/CPU)
+            raw_val = plugin.run()
+            return raw_val if raw_val is not None else "None"
+        except Exception as e:
+            self.logger.error(f"Plugin error [{metric_name}]: {e}")
+            return "Error"
+
+    def close(self) -> None:
+        # Không chờ plugin bị treo
+        self._executor.shutdown(wait=False)
+
+
+# Interval dùng khi config có `interval` không hợp lệ (<= 0, không phải số)
+DEFAULT_INTERVAL = 5.0
+
+
+class IntervalSchedule:
+    """
+    Lịch thu thập theo từng metric (heap theo thời điểm đến hạn).
+
+    Mỗi metric có interval riêng (`intervals` trong config, mặc định là
+    `interval`). Thời điểm đến hạn nằm trên lưới `phase + k * interval`
+    của đồng hồ monotonic, nên thời gian thu thập không làm trôi chu kỳ;
+    tick bị lỡ (backoff, plugin chậm) được bỏ qua thay vì dồn lại.
+    `phase` suy ra từ hostname: cố định qua các lần reconnect, nhưng khác
+    nhau giữa các agent để chúng không gửi cùng một giây. Các metric của
+    một agent đến hạn cùng lúc thì đi chung một batch.
+    """
+
+    def __init__(self, hostname: str, jitter: float = 1.0) -> None:
+        """
+        :param hostname: Dùng để tính phase của agent
+        :param jitter: Độ lệch phase tối đa, tính theo phần của interval (0..1)
+        """
+        self.hostname = hostname
+        self.jitter = jitter
+        # Phase chung của agent (giây, trong 1 giờ); phase của từng metric là
+        # phần dư theo interval, nên các interval bội số của nhau trùng tick
+        self._phase = zlib.crc32(hostname.encode()) / 0xFFFFFFFF * 3600.0
+        self._heap: List[Tuple[float, str]] = []
+        # metric -> (interval, thời điểm đến hạn kế tiếp)
+        self._slots: Dict[str, Tuple[float, float]] = {}
+        # key config không hợp lệ -> giá trị đã báo, để chỉ log một lần
+        self._invalid: Dict[str, Any] = {}
+        self.logger = logging.getLogger(__name__)
+
+    def configure(self, metrics: List[str], interval: float, intervals: Mapping[str, float] = None) -> float:
+        """
+        Cập nhật danh sách metric/interval; metric không đổi giữ nguyên lịch.
+        :return: `interval` đã kiểm tra
+        """
+        intervals = intervals or {}
+        now = time.monotonic()
+        interval = self._checked("interval", interval, DEFAULT_INTERVAL)
+        wanted = {
+            m: self._checked(f"intervals.{m}", intervals[m], interval) if m in intervals else interval
+            for m in metrics
+        }
+
+        for metric in list(self._slots):
+            if metric not in wanted:
+                del self._slots[metric]
+
+        for metric, every in wanted.items():
+            slot = self._slots.get(metric)
+            if slot is not None and slot[0] == every:
+                continue
+            due = self._first_due(every, now)
+            self._slots[metric] = (every, due)
+            heapq.heappush(self._heap, (due, metric))
+        return interval
+
+    def _checked(self, key: str, value: Any, fallback: float) -> float:
+        """Interval từ config (có thể từ etcd); giá trị <= 0 hoặc không phải số thì dùng `fallback`."""
+        try:
+            every = float(value)
+        except (TypeError, ValueError):
+            every = math.nan
+        if every > 0 and math.isfinite(every):
+            self._invalid.pop(key, None)
+            return every
+        if key not in self._invalid or self._invalid[key] != value:
+            self._invalid[key] = value
+            self.logger.warning(f"Invalid {key}={value!r} in config, using {fallback}s")
+        return fallback
+
+    def next_due(self) -> Optional[float]:
+        """Thời điểm (monotonic) metric kế tiếp đến hạn; None nếu không có metric."""
+        while self._heap:
+            due, metric = self._heap[0]
+            if self._is_current(due, metric):
+                return due
+            heapq.heappop(self._heap)
+        return None
+
+    def pop_due(self, now: float, force: bool = False) -> List[str]:
+        """
+        Lấy các metric đã đến hạn và xếp lịch lần kế tiếp.
+        :param force: Trả về mọi metric (vd. vừa nhận command mới);
+                      lịch của metric chưa đến hạn không bị thay đổi
+        """
+        due_metrics = []
+        while self._heap and self._heap[0][0] <= now:
+            due, metric = heapq.heappop(self._heap)
+            if not self._is_current(due, metric):
+                continue
+            every = self._slots[metric][0]
+            # Bỏ qua các tick đã lỡ để giữ đúng lưới
+            missed = int((now - due) // every) + 1
+            next_due = due + missed * every
+            self._slots[metric] = (every, next_due)
+            heapq.heappush(self._heap, (next_due, metric))
+            due_metrics.append(metric)
+
+        if force:
+            due_metrics.extend(m for m in self._slots if m not in due_metrics)
+        return due_metrics
+
+    def _is_current(self, due: float, metric: str) -> bool:
+        # Entry cũ (metric bị xoá hoặc đổi interval) bị bỏ qua khi gặp
+        slot = self._slots.get(metric)
+        return slot is not None and slot[1] == due
+
+    def _first_due(self, every: float, now: float) -> float:
+        phase = (self._phase % every) * self.jitter
+        due = now - (now % every) + phase
+        if due < now:
+            due += every
+        return due
+
+
+class MetricCollector:
+    """
+    Thread thu thập metric, chạy độc lập với gRPC stream.
+
+    Mỗi lần có metric đến hạn, collector tạo một MetricBatch và đưa vào
+    `sink` (SampleBuffer): batch tới stream nếu đang kết nối, ngược lại
+    được ghi vào spool. Nhờ vậy việc thu thập không dừng khi mất server.
+    """
+
+    def __init__(
+        self,
+        plugin_manager,
+        config_manager,
+        sink,
+        plugin_workers: int = 4,
+        plugin_timeout: float = 2.0,
+        jitter: float = 1.0,
+    ) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.plugin_manager = plugin_manager
+        self.config_manager = config_manager
+        self.sink = sink
+        self.hostname = socket.gethostname()
+        # Plugin chạy song song, mỗi plugin có deadline riêng
+        self.scheduler = CollectionScheduler(plugin_manager, plugin_workers, plugin_timeout)
+        # Lịch theo từng metric, không trôi theo thời gian thu thập
+        self.schedule = IntervalSchedule(self.hostname, jitter)
+
+        # Extra delay (seconds) requested by an overloaded server, applied once
+        self.backoff_s = 0.0
+        # Set when a pushed command changes the metrics: collect right away
+        self._wakeup = threading.Event()
+        self._running = False
+        self._thread = threading.Thread(target=self._run, name="collector", daemon=True)
+
+    def start(self) -> None:
+        self._running = True
+        self._thread.start()
+
+    def stop(self) -> None:
+        self._running = False
+        self._wakeup.set()
+        self._thread.join(timeout=5)
+        self.scheduler.close()
+
+    def wake(self) -> None:
+        self._wakeup.set()
+
+    def backoff(self, seconds: float) -> None:
+        self.backoff_s = seconds
+
+    def _run(self) -> None:
+        for metrics in self._ticks():
+            try:
+                self.sink.put(self._collect_batch(metrics))
+            except Exception as e:
+                self.logger.error(f"Collector error: {e}")
+
+    def _ticks(self):
+        """
+        Vòng lặp chính điều phối việc thu thập: yield danh sách metrics
+        đến hạn. Mỗi metric có interval riêng (`intervals` trong config).
+        """
+        last_loaded_paths = []
+        force = False
+
+        while self._running:
+            # 1. Lấy cấu hình snapshot
+            config = self.config_manager.get_config()
+            interval = config.get("interval", 5)
+            metrics = config.get("metrics", [])
+            plugin_paths = config.get("plugins", [])
+
+            # 2. Xử lý reload plugin nếu config thay đổi
+            last_loaded_paths = self._check_and_reload_plugins(plugin_paths, last_loaded_paths)
+            interval = self.schedule.configure(metrics, interval, config.get("intervals"))
+
+            # 3. Thu thập các metric đến hạn (hoặc Heartbeat nếu không có metric nào)
+            due = self.schedule.pop_due(time.monotonic(), force=force)
+            if due or not metrics:
+                yield due
+
+            # 4. Chờ tới metric kế tiếp (cộng thêm backoff nếu server yêu cầu)
+            # Command mới từ server sẽ đánh thức vòng lặp ngay lập tức
+            backoff, self.backoff_s = self.backoff_s, 0.0
+            next_due = self.schedule.next_due()
+            timeout = interval if next_due is None else max(0.0, next_due - time.monotonic())
+            force = self._wakeup.wait(timeout + backoff)
+            self._wakeup.clear()
+
+    def _check_and_reload_plugins(self, current_paths, last_paths):
+        if set(current_paths) != set(last_paths):
+            self.logger.info(f"Plugin config changed. Reloading plugins...")
+            self.plugin_manager.load_plugins(current_paths)
+            return current_paths
+        return last_paths
+
+    def _collect_batch(self, metrics) -> MetricBatch:
+        """Chạy các plugin song song; thời gian bằng plugin chậm nhất."""
+        samples = []
+        for metric_name, raw_val, unit in self.scheduler.collect(metrics):
+            sample = CommandResponse(metric=metric_name, unit=unit)
+            set_sample_value(sample, raw_val)
+            samples.append(sample)
+
+        return MetricBatch(
+            timestamp_ns=time.time_ns(),
+            hostname=self.hostname,
+            samples=samples,
+        )
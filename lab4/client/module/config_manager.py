@@ -46,6 +46,9 @@ class ConfigManager:
         
         # 2. Lưu available metrics từ etcd (để validate commands)
         self.available_metrics = self.config.get("metrics", [])
+
+        # 3. Version của command server đang áp dụng (0 = chưa có command)
+        self.command_version = 0
         
         self.hostname = socket.gethostname()
         self.client = None
@@ -110,11 +113,15 @@ class ConfigManager:
         """Lấy danh sách metrics có sẵn từ etcd"""
         return self.available_metrics
 
-    def update_local_metrics(self, new_metrics):
+    def update_local_metrics(self, new_metrics, version=0):
         """
         Cập nhật metrics cục bộ (không gửi lên etcd)
         Chỉ chấp nhận metrics là tập con của available_metrics
+        :param version: version của command; bỏ qua nếu đã áp dụng version này
         """
+        if version and version == self.command_version:
+            return True
+
         # Validate: new_metrics phải là tập con của available_metrics
         valid_metrics = [m for m in new_metrics if m in self.available_metrics]
         
@@ -130,6 +137,16 @@ class ConfigManager:
         new_conf = self.config.copy()
         new_conf["metrics"] = valid_metrics
         self.config = new_conf
+        self.command_version = version
         
-        self.logger.info(f"Local metrics updated to: {valid_metrics}")
-        return True
\ No newline at end of file
+        self.logger.info(f"Local metrics updated to: {valid_metrics} (version={version})")
+        return True
+
+    def reset_local_metrics(self):
+        """Command hết hạn: quay về danh sách metrics mặc định từ etcd"""
+        new_conf = self.config.copy()
+        new_conf["metrics"] = list(self.available_metrics)
+        self.config = new_conf
+        self.command_version = 0
+
+        self.logger.info(f"Local metrics reset to: {new_conf['metrics']}")
@@ -0,0 +1,100 @@
+import logging
+import time
+from typing import Dict, Mapping, Optional, Tuple, Union
+
+from generated.monitor_pb2 import MetricBatch
+
+Value = Union[float, Dict[str, float]]
+
+
+def parse_tolerances(spec: str) -> Dict[str, float]:
+    """"memory=0.5,process_count=0" -> {"memory": 0.5, "process_count": 0.0}"""
+    tolerances = {}
+    for part in spec.split(","):
+        if "=" in part:
+            metric, tolerance = part.split("=", 1)
+            tolerances[metric.strip()] = float(tolerance)
+    return tolerances
+
+
+class Deadband:
+    """
+    Bỏ bớt sample gần như không đổi trên stream live (chỉ BatchStream).
+
+    Sample của metric có trong `tolerances` bị bỏ khi mọi giá trị của nó
+    lệch không quá tolerance (tuyệt đối) so với giá trị *đã gửi* lần
+    trước; tên metric được ghi vào `MetricBatch.unchanged` để phía
+    analysis lặp lại giá trị cũ (forward-fill). So với giá trị đã gửi,
+    không phải giá trị vừa đo, nên thay đổi chậm vẫn được gửi khi cộng
+    dồn vượt tolerance.
+
+    Mỗi metric vẫn được gửi đầy đủ ít nhất mỗi `keyframe_interval` giây
+    (keyframe), chứng tỏ agent còn sống và sửa lệch nếu analysis bị mất
+    giá trị cũ (ví dụ khởi động lại).
+    """
+
+    def __init__(self, tolerances: Mapping[str, float], keyframe_interval: float = 60.0) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.tolerances = dict(tolerances)
+        self.keyframe_interval = keyframe_interval
+        # metric -> (giá trị đã gửi, thời điểm gửi theo monotonic)
+        self._sent: Dict[str, Tuple[Value, float]] = {}
+        self.suppressed = 0
+
+    def reset(self) -> None:
+        """Quên giá trị đã gửi: batch kế tiếp được gửi đầy đủ (dùng khi kết nối lại)."""
+        self._sent.clear()
+
+    def filter(self, batch: MetricBatch, now: Optional[float] = None) -> MetricBatch:
+        """Bỏ các sample trong deadband khỏi `batch` (sửa tại chỗ)."""
+        if not self.tolerances or not batch.samples:
+            return batch
+        now = time.monotonic() if now is None else now
+
+        keep = []
+        unchanged = []
+        for sample in batch.samples:
+            tolerance = self.tolerances.get(sample.metric)
+            value = _numeric_value(sample)
+            if tolerance is None or value is None:
+                # Metric không cấu hình, hoặc "Error"/"Timeout": luôn gửi
+                self._sent.pop(sample.metric, None)
+                keep.append(sample)
+                continue
+
+            sent = self._sent.get(sample.metric)
+            if (
+                sent is not None
+                and now - sent[1] < self.keyframe_interval
+                and _within(value, sent[0], tolerance)
+            ):
+                unchanged.append(sample.metric)
+                continue
+            self._sent[sample.metric] = (value, now)
+            keep.append(sample)
+
+        if unchanged:
+            self.suppressed += len(unchanged)
+            del batch.samples[:]
+            batch.samples.extend(keep)
+            batch.unchanged.extend(unchanged)
+        return batch
+
+
+def _numeric_value(sample) -> Optional[Value]:
+    kind = sample.WhichOneof("typed_value")
+    if kind is not None:
+        return float(getattr(sample, kind))
+    if sample.fields:
+        return dict(sample.fields)
+    return None
+
+
+def _within(value: Value, sent: Value, tolerance: float) -> bool:
+    if isinstance(value, dict):
+        if not isinstance(sent, dict) or value.keys() != sent.keys():
+            return False
+        return all(abs(v - sent[k]) <= tolerance for k, v in value.items())
+    if isinstance(sent, dict):
+        return False
+    return abs(value - sent) <= tolerance
@@ -1,56 +1,193 @@
 import grpc
 from generated.monitor_pb2_grpc import MonitorServiceStub
 from generated.monitor_pb2 import CommandRequest, CommandResponse
+from typing import Any, Optional, Sequence, Tuple
+from module.collection import MetricCollector
+from module.deadband import Deadband
+from module.spool import SampleBuffer
 
 # from constant import MetricType # Bỏ hoặc không dùng tới nữa vì dùng string từ etcd
-import datetime
-import socket
 import time
+import socket
+import threading
 import logging
 
+
 class GRPCClient:
     
-    def __init__(self, address: str, plugin_manager, config_manager) -> None:
-        self.channel = grpc.insecure_channel(address)
-        self.stub = MonitorServiceStub(self.channel)
-
-        self.plugin_manager = plugin_manager
+    def __init__(
+        self,
+        address: str,
+        collector: MetricCollector,
+        buffer: SampleBuffer,
+        config_manager,
+        batch_mode: str = "auto",
+        groups=(),
+        labels=None,
+        connect_timeout: float = 10.0,
+        deadband: Optional[Deadband] = None,
+        options: Sequence[Tuple[str, Any]] = (),
+        compression: grpc.Compression = grpc.Compression.NoCompression,
+    ) -> None:
+        """
+        :param options: channel options (keepalive, flow control; see module.grpc_options)
+        :param compression: nén mọi message gửi lên server (gzip/deflate)
+        """
+        self.options = list(options)
+        self.compression = compression
+        self.address = None
+        self.connect(address)
+        # Stream đang chạy, để interrupt() có thể hủy nó
+        self._call = None
+        # Được set bởi interrupt(), kể cả khi chưa có stream (đang chờ channel);
+        # giữ nguyên tới khi người gọi clear() trước lần kết nối sau
+        self.interrupted = threading.Event()
+
+        # Collector chạy ở thread riêng; client chỉ gửi những gì nằm trong buffer
+        self.collector = collector
+        self.buffer = buffer
         self.config_manager = config_manager 
-        self.plugin_manager.load_plugins()
+        self.connect_timeout = connect_timeout
+
+        # "on": BatchStream only, "off": legacy CommandStream only,
+        # "auto": try BatchStream and fall back if the server does not implement it.
+        self.configured_batch_mode = batch_mode
+        # Chế độ của phiên hiện tại: "auto" có thể thành "off" tới lần run() sau
+        # (server mới/đã nâng cấp được thử BatchStream lại)
+        self.batch_mode = batch_mode
+        # Bỏ sample không đổi trên BatchStream (CommandStream không có `unchanged`)
+        self.deadband = deadband
 
         self.recived_commands = []
+        # Sent as stream metadata so the server can target this agent
+        self.metadata = (
+            ("x-monitor-hostname", socket.gethostname()),
+            ("x-monitor-groups", ",".join(groups)),
+            ("x-monitor-labels", ",".join(f"{k}={v}" for k, v in (labels or {}).items())),
+        )
         self.logger = logging.getLogger(__name__)
-        self.logger.info(f"GRPCClient initialized with address: {address}")
+        self.logger.info(f"GRPCClient initialized with address: {address} (batch_mode={batch_mode})")
+
+    def connect(self, address: str) -> None:
+        """
+        Đổi server đích. Cùng địa chỉ thì giữ channel cũ; địa chỉ khác thì
+        đóng channel cũ và mở channel mới (gọi giữa hai lần run()).
+        """
+        if address == self.address:
+            return
+        if self.address is not None:
+            self.logger.info(f"Switching gRPC server: {self.address} -> {address}")
+            self.close()
+        self.address = address
+        self.channel = grpc.insecure_channel(address, options=self.options, compression=self.compression)
+        self.stub = MonitorServiceStub(self.channel)
 
-    def run(self):
-        responses = self.stub.CommandStream(self.command_stream())
+    def interrupt(self) -> None:
+        """Hủy stream đang chạy (khi rebalance); run() trả về ngay."""
+        # Set trước khi đọc _call: run() gán _call rồi mới kiểm tra cờ,
+        # nên một trong hai bên chắc chắn hủy stream
+        self.interrupted.set()
+        call = self._call
+        if call is not None:
+            call.cancel()
+
+    def _start(self, call):
+        """Ghi nhận stream vừa mở; hủy ngay nếu interrupt() đã được gọi trước đó."""
+        self._call = call
+        if self.interrupted.is_set():
+            call.cancel()
+        return call
+
+    def run(self) -> float:
+        """
+        Một phiên kết nối: chờ channel sẵn sàng rồi stream tới khi lỗi.
+        Channel được giữ lại sau khi run() trả về, nên gọi run() lần nữa
+        dùng lại channel (gRPC tự kết nối lại); gọi close() khi tắt agent.
+        :return: số giây stream đã hoạt động (0 nếu không kết nối được)
+        """
+        if self.interrupted.is_set():
+            # Rebalance trước khi kịp mở stream: để người gọi chọn server mới
+            return 0.0
+        connected_at = None
+        self.batch_mode = self.configured_batch_mode
         try:
-            for response in responses:
-                response: CommandRequest
-                command_list = list(response.commandList)
-                self.logger.info(f"Received command from server: {command_list}")
-
-                # Cập nhật metrics nội bộ nếu command khác với trước đó
-                if command_list != self.recived_commands:
-                    self.recived_commands = command_list
-                    
-                    # Lấy available metrics từ etcd để validate
-                    available = self.config_manager.get_available_metrics()
-                    self.logger.info(f"Available metrics from etcd: {available}")
-                    
-                    # Cập nhật local metrics (sẽ tự động validate)
-                    success = self.config_manager.update_local_metrics(self.recived_commands)
-                    if success:
-                        self.logger.info(f"Local metrics updated to: {self.recived_commands}")
-                    else:
-                        self.logger.error("Failed to update local metrics.")
+            # Chỉ nhận batch live khi đã kết nối; trước đó batch nằm trong spool
+            grpc.channel_ready_future(self.channel).result(timeout=self.connect_timeout)
+            connected_at = time.monotonic()
+            self.buffer.go_online()
+            if self.deadband is not None:
+                # Server mới có thể chưa có giá trị nào: bắt đầu bằng keyframe
+                self.deadband.reset()
+
+            if self.batch_mode in ("auto", "on"):
+                try:
+                    self._handle_responses(
+                        self._start(self.stub.BatchStream(self.batch_stream(), metadata=self.metadata))
+                    )
+                except grpc.RpcError as e:
+                    if self.batch_mode != "auto" or e.code() != grpc.StatusCode.UNIMPLEMENTED:
+                        raise
+                    self.logger.warning("Server does not support BatchStream. Falling back to CommandStream.")
+                    self.batch_mode = "off"
+
+            if self.batch_mode == "off":
+                self._handle_responses(
+                    self._start(self.stub.CommandStream(self.command_stream(), metadata=self.metadata))
+                )
+        except grpc.FutureTimeoutError:
+            self.logger.error(f"Server not reachable within {self.connect_timeout}s")
         except grpc.RpcError as e:
-            self.logger.error(f"RPC error: {e.code()} - {e.details()}")
+            if e.code() == grpc.StatusCode.CANCELLED:
+                self.logger.info(f"Stream to {self.address} cancelled.")
+            else:
+                self.logger.error(f"RPC error: {e.code()} - {e.details()}")
         except Exception as e:
             self.logger.error(f"Error: {e}")
         finally:
-            self.close()
-    
+            self._call = None
+            self.buffer.go_offline()
+        return 0.0 if connected_at is None else time.monotonic() - connected_at
+
+
+    def _handle_responses(self, responses):
+        for response in responses:
+            response: CommandRequest
+            command_list = list(response.commandList)
+            self.logger.info(f"Received command from server: {command_list} (version={response.version})")
+
+            if response.backoff_ms > 0:
+                self.logger.warning(f"Server overloaded. Backing off {response.backoff_ms} ms.")
+                self.collector.backoff(response.backoff_ms / 1000.0)
+
+            if response.version:
+                # Server có version: chỉ áp dụng lại khi version thay đổi
+                changed = response.version != self.config_manager.command_version
+            elif not command_list and self.config_manager.command_version and not response.backoff_ms:
+                # Command đã hết hạn (TTL) -> quay về metrics mặc định
+                self.recived_commands = []
+                self.config_manager.reset_local_metrics()
+                self.collector.wake()
+                continue
+            else:
+                # Server cũ: so sánh danh sách như trước
+                changed = command_list != self.recived_commands
+
+            # Cập nhật metrics nội bộ nếu command khác với trước đó
+            if changed:
+                self.recived_commands = command_list
+
+                # Lấy available metrics từ etcd để validate
+                available = self.config_manager.get_available_metrics()
+                self.logger.info(f"Available metrics from etcd: {available}")
+
+                # Cập nhật local metrics (sẽ tự động validate)
+                success = self.config_manager.update_local_metrics(self.recived_commands, response.version)
+                if success:
+                    self.logger.info(f"Local metrics updated to: {self.recived_commands}")
+                    self.collector.wake()
+                else:
+                    self.logger.error("Failed to update local metrics.")
+
     def close(self):
         """Đóng channel gRPC để giải phóng tài nguyên."""
         try:
@@ -60,66 +197,52 @@ class GRPCClient:
             self.logger.error(f"Error closing channel: {e}")
 
     def command_stream(self):
-        """Vòng lặp chính điều phối luồng gửi dữ liệu."""
-        last_loaded_paths = []
-
-        while True:
-            # 1. Lấy cấu hình snapshot
-            config = self.config_manager.get_config()
-            interval = config.get("interval", 5)
-            metrics = config.get("metrics", [])
-            plugin_paths = config.get("plugins", [])
-
-            # 2. Xử lý reload plugin nếu config thay đổi
-            last_loaded_paths = self._check_and_reload_plugins(plugin_paths, last_loaded_paths)
-
-            # 3. Gửi dữ liệu (hoặc Heartbeat)
-            if metrics:
-                for metric_name in metrics:
-                    yield self._collect_metric_data(metric_name)
+        """Legacy mode: one CommandResponse per metric per tick."""
+        for batch in self._frames():
+            if batch.samples:
+                for sample in batch.samples:
+                    if not sample.timestamp_ns and not sample.timestamp:
+                        sample.timestamp_ns = batch.timestamp_ns
+                        sample.timestamp = batch.timestamp
+                    sample.hostname = batch.hostname
+                    yield sample
             else:
                 # Nếu không có metric nào, gửi tin nhắn rỗng để giữ kết nối Server
                 yield self._create_heartbeat()
 
-            # 4. Ngủ theo cấu hình
-            time.sleep(interval)
-
-
-    def _check_and_reload_plugins(self, current_paths, last_paths):
-        if set(current_paths) != set(last_paths):
-            self.logger.info(f"Plugin config changed. Reloading plugins...")
-            self.plugin_manager.load_plugins(current_paths)
-            return current_paths
-        return last_paths
-
-    def _collect_metric_data(self, metric_name):
-        plugin = self.plugin_manager.get_plugin(metric_name)
-        
-        value = "Metric not found"
-        unit = "N/A"
-
-        if plugin:
-            try:
-                # Chạy logic thu thập (có thể tốn thời gian/CPU)
-                raw_val = plugin.run()
-                value = str(raw_val) if raw_val is not None else "None"
-                unit = getattr(plugin, "unit", "N/A")
-            except Exception as e:
-                self.logger.error(f"Plugin error [{metric_name}]: {e}")
-                value = "Error"
-
-        return CommandResponse(
-            timestamp=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
-            hostname=socket.gethostname(),
-            metric=metric_name,
-            value=value,
-            unit=unit,
-        )
+    def batch_stream(self):
+        """Batch mode: one MetricBatch per tick. An empty batch doubles as heartbeat."""
+        yield from self._frames(self.deadband)
+
+    def _frames(self, deadband: Optional[Deadband] = None):
+        """
+        Batch live từ collector được ưu tiên; khi không có batch live, gửi
+        backlog trong spool theo rate limit của buffer. Frame chỉ được xác
+        nhận (replay được ack trong spool) sau `inflight_window` giây của
+        buffer; stream đóng trước đó thì chúng được gửi lại.
+        `deadband` chỉ lọc batch live; backlog replay được gửi đầy đủ.
+        """
+        while self.buffer.online:
+            self.buffer.confirm()
+            batch = self.buffer.wait_live(0)
+            if batch is not None:
+                yield batch if deadband is None else deadband.filter(batch)
+                continue
+
+            replay = self.buffer.next_replay()
+            if replay is not None:
+                yield replay
+                continue
+
+            delay = self.buffer.replay_delay()
+            batch = self.buffer.wait_live(1.0 if delay is None else min(delay, 1.0))
+            if batch is not None:
+                yield batch if deadband is None else deadband.filter(batch)
 
     def _create_heartbeat(self):
         # self.logger.debug("Sending heartbeat...")
         return CommandResponse(
-            timestamp=datetime.datetime.now().strftime("%Y-%m-%d %H:%M:%S"),
+            timestamp_ns=time.time_ns(),
             hostname=socket.gethostname(),
             metric="heartbeat",
             value="alive",
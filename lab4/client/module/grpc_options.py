@@ -0,0 +1,46 @@
+import os
+from typing import Any, List, Mapping, Tuple
+
+import grpc
+
+COMPRESSION = {
+    "none": grpc.Compression.NoCompression,
+    "gzip": grpc.Compression.Gzip,
+    "deflate": grpc.Compression.Deflate,
+}
+
+
+def parse_compression(name: str) -> grpc.Compression:
+    """"gzip" -> grpc.Compression.Gzip; tên lạ thì báo lỗi ngay lúc khởi động."""
+    try:
+        return COMPRESSION[(name or "none").lower()]
+    except KeyError:
+        raise ValueError(f"Unknown gRPC compression: {name} (expected one of {', '.join(COMPRESSION)})")
+
+
+def channel_options(env: Mapping[str, str] = os.environ) -> List[Tuple[str, Any]]:
+    """
+    Option cho channel của agent, đọc từ biến môi trường.
+
+    Keepalive: ping HTTP/2 mỗi GRPC_KEEPALIVE_TIME_MS (mặc định 30s), kết
+    nối bị coi là chết nếu không có ack sau GRPC_KEEPALIVE_TIMEOUT_MS
+    (mặc định 10s); 0 = tắt. Server phải cho phép ping dày như vậy
+    (GRPC_MIN_PING_INTERVAL_MS phía server), nếu không sẽ bị GOAWAY.
+    Flow control: GRPC_HTTP2_BDP_PROBE (0/1) và GRPC_HTTP2_LOOKAHEAD_BYTES
+    (cửa sổ ban đầu của mỗi stream); không đặt thì dùng mặc định của gRPC.
+    """
+    options: List[Tuple[str, Any]] = []
+    keepalive_ms = int(env.get("GRPC_KEEPALIVE_TIME_MS", "30000"))
+    if keepalive_ms > 0:
+        options += [
+            ("grpc.keepalive_time_ms", keepalive_ms),
+            ("grpc.keepalive_timeout_ms", int(env.get("GRPC_KEEPALIVE_TIMEOUT_MS", "10000"))),
+            # Agent idle (deadband, backoff) vẫn phải phát hiện được kết nối chết
+            ("grpc.keepalive_permit_without_calls", 1),
+            ("grpc.http2.max_pings_without_data", 0),
+        ]
+    if env.get("GRPC_HTTP2_BDP_PROBE"):
+        options.append(("grpc.http2.bdp_probe", int(env["GRPC_HTTP2_BDP_PROBE"])))
+    if env.get("GRPC_HTTP2_LOOKAHEAD_BYTES"):
+        options.append(("grpc.http2.lookahead_bytes", int(env["GRPC_HTTP2_LOOKAHEAD_BYTES"])))
+    return options
@@ -4,6 +4,8 @@ from abc import ABC, abstractmethod
 class BasePlugin(ABC):
     unit: str = "N/A"
     name: str = "base"
+    # Deadline (seconds) for one run(); None = CollectionScheduler default
+    timeout: float | None = None
 
     @abstractmethod
     def initialize(self):
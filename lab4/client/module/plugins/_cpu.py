@@ -3,25 +3,82 @@ import subprocess
 import re
 import shutil
 import logging
+import os
+from typing import Optional
 try:
     import psutil
 except Exception:
     psutil = None
 
 
+PROC_STAT = "/proc/stat"
+
+
 class CPUPlugin(BasePlugin):
+    """
+    CPU usage (%) since the previous tick, computed from the aggregate
+    `cpu` line of /proc/stat. Falls back to `top -bn1` / psutil when
+    /proc is not available or use_proc=False.
+    """
     unit = "%"
     name = "cpu"
     
-    def __init__(self):
+    def __init__(self, use_proc: bool = True):
         super().__init__()
+        self.use_proc = use_proc and os.path.exists(PROC_STAT)
+        self.has_top = False
+        self._prev: Optional[tuple[int, int]] = None
 
     def initialize(self):
-        pass
+        if self.use_proc:
+            # Baseline so the first run() already measures one interval
+            self._prev = self._read_proc_stat()
+        else:
+            self.has_top = shutil.which("top") is not None
 
     def run(self) -> float | None:
+        if self.use_proc:
+            return self._run_proc()
+        return self._run_top()
+
+    def _run_proc(self) -> float | None:
+        sample = self._read_proc_stat()
+        if sample is None:
+            return None
+
+        prev, self._prev = self._prev, sample
+        if prev is None:
+            # No baseline yet: average since boot
+            prev = (0, 0)
+
+        total = sample[0] - prev[0]
+        idle = sample[1] - prev[1]
+        if total <= 0:
+            return 0.0
+        return round(100.0 * (total - idle) / total, 2)
+
+    @staticmethod
+    def _read_proc_stat() -> Optional[tuple[int, int]]:
+        """
+        Return (total, idle) jiffies from the aggregate cpu line:
+        user nice system idle iowait irq softirq steal [guest guest_nice]
+        guest time is already counted in user/nice, so only the first 8 count.
+        """
+        try:
+            with open(PROC_STAT, "rb") as f:
+                fields = f.readline().split()
+        except OSError:
+            return None
+        if len(fields) < 5 or fields[0] != b"cpu":
+            return None
+
+        values = [int(v) for v in fields[1:9]]
+        idle = values[3] + values[4]  # idle + iowait
+        return sum(values), idle
+
+    def _run_top(self) -> float | None:
         # Try to use `top` if available, otherwise fall back to psutil if installed
-        if shutil.which("top"):
+        if self.has_top:
             out = self.run_cmd(["top", "-bn1"])
             cpu_line = ""
             for line in out.splitlines():
@@ -55,3 +112,10 @@ class CPUPlugin(BasePlugin):
 
     def cleanup(self):
         pass
+
+
+class CPUCommandPlugin(CPUPlugin):
+    """CPUPlugin backed by `top` (for hosts without a usable /proc)."""
+
+    def __init__(self):
+        super().__init__(use_proc=False)
@@ -1,13 +1,28 @@
 from ._base import BasePlugin
+import os
 import subprocess
 
 class ProcessCountPlugin(BasePlugin):
+    """
+    Number of processes: numeric entries of /proc (one per PID), or
+    `ps aux` when /proc is not available or use_proc=False.
+    """
     name = "process_count"
 
-    def __init__(self):
+    def __init__(self, use_proc: bool = True):
         super().__init__()
+        self.use_proc = use_proc and os.path.isdir("/proc/self")
 
     def run(self) -> int:
+        if self.use_proc:
+            return self._run_proc()
+        return self._run_ps()
+
+    def _run_proc(self) -> int:
+        with os.scandir("/proc") as entries:
+            return sum(1 for entry in entries if entry.name.isdigit())
+
+    def _run_ps(self) -> int:
         out = self.run_cmd(["ps", "aux"])
         return len(out.splitlines()) - 1  # header excluded
 
@@ -21,3 +36,10 @@ class ProcessCountPlugin(BasePlugin):
 
     def initialize(self):
         pass
+
+
+class ProcessCountCommandPlugin(ProcessCountPlugin):
+    """ProcessCountPlugin backed by `ps aux` (for hosts without a usable /proc)."""
+
+    def __init__(self):
+        super().__init__(use_proc=False)
@@ -2,25 +2,64 @@ from ._base import BasePlugin
 import subprocess
 import shutil
 import logging
+import os
 try:
     import psutil
 except Exception:
     psutil = None
 
 
+PROC_MEMINFO = "/proc/meminfo"
+
+
 class RAMPlugin(BasePlugin):
+    """
+    Memory usage (%) = (MemTotal - MemAvailable) / MemTotal from
+    /proc/meminfo. Falls back to `free -m` / psutil when /proc is not
+    available or use_proc=False.
+    """
     unit = "%"
     name = "memory"
 
-    def __init__(self):
+    def __init__(self, use_proc: bool = True):
         super().__init__()
+        self.use_proc = use_proc and os.path.exists(PROC_MEMINFO)
+        self.has_free = False
 
     def initialize(self):
-        pass
+        if not self.use_proc:
+            self.has_free = shutil.which("free") is not None
 
     def run(self) -> float | None:
+        if self.use_proc:
+            return self._run_proc()
+        return self._run_free()
+
+    def _run_proc(self) -> float | None:
+        info = {}
+        try:
+            with open(PROC_MEMINFO, "rb") as f:
+                for line in f:
+                    key, _, rest = line.partition(b":")
+                    if key in (b"MemTotal", b"MemAvailable", b"MemFree", b"Buffers", b"Cached"):
+                        info[key] = int(rest.split()[0])  # kB
+                        if len(info) == 5:
+                            break
+        except OSError:
+            return None
+
+        total = info.get(b"MemTotal")
+        if not total:
+            return None
+        available = info.get(b"MemAvailable")
+        if available is None:
+            # Kernel < 3.14 has no MemAvailable
+            available = info.get(b"MemFree", 0) + info.get(b"Buffers", 0) + info.get(b"Cached", 0)
+        return round((total - available) / total * 100.0, 2)
+
+    def _run_free(self) -> float | None:
         # Try `free` if available, otherwise fall back to psutil
-        if shutil.which("free"):
+        if self.has_free:
             out = self.run_cmd(["free", "-m"])
             for line in out.splitlines():
                 if line.startswith("Mem:"):
@@ -50,3 +89,10 @@ class RAMPlugin(BasePlugin):
 
     def cleanup(self):
         pass
+
+
+class RAMCommandPlugin(RAMPlugin):
+    """RAMPlugin backed by `free` (for hosts without a usable /proc)."""
+
+    def __init__(self):
+        super().__init__(use_proc=False)
@@ -0,0 +1,94 @@
+import logging
+import random
+import threading
+
+
+class DecorrelatedJitter:
+    """
+    Backoff "decorrelated jitter": lần chờ kế tiếp là ngẫu nhiên trong
+    [base, 3 * lần chờ trước], tối đa `cap`. Khi server khởi động lại,
+    các agent mất kết nối cùng lúc nhưng kết nối lại rải rác, không dồn
+    thành một đợt (thundering herd).
+    """
+
+    def __init__(self, base: float = 1.0, cap: float = 60.0, rng: random.Random = None) -> None:
+        self.base = base
+        self.cap = max(cap, base)
+        self._rng = rng or random.Random()
+        self._sleep = base
+
+    def next(self) -> float:
+        """Số giây chờ trước lần kết nối kế tiếp."""
+        self._sleep = min(self.cap, self._rng.uniform(self.base, self._sleep * 3))
+        return self._sleep
+
+    def reset(self) -> None:
+        self._sleep = self.base
+
+
+class ReconnectManager:
+    """
+    Vòng kết nối lại của agent. Dùng lại một GRPCClient (và channel của
+    nó) cho mọi lần kết nối; collector, plugin và trạng thái delta của
+    plugin (diskio, network) không bị khởi tạo lại.
+
+    Giữa hai lần thử là một khoảng backoff DecorrelatedJitter; backoff
+    chỉ được reset khi stream trước đó đã chạy ổn định ít nhất
+    `stable_after` giây, nên server nhận rồi ngắt ngay cũng không làm
+    agent kết nối dồn dập.
+
+    Có `balancer` (ServerBalancer) thì mỗi lần kết nối chọn server theo
+    consistent hashing; server không kết nối được bị đánh dấu lỗi để lần
+    sau thử replica kế tiếp. Khi balancer rebalance, stream hiện tại bị
+    hủy và agent kết nối ngay sang server mới, không chờ backoff.
+    """
+
+    def __init__(self, client, backoff: DecorrelatedJitter, stable_after: float = 30.0, balancer=None) -> None:
+        self.logger = logging.getLogger(__name__)
+        self.client = client
+        self.backoff = backoff
+        self.stable_after = stable_after
+        self.balancer = balancer
+        self._stop = threading.Event()
+        self._rebalance = threading.Event()
+        if balancer is not None:
+            balancer.on_rebalance = self._on_rebalance
+
+    def run_forever(self) -> None:
+        if self.balancer is not None:
+            self.balancer.start()
+        while not self._stop.is_set():
+            address = None
+            # Rebalance trong lúc chờ backoff đã được pick() tính tới
+            self._rebalance.clear()
+            self.client.interrupted.clear()
+            if self.balancer is not None:
+                address = self.balancer.pick()
+                if address is not None:
+                    self.client.connect(address)
+
+            uptime = self.client.run()
+            if uptime >= self.stable_after:
+                self.backoff.reset()
+            if address is not None:
+                if uptime > 0:
+                    self.balancer.mark_ok(address)
+                elif not self._rebalance.is_set():
+                    # Bị rebalance trước khi kịp kết nối thì server không có lỗi
+                    self.balancer.mark_failed(address)
+            if self._stop.is_set():
+                break
+            if self._rebalance.is_set():
+                continue
+            delay = self.backoff.next()
+            self.logger.warning(f"gRPC stream ended after {uptime:.1f}s. Reconnecting in {delay:.1f}s...")
+            self._stop.wait(delay)
+
+    def stop(self) -> None:
+        self._stop.set()
+        if self.balancer is not None:
+            self.balancer.stop()
+
+    def _on_rebalance(self, address: str) -> None:
+        self._rebalance.set()
+        self.client.interrupt()
@@ -0,0 +1,394 @@
+import logging
+import os
+import queue
+import struct
+import threading
+import time
+import zlib
+from collections import deque
+from typing import Deque, List, Optional, Tuple
+
+from generated.monitor_pb2 import MetricBatch
+
+# Header của mỗi record: độ dài payload + crc32 của payload
+_HEADER = struct.Struct("<II")
+_SEGMENT_PREFIX = "seg-"
+_SEGMENT_SUFFIX = ".log"
+_CURSOR_FILE = "cursor"
+
+Position = Tuple[int, int]  # (segment id, offset)
+
+
+class SpoolPolicy:
+    DROP_OLDEST = "drop_oldest"  # xoá segment cũ nhất khi vượt dung lượng
+    DROP_NEWEST = "drop_newest"  # từ chối ghi thêm khi vượt dung lượng
+
+
+class Spool:
+    """
+    Spool ghi-trước trên đĩa: file append-only, chia thành các segment.
+
+    Mỗi record là `<len><crc32><payload>`. Vị trí đã gửi xong (cursor)
+    được lưu riêng trong file `cursor`, nên khởi động lại agent vẫn đọc
+    tiếp đúng chỗ. Record ghi dở lúc crash (sai độ dài / crc) bị cắt bỏ
+    khi mở lại. Segment đọc xong thì bị xoá; khi tổng dung lượng vượt
+    `max_bytes` thì áp dụng `policy`.
+    """
+
+    def __init__(
+        self,
+        directory: str,
+        segment_bytes: int = 4 * 1024 * 1024,
+        max_bytes: int = 256 * 1024 * 1024,
+        policy: str = SpoolPolicy.DROP_OLDEST,
+    ) -> None:
+        if policy not in (SpoolPolicy.DROP_OLDEST, SpoolPolicy.DROP_NEWEST):
+            raise ValueError(f"Unknown spool policy: {policy}")
+
+        self.logger = logging.getLogger(__name__)
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self.max_bytes = max_bytes
+        self.policy = policy
+        self.evicted = 0  # số record bị bỏ do vượt dung lượng
+
+        self._lock = threading.Lock()
+        os.makedirs(directory, exist_ok=True)
+
+        self._segments: List[int] = sorted(
+            int(name[len(_SEGMENT_PREFIX):-len(_SEGMENT_SUFFIX)])
+            for name in os.listdir(directory)
+            if name.startswith(_SEGMENT_PREFIX) and name.endswith(_SEGMENT_SUFFIX)
+        )
+        if not self._segments:
+            self._segments = [1]
+        self._sizes = {seg: self._recover(seg) for seg in self._segments}
+
+        self._cursor = self._load_cursor()
+        self._writer = open(self._path(self._segments[-1]), "ab")
+        self._drop_consumed()
+
+    # ---- ghi ----
+
+    def append(self, payload: bytes) -> bool:
+        """:return: False nếu record bị từ chối (DROP_NEWEST khi đầy)"""
+        record = _HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+        with self._lock:
+            if self._total_bytes() + len(record) > self.max_bytes:
+                if self.policy == SpoolPolicy.DROP_NEWEST:
+                    self.evicted += 1
+                    return False
+                while len(self._segments) > 1 and self._total_bytes() + len(record) > self.max_bytes:
+                    self._evict_oldest()
+
+            active = self._segments[-1]
+            if self._sizes[active] and self._sizes[active] + len(record) > self.segment_bytes:
+                active = self._rotate()
+
+            self._writer.write(record)
+            self._writer.flush()
+            self._sizes[active] += len(record)
+            return True
+
+    # ---- đọc ----
+
+    def read(self, max_records: int, start: Optional[Position] = None) -> Tuple[List[bytes], Position]:
+        """
+        Đọc tối đa `max_records` record từ `start` (mặc định: cursor), không dịch cursor.
+        :return: (payloads, vị trí sau record cuối) để truyền cho ack() / lần read() sau
+        """
+        with self._lock:
+            payloads: List[bytes] = []
+            seg, offset = self._from(start)
+            for current in [s for s in self._segments if s >= seg]:
+                start = offset if current == seg else 0
+                end = self._sizes[current]
+                with open(self._path(current), "rb") as f:
+                    f.seek(start)
+                    while start < end and len(payloads) < max_records:
+                        header = f.read(_HEADER.size)
+                        length, _crc = _HEADER.unpack(header)
+                        payloads.append(f.read(length))
+                        start += _HEADER.size + length
+                seg, offset = current, start
+                if len(payloads) >= max_records:
+                    break
+            return payloads, (seg, offset)
+
+    def ack(self, position: Position) -> None:
+        """Đánh dấu đã gửi xong tới `position`; xoá segment không còn cần."""
+        with self._lock:
+            if position <= self._cursor:
+                return
+            self._cursor = position
+            self._drop_consumed()
+            self._save_cursor()
+
+    def empty(self, start: Optional[Position] = None) -> bool:
+        """Không còn record nào sau `start` (mặc định: cursor)."""
+        with self._lock:
+            seg, offset = self._from(start)
+            return seg == self._segments[-1] and offset >= self._sizes[seg]
+
+    def pending_bytes(self) -> int:
+        with self._lock:
+            seg, offset = self._cursor
+            return sum(size for s, size in self._sizes.items() if s >= seg) - offset
+
+    def close(self) -> None:
+        with self._lock:
+            self._writer.close()
+
+    # ---- nội bộ (gọi khi đang giữ lock) ----
+
+    def _path(self, seg: int) -> str:
+        return os.path.join(self.directory, f"{_SEGMENT_PREFIX}{seg:09d}{_SEGMENT_SUFFIX}")
+
+    def _from(self, start: Optional[Position]) -> Position:
+        # Vị trí trước cursor (segment đã bị xoá) thì đọc từ cursor
+        return self._cursor if start is None else max(start, self._cursor)
+
+    def _total_bytes(self) -> int:
+        return sum(self._sizes.values())
+
+    def _rotate(self) -> int:
+        self._writer.close()
+        seg = self._segments[-1] + 1
+        self._segments.append(seg)
+        self._sizes[seg] = 0
+        self._writer = open(self._path(seg), "ab")
+        return seg
+
+    def _evict_oldest(self) -> None:
+        seg = self._segments.pop(0)
+        self.evicted += self._count_records(seg, self._cursor[1] if self._cursor[0] == seg else 0)
+        del self._sizes[seg]
+        os.remove(self._path(seg))
+        if self._cursor[0] <= seg:
+            self._cursor = (self._segments[0], 0)
+            self._save_cursor()
+        self.logger.warning(f"[Spool] Size cap reached, evicted segment {seg}")
+
+    def _drop_consumed(self) -> None:
+        # Segment nằm hoàn toàn trước cursor (và không phải segment đang ghi)
+        seg, offset = self._cursor
+        while len(self._segments) > 1 and (
+            self._segments[0] < seg or (self._segments[0] == seg and offset >= self._sizes[seg])
+        ):
+            done = self._segments.pop(0)
+            del self._sizes[done]
+            os.remove(self._path(done))
+            if done == seg:
+                self._cursor = (self._segments[0], 0)
+        if self._cursor[0] < self._segments[0]:
+            self._cursor = (self._segments[0], 0)
+
+    def _recover(self, seg: int) -> int:
+        """Kiểm tra segment, cắt bỏ record ghi dở ở cuối. :return: kích thước hợp lệ"""
+        path = self._path(seg)
+        if not os.path.exists(path):
+            return 0
+        valid = 0
+        with open(path, "rb") as f:
+            while True:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    break
+                length, crc = _HEADER.unpack(header)
+                payload = f.read(length)
+                if len(payload) < length or zlib.crc32(payload) != crc:
+                    break
+                valid += _HEADER.size + length
+        if valid != os.path.getsize(path):
+            self.logger.warning(f"[Spool] Truncating torn tail of segment {seg} at {valid}")
+            with open(path, "r+b") as f:
+                f.truncate(valid)
+        return valid
+
+    def _count_records(self, seg: int, start: int) -> int:
+        count = 0
+        with open(self._path(seg), "rb") as f:
+            f.seek(start)
+            while True:
+                header = f.read(_HEADER.size)
+                if len(header) < _HEADER.size:
+                    return count
+                f.seek(_HEADER.unpack(header)[0], os.SEEK_CUR)
+                count += 1
+
+    def _load_cursor(self) -> Position:
+        try:
+            with open(os.path.join(self.directory, _CURSOR_FILE)) as f:
+                seg, offset = (int(x) for x in f.read().split())
+        except (OSError, ValueError):
+            return self._segments[0], 0
+        if seg not in self._sizes:
+            return self._segments[0], 0
+        return seg, min(offset, self._sizes[seg])
+
+    def _save_cursor(self) -> None:
+        path = os.path.join(self.directory, _CURSOR_FILE)
+        with open(path + ".tmp", "w") as f:
+            f.write(f"{self._cursor[0]} {self._cursor[1]}")
+        os.replace(path + ".tmp", path)
+
+
+class SampleBuffer:
+    """
+    Điểm gặp giữa collector thread và gRPC stream.
+
+    Khi stream đang chạy (online), batch đi qua hàng đợi trong RAM tới
+    stream. Khi mất kết nối (offline) hoặc hàng đợi đầy, batch được ghi
+    vào Spool. Lúc stream rảnh, `next_replay()` trả backlog trong Spool
+    thành các batch lớn (mỗi sample mang timestamp riêng), giới hạn theo
+    `replay_rate` batch/giây để không lấn sample live.
+
+    Stream không có ack từng batch từ server, nên frame đã đưa cho gRPC
+    được giữ lại (in-flight) thêm `inflight_window` giây: batch live giữ
+    dạng bytes, batch replay chưa được ack trong Spool. Sau khoảng đó mà
+    stream vẫn sống (keepalive chưa báo chết) thì frame coi như đã tới
+    server. Khi stream đóng, batch live in-flight được ghi lại vào Spool
+    và replay đọc lại từ vị trí đã ack, nên server có thể nhận trùng
+    nhưng không mất sample.
+    """
+
+    def __init__(
+        self,
+        spool: Spool,
+        live_size: int = 16,
+        replay_batch: int = 100,
+        replay_rate: float = 2.0,
+        inflight_window: float = 60.0,
+    ) -> None:
+        """
+        :param spool: Spool trên đĩa
+        :param live_size: Số batch live tối đa chờ trong RAM
+        :param replay_batch: Số tick (record) tối đa gộp vào mỗi batch replay
+        :param replay_rate: Số batch replay tối đa mỗi giây
+        :param inflight_window: Số giây giữ frame đã gửi trước khi coi là server đã nhận;
+                                nên lớn hơn keepalive time + timeout của channel
+        """
+        self.logger = logging.getLogger(__name__)
+        self.spool = spool
+        self.replay_batch = replay_batch
+        self.replay_interval = 1.0 / replay_rate if replay_rate > 0 else 0.0
+        self.live: queue.Queue = queue.Queue(maxsize=live_size)
+        self._online = False
+        self._lock = threading.Lock()
+        self._next_replay = 0.0
+        self.inflight_window = inflight_window
+        # Frame đã đưa cho stream: (thời điểm, bytes của batch live | None, position replay | None)
+        self._inflight: Deque[Tuple[float, Optional[bytes], Optional[Position]]] = deque()
+        # Vị trí đọc replay kế tiếp; đi trước cursor của Spool một khoảng in-flight
+        self._read_pos: Optional[Position] = None
+
+    def put(self, batch: MetricBatch) -> None:
+        """Gọi từ collector thread mỗi tick."""
+        with self._lock:
+            if self._online:
+                try:
+                    self.live.put_nowait(batch)
+                    return
+                except queue.Full:
+                    pass
+            if batch.samples:
+                # Heartbeat (batch rỗng) không cần lưu
+                self._spool(batch)
+
+    @property
+    def online(self) -> bool:
+        return self._online
+
+    def go_online(self) -> None:
+        with self._lock:
+            self._online = True
+        if not self.spool.empty():
+            self.logger.info(f"[Spool] Replaying {self.spool.pending_bytes()} bytes of backlog")
+
+    def go_offline(self) -> None:
+        """
+        Stream đã đóng: ghi lại các batch live in-flight và các batch còn
+        trong RAM xuống Spool; replay đọc lại từ vị trí đã ack.
+        """
+        with self._lock:
+            self._online = False
+            for _, payload, _ in self._inflight:
+                if payload is not None and not self.spool.append(payload):
+                    self.logger.warning("[Spool] Spool is full, dropping batch")
+            self._inflight.clear()
+            self._read_pos = None
+            while True:
+                try:
+                    batch = self.live.get_nowait()
+                except queue.Empty:
+                    break
+                if batch is not None and batch.samples:
+                    self._spool(batch)
+
+    def wait_live(self, timeout: float) -> Optional[MetricBatch]:
+        """Batch live kế tiếp, đã được ghi nhận là in-flight."""
+        try:
+            batch = self.live.get(timeout=timeout)
+        except queue.Empty:
+            return None
+        with self._lock:
+            if not self._online:
+                # go_offline() chạy ngay trước khi lấy được batch: stream đã đóng
+                if batch.samples:
+                    self._spool(batch)
+                return None
+            if batch.samples:
+                self._inflight.append((time.monotonic(), batch.SerializeToString(), None))
+        return batch
+
+    def next_replay(self) -> Optional[MetricBatch]:
+        """Batch replay kế tiếp nếu tới lượt theo rate limit (được ghi nhận là in-flight)."""
+        now = time.monotonic()
+        if now < self._next_replay or self.spool.empty(self._read_pos):
+            return None
+        self._next_replay = now + self.replay_interval
+
+        payloads, position = self.spool.read(self.replay_batch, self._read_pos)
+        merged = MetricBatch()
+        for payload in payloads:
+            batch = MetricBatch.FromString(payload)
+            merged.hostname = batch.hostname
+            merged.timestamp_ns = batch.timestamp_ns
+            merged.timestamp = batch.timestamp
+            for sample in batch.samples:
+                # Batch spool bởi agent cũ chỉ có timestamp dạng chuỗi
+                if not sample.timestamp_ns and not sample.timestamp:
+                    sample.timestamp_ns = batch.timestamp_ns
+                    sample.timestamp = batch.timestamp
+                merged.samples.append(sample)
+        with self._lock:
+            if not self._online:
+                return None
+            self._read_pos = position
+            self._inflight.append((now, None, position))
+        return merged
+
+    def confirm(self, now: Optional[float] = None) -> None:
+        """
+        Frame gửi từ hơn `inflight_window` giây trước mà stream vẫn sống
+        thì coi như server đã nhận: bỏ khỏi in-flight, ack replay trong Spool.
+        """
+        now = time.monotonic() if now is None else now
+        position = None
+        with self._lock:
+            while self._inflight and self._inflight[0][0] <= now - self.inflight_window:
+                _, _, replayed = self._inflight.popleft()
+                if replayed is not None:
+                    position = replayed
+            if position is not None:
+                self.spool.ack(position)
+
+    def replay_delay(self) -> Optional[float]:
+        """Số giây tới lượt replay kế tiếp (None nếu không có backlog)."""
+        if self.spool.empty(self._read_pos):
+            return None
+        return max(0.0, self._next_replay - time.monotonic())
+
+    def _spool(self, batch: MetricBatch) -> None:
+        if not self.spool.append(batch.SerializeToString()):
+            self.logger.warning("[Spool] Spool is full, dropping batch")
@@ -14,12 +14,14 @@ _sym_db = _symbol_database.Default()
 
 
 
-DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\rmonitor.proto\x12\x07monitor\"%\n\x0e\x43ommandRequest\x12\x13\n\x0b\x63ommandList\x18\x01 \x03(\t\"c\n\x0f\x43ommandResponse\x12\x11\n\ttimestamp\x18\x01 \x01(\t\x12\x10\n\x08hostname\x18\x02 \x01(\t\x12\x0e\n\x06metric\x18\x03 \x01(\t\x12\r\n\x05value\x18\x04 \x01(\t\x12\x0c\n\x04unit\x18\x05 \x01(\t2X\n\x0eMonitorService\x12\x46\n\rCommandStream\x12\x18.monitor.CommandResponse\x1a\x17.monitor.CommandRequest(\x01\x30\x01\x62\x06proto3')
+DESCRIPTOR = _descriptor_pool.Default().AddSerializedFile(b'\n\rmonitor.proto\x12\x07monitor\"J\n\x0e\x43ommandRequest\x12\x13\n\x0b\x63ommandList\x18\x01 \x03(\t\x12\x12\n\nbackoff_ms\x18\x02 \x01(\x05\x12\x0f\n\x07version\x18\x03 \x01(\x03\"\x9a\x02\n\x0f\x43ommandResponse\x12\x11\n\ttimestamp\x18\x01 \x01(\t\x12\x10\n\x08hostname\x18\x02 \x01(\t\x12\x0e\n\x06metric\x18\x03 \x01(\t\x12\r\n\x05value\x18\x04 \x01(\t\x12\x0c\n\x04unit\x18\x05 \x01(\t\x12\x16\n\x0c\x64ouble_value\x18\x06 \x01(\x01H\x00\x12\x13\n\tint_value\x18\x07 \x01(\x03H\x00\x12\x34\n\x06\x66ields\x18\x08 \x03(\x0b\x32$.monitor.CommandResponse.FieldsEntry\x12\x14\n\x0ctimestamp_ns\x18\t \x01(\x03\x1a-\n\x0b\x46ieldsEntry\x12\x0b\n\x03key\x18\x01 \x01(\t\x12\r\n\x05value\x18\x02 \x01(\x01:\x02\x38\x01\x42\r\n\x0btyped_value\"\x86\x01\n\x0bMetricBatch\x12\x11\n\ttimestamp\x18\x01 \x01(\t\x12\x10\n\x08hostname\x18\x02 \x01(\t\x12)\n\x07samples\x18\x03 \x03(\x0b\x32\x18.monitor.CommandResponse\x12\x14\n\x0ctimestamp_ns\x18\x04 \x01(\x03\x12\x11\n\tunchanged\x18\x05 \x03(\t2\x9a\x01\n\x0eMonitorService\x12\x46\n\rCommandStream\x12\x18.monitor.CommandResponse\x1a\x17.monitor.CommandRequest(\x01\x30\x01\x12@\n\x0b\x42\x61tchStream\x12\x14.monitor.MetricBatch\x1a\x17.monitor.CommandRequest(\x01\x30\x01\x62\x06proto3')
 
 
 
 _COMMANDREQUEST = DESCRIPTOR.message_types_by_name['CommandRequest']
 _COMMANDRESPONSE = DESCRIPTOR.message_types_by_name['CommandResponse']
+_COMMANDRESPONSE_FIELDSENTRY = _COMMANDRESPONSE.nested_types_by_name['FieldsEntry']
+_METRICBATCH = DESCRIPTOR.message_types_by_name['MetricBatch']
 CommandRequest = _reflection.GeneratedProtocolMessageType('CommandRequest', (_message.Message,), {
   'DESCRIPTOR' : _COMMANDREQUEST,
   '__module__' : 'monitor_pb2'
@@ -28,20 +30,41 @@ CommandRequest = _reflection.GeneratedProtocolMessageType('CommandRequest', (_me
 _sym_db.RegisterMessage(CommandRequest)
 
 CommandResponse = _reflection.GeneratedProtocolMessageType('CommandResponse', (_message.Message,), {
+
+  'FieldsEntry' : _reflection.GeneratedProtocolMessageType('FieldsEntry', (_message.Message,), {
+    'DESCRIPTOR' : _COMMANDRESPONSE_FIELDSENTRY,
+    '__module__' : 'monitor_pb2'
+    # @@protoc_insertion_point(class_scope:monitor.CommandResponse.FieldsEntry)
+    })
+  ,
   'DESCRIPTOR' : _COMMANDRESPONSE,
   '__module__' : 'monitor_pb2'
   # @@protoc_insertion_point(class_scope:monitor.CommandResponse)
   })
 _sym_db.RegisterMessage(CommandResponse)
+_sym_db.RegisterMessage(CommandResponse.FieldsEntry)
+
+MetricBatch = _reflection.GeneratedProtocolMessageType('MetricBatch', (_message.Message,), {
+  'DESCRIPTOR' : _METRICBATCH,
+  '__module__' : 'monitor_pb2'
+  # @@protoc_insertion_point(class_scope:monitor.MetricBatch)
+  })
+_sym_db.RegisterMessage(MetricBatch)
 
 _MONITORSERVICE = DESCRIPTOR.services_by_name['MonitorService']
 if _descriptor._USE_C_DESCRIPTORS == False:
 
   DESCRIPTOR._options = None
+  _COMMANDRESPONSE_FIELDSENTRY._options = None
+  _COMMANDRESPONSE_FIELDSENTRY._serialized_options = b'8\001'
   _COMMANDREQUEST._serialized_start=26
-  _COMMANDREQUEST._serialized_end=63
-  _COMMANDRESPONSE._serialized_start=65
-  _COMMANDRESPONSE._serialized_end=164
-  _MONITORSERVICE._serialized_start=166
-  _MONITORSERVICE._serialized_end=254
+  _COMMANDREQUEST._serialized_end=100
+  _COMMANDRESPONSE._serialized_start=103
+  _COMMANDRESPONSE._serialized_end=385
+  _COMMANDRESPONSE_FIELDSENTRY._serialized_start=325
+  _COMMANDRESPONSE_FIELDSENTRY._serialized_end=370
+  _METRICBATCH._serialized_start=388
+  _METRICBATCH._serialized_end=522
+  _MONITORSERVICE._serialized_start=525
+  _MONITORSERVICE._serialized_end=679
 # @@protoc_insertion_point(module_scope)
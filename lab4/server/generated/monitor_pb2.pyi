@@ -1,26 +1,59 @@
 from google.protobuf.internal import containers as _containers
 from google.protobuf import descriptor as _descriptor
 from google.protobuf import message as _message
-from typing import ClassVar as _ClassVar, Iterable as _Iterable, Optional as _Optional
+from typing import ClassVar as _ClassVar, Iterable as _Iterable, Mapping as _Mapping, Optional as _Optional, Union as _Union
 
 DESCRIPTOR: _descriptor.FileDescriptor
 
 class CommandRequest(_message.Message):
-    __slots__ = ("commandList",)
+    __slots__ = ("commandList", "backoff_ms", "version")
     COMMANDLIST_FIELD_NUMBER: _ClassVar[int]
+    BACKOFF_MS_FIELD_NUMBER: _ClassVar[int]
+    VERSION_FIELD_NUMBER: _ClassVar[int]
     commandList: _containers.RepeatedScalarFieldContainer[str]
-    def __init__(self, commandList: _Optional[_Iterable[str]] = ...) -> None: ...
+    backoff_ms: int
+    version: int
+    def __init__(self, commandList: _Optional[_Iterable[str]] = ..., backoff_ms: _Optional[int] = ..., version: _Optional[int] = ...) -> None: ...
 
 class CommandResponse(_message.Message):
-    __slots__ = ("timestamp", "hostname", "metric", "value", "unit")
+    __slots__ = ("timestamp", "hostname", "metric", "value", "unit", "double_value", "int_value", "fields", "timestamp_ns")
+    class FieldsEntry(_message.Message):
+        __slots__ = ("key", "value")
+        KEY_FIELD_NUMBER: _ClassVar[int]
+        VALUE_FIELD_NUMBER: _ClassVar[int]
+        key: str
+        value: float
+        def __init__(self, key: _Optional[str] = ..., value: _Optional[float] = ...) -> None: ...
     TIMESTAMP_FIELD_NUMBER: _ClassVar[int]
     HOSTNAME_FIELD_NUMBER: _ClassVar[int]
     METRIC_FIELD_NUMBER: _ClassVar[int]
     VALUE_FIELD_NUMBER: _ClassVar[int]
     UNIT_FIELD_NUMBER: _ClassVar[int]
+    DOUBLE_VALUE_FIELD_NUMBER: _ClassVar[int]
+    INT_VALUE_FIELD_NUMBER: _ClassVar[int]
+    FIELDS_FIELD_NUMBER: _ClassVar[int]
+    TIMESTAMP_NS_FIELD_NUMBER: _ClassVar[int]
     timestamp: str
     hostname: str
     metric: str
     value: str
     unit: str
-    def __init__(self, timestamp: _Optional[str] = ..., hostname: _Optional[str] = ..., metric: _Optional[str] = ..., value: _Optional[str] = ..., unit: _Optional[str] = ...) -> None: ...
+    double_value: float
+    int_value: int
+    fields: _containers.ScalarMap[str, float]
+    timestamp_ns: int
+    def __init__(self, timestamp: _Optional[str] = ..., hostname: _Optional[str] = ..., metric: _Optional[str] = ..., value: _Optional[str] = ..., unit: _Optional[str] = ..., double_value: _Optional[float] = ..., int_value: _Optional[int] = ..., fields: _Optional[_Mapping[str, float]] = ..., timestamp_ns: _Optional[int] = ...) -> None: ...
+
+class MetricBatch(_message.Message):
+    __slots__ = ("timestamp", "hostname", "samples", "timestamp_ns", "unchanged")
+    TIMESTAMP_FIELD_NUMBER: _ClassVar[int]
+    HOSTNAME_FIELD_NUMBER: _ClassVar[int]
+    SAMPLES_FIELD_NUMBER: _ClassVar[int]
+    TIMESTAMP_NS_FIELD_NUMBER: _ClassVar[int]
+    UNCHANGED_FIELD_NUMBER: _ClassVar[int]
+    timestamp: str
+    hostname: str
+    samples: _containers.RepeatedCompositeFieldContainer[CommandResponse]
+    timestamp_ns: int
+    unchanged: _containers.RepeatedScalarFieldContainer[str]
+    def __init__(self, timestamp: _Optional[str] = ..., hostname: _Optional[str] = ..., samples: _Optional[_Iterable[_Union[CommandResponse, _Mapping]]] = ..., timestamp_ns: _Optional[int] = ..., unchanged: _Optional[_Iterable[str]] = ...) -> None: ...
@@ -19,6 +19,11 @@ class MonitorServiceStub(object):
                 request_serializer=monitor__pb2.CommandResponse.SerializeToString,
                 response_deserializer=monitor__pb2.CommandRequest.FromString,
                 )
+        self.BatchStream = channel.stream_stream(
+                '/monitor.MonitorService/BatchStream',
+                request_serializer=monitor__pb2.MetricBatch.SerializeToString,
+                response_deserializer=monitor__pb2.CommandRequest.FromString,
+                )
 
 
 class MonitorServiceServicer(object):
@@ -30,6 +35,12 @@ class MonitorServiceServicer(object):
         context.set_details('Method not implemented!')
         raise NotImplementedError('Method not implemented!')
 
+    def BatchStream(self, request_iterator, context):
+        """Missing associated documentation comment in .proto file."""
+        context.set_code(grpc.StatusCode.UNIMPLEMENTED)
+        context.set_details('Method not implemented!')
+        raise NotImplementedError('Method not implemented!')
+
 
 def add_MonitorServiceServicer_to_server(servicer, server):
     rpc_method_handlers = {
@@ -38,6 +49,11 @@ def add_MonitorServiceServicer_to_server(servicer, server):
                     request_deserializer=monitor__pb2.CommandResponse.FromString,
                     response_serializer=monitor__pb2.CommandRequest.SerializeToString,
             ),
+            'BatchStream': grpc.stream_stream_rpc_method_handler(
+                    servicer.BatchStream,
+                    request_deserializer=monitor__pb2.MetricBatch.FromString,
+                    response_serializer=monitor__pb2.CommandRequest.SerializeToString,
+            ),
     }
     generic_handler = grpc.method_handlers_generic_handler(
             'monitor.MonitorService', rpc_method_handlers)
@@ -64,3 +80,20 @@ class MonitorService(object):
             monitor__pb2.CommandRequest.FromString,
             options, channel_credentials,
             insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
+
+    @staticmethod
+    def BatchStream(request_iterator,
+            target,
+            options=(),
+            channel_credentials=None,
+            call_credentials=None,
+            insecure=False,
+            compression=None,
+            wait_for_ready=None,
+            timeout=None,
+            metadata=None):
+        return grpc.experimental.stream_stream(request_iterator, target, '/monitor.MonitorService/BatchStream',
+            monitor__pb2.MetricBatch.SerializeToString,
+            monitor__pb2.CommandRequest.FromString,
+            options, channel_credentials,
+            insecure, call_credentials, compression, wait_for_ready, timeout, metadata)
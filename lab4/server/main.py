@@ -4,10 +4,14 @@ from generated.monitor_pb2_grpc import (
 
 import grpc
 from concurrent import futures
+import asyncio
 import logging
 from module.grpc_server import MonitorService
+from module.grpc_aio_server import AsyncMonitorService
 from module.kafka_producer import KafkaProducerClient
 from module.kafka_consumer import KafkaConsumerClient
+from module.produce_pipeline import ProducePipeline
+from module.grpc_options import parse_compression, server_options
 import os
 import time
 import threading
@@ -18,6 +22,40 @@ def handler_command(message: dict):
     # Here you can add logic to handle the command message
 
 
+def serve_threaded(
+    producer, consumer, pipeline, backoff_ms: int, port: int, max_workers: int, key_fields, options, compression
+):
+    # Each CommandStream holds one pool thread for its whole lifetime,
+    # so max_workers is also the max number of connected agents.
+    server = grpc.server(
+        futures.ThreadPoolExecutor(max_workers=max_workers), options=options, compression=compression
+    )
+    add_MonitorServiceServicer_to_server(
+        MonitorService(producer, consumer, pipeline, backoff_ms, key_fields), server
+    )
+    server.add_insecure_port(f"[::]:{port}")
+
+    logging.info(f"Starting gRPC server (thread pool, max_workers={max_workers}) on port {port}...")
+
+    server.start()
+    server.wait_for_termination()
+
+
+async def serve_aio(producer, consumer, pipeline, backoff_ms: int, port: int, key_fields, options, compression):
+    server = grpc.aio.server(options=options, compression=compression)
+    service = AsyncMonitorService(producer, consumer, pipeline, backoff_ms, key_fields)
+    add_MonitorServiceServicer_to_server(service, server)
+    server.add_insecure_port(f"[::]:{port}")
+
+    logging.info(f"Starting gRPC server (asyncio) on port {port}...")
+
+    await server.start()
+    try:
+        await server.wait_for_termination()
+    finally:
+        service.close()
+
+
 def main():
     logging.basicConfig(
         level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s"
@@ -26,6 +64,24 @@ def main():
     # Read Kafka brokers from environment (set in k8s manifest) or fall back to localhost
     kafka_brokers = os.environ.get("KAFKA_BROKERS", "localhost:9092")
     logging.info(f"Using Kafka brokers: {kafka_brokers}")
+    # "thread" = grpc.server + ThreadPoolExecutor, "aio" = grpc.aio event loop
+    server_mode = os.environ.get("SERVER_MODE", "thread").lower()
+    grpc_port = int(os.environ.get("GRPC_PORT", "50051"))
+    max_workers = int(os.environ.get("GRPC_MAX_WORKERS", "10"))
+    # "json" keeps the legacy wire format; switch to "msgpack" once every consumer is upgraded
+    kafka_codec = os.environ.get("KAFKA_CODEC", "json")
+    # Kafka record key for monitor_metrics, e.g. "hostname" or "hostname,metric";
+    # records with the same key keep their order on one partition
+    key_fields = [f.strip() for f in os.environ.get("KAFKA_KEY_FIELDS", "hostname").split(",") if f.strip()]
+    # Produce pipeline: bounded queue between gRPC handlers and Kafka
+    queue_size = int(os.environ.get("PRODUCE_QUEUE_SIZE", "10000"))
+    queue_shards = int(os.environ.get("PRODUCE_SHARDS", "4"))
+    send_batch_size = int(os.environ.get("PRODUCE_BATCH_SIZE", "500"))
+    overload_policy = os.environ.get("PRODUCE_OVERLOAD_POLICY", "drop_oldest").lower()
+    backoff_ms = int(os.environ.get("PRODUCE_BACKOFF_MS", "5000"))
+    # Compression of replies (agents pick their own) plus keepalive / HTTP/2 tuning
+    compression = parse_compression(os.environ.get("GRPC_COMPRESSION", "none"))
+    options = server_options()
 
     # Retry connecting to Kafka until brokers are available so the pod stays running
     consumer = None
@@ -35,28 +91,43 @@ def main():
         try:
             retry_count += 1
             logging.info(f"Attempting to connect to Kafka (attempt #{retry_count})...")
+            # Every replica must see every command (agents are spread across
+            # replicas): no consumer group, all partitions assigned to each replica
+            # and read from the earliest offset, so a new or restarted replica
+            # rebuilds the command table (the newest version wins). Nothing is
+            # committed, so no per-pod groups pile up on the brokers.
             consumer = KafkaConsumerClient(
                 topic="commands",
                 brokers=kafka_brokers,
-                group_id="monitor-server-group",
+                group_id=None,
                 auto_offset_reset="earliest",
             )
-            producer = KafkaProducerClient(broker_addr=kafka_brokers)
+            producer = KafkaProducerClient(broker_addr=kafka_brokers, codec=kafka_codec)
             logging.info("Successfully connected to Kafka!")
             break
         except Exception as e:
             logging.error(f"Failed to connect to Kafka brokers '{kafka_brokers}': {e}. Retrying in 5s...")
             time.sleep(5)
 
+    pipeline = ProducePipeline(
+        producer,
+        shards=queue_shards,
+        queue_size=queue_size,
+        batch_size=send_batch_size,
+        overload_policy=overload_policy,
+    )
 
-    server = grpc.server(futures.ThreadPoolExecutor(max_workers=10))
-    add_MonitorServiceServicer_to_server(MonitorService(producer, consumer), server)
-    server.add_insecure_port("[::]:50051")
-
-    logging.info("Starting gRPC server on port 50051...")
-
-    server.start()
-    server.wait_for_termination()
+    try:
+        if server_mode == "aio":
+            asyncio.run(
+                serve_aio(producer, consumer, pipeline, backoff_ms, grpc_port, key_fields, options, compression)
+            )
+        else:
+            serve_threaded(
+                producer, consumer, pipeline, backoff_ms, grpc_port, max_workers, key_fields, options, compression
+            )
+    finally:
+        pipeline.close()
 
 
 if __name__ == "__main__":
@@ -0,0 +1,203 @@
+import threading
+import time
+from dataclasses import dataclass, field
+from typing import Any, Dict, FrozenSet, Iterable, List, Mapping, Optional, Tuple
+
+
+@dataclass(frozen=True)
+class CommandEnvelope:
+    """
+    One command from the Kafka `commands` topic.
+
+    {
+      "version": 1718000000123,
+      "metrics": ["cpu", "memory"],
+      "target": {"hosts": [...], "groups": [...], "labels": {"zone": "a"}},
+      "ttl": 300,
+      "issued_at": 1718000000.12
+    }
+
+    An empty target means every agent. `labels` is a selector: an agent
+    matches when it carries all of them.
+    """
+
+    version: int
+    metrics: Tuple[str, ...]
+    hosts: FrozenSet[str] = frozenset()
+    groups: FrozenSet[str] = frozenset()
+    labels: Tuple[Tuple[str, str], ...] = ()
+    expires_at: Optional[float] = None
+
+    @property
+    def is_broadcast(self) -> bool:
+        return not self.hosts and not self.groups and not self.labels
+
+    def expired(self, now: float) -> bool:
+        return self.expires_at is not None and now >= self.expires_at
+
+    @staticmethod
+    def is_versioned(message: Any) -> bool:
+        """False for the older formats, which need a fallback version."""
+        return isinstance(message, dict) and bool(message.get("version"))
+
+    @classmethod
+    def from_message(cls, message: Any, fallback_version: int) -> "CommandEnvelope":
+        """
+        Parse an envelope. Also accepts the older formats: a bare metric
+        list and {"metrics", "hosts", "groups"}; those get `fallback_version`.
+        """
+        if not isinstance(message, dict):
+            return cls(version=fallback_version, metrics=tuple(message))
+
+        target = message.get("target")
+        if target is None:
+            target = message
+
+        expires_at = None
+        ttl = message.get("ttl")
+        if ttl:
+            expires_at = float(message.get("issued_at") or time.time()) + float(ttl)
+
+        return cls(
+            version=int(message.get("version") or fallback_version),
+            metrics=tuple(message.get("metrics", [])),
+            hosts=frozenset(target.get("hosts") or ()),
+            groups=frozenset(target.get("groups") or ()),
+            labels=tuple(sorted((target.get("labels") or {}).items())),
+            expires_at=expires_at,
+        )
+
+
+# Effective command of a host that no envelope targets
+NO_COMMAND = CommandEnvelope(version=0, metrics=())
+
+
+@dataclass
+class _Agent:
+    groups: FrozenSet[str]
+    labels: Dict[str, str]
+    effective: CommandEnvelope = field(default=NO_COMMAND)
+
+
+class CommandTable:
+    """
+    Versioned command state.
+
+    Envelopes are stored per selector (broadcast / host / group / label
+    selector) and the effective envelope of every connected host is
+    materialised in `_agents`, so answering "what should this host run"
+    is a dictionary lookup. Within a selector an envelope only replaces
+    an older version; across selectors the newest version wins.
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._broadcast: CommandEnvelope = NO_COMMAND
+        self._by_host: Dict[str, CommandEnvelope] = {}
+        self._by_group: Dict[str, CommandEnvelope] = {}
+        self._by_labels: Dict[Tuple[Tuple[str, str], ...], CommandEnvelope] = {}
+        self._agents: Dict[str, _Agent] = {}
+        self._last_version = 0
+        self._last_fallback = 0
+
+    def next_version(self, timestamp_ms: Optional[int] = None) -> int:
+        """
+        Version for unversioned (legacy) messages. With the Kafka record's
+        timestamp (epoch ms, like envelope versions) the version reflects
+        when the message was published, so re-reading the topic from the
+        start never lets an old bare list outrank later envelopes; legacy
+        messages still get strictly increasing versions among themselves.
+        Without it: newer than anything seen.
+        """
+        with self._lock:
+            if timestamp_ms is None or timestamp_ms <= 0:
+                version = max(self._last_version + 1, time.time_ns() // 1_000_000)
+            else:
+                version = max(timestamp_ms, self._last_fallback + 1)
+            self._last_fallback = max(self._last_fallback, version)
+            return version
+
+    def effective(self, hostname: str) -> CommandEnvelope:
+        agent = self._agents.get(hostname)
+        return agent.effective if agent is not None else NO_COMMAND
+
+    def add_agent(self, hostname: str, groups: Iterable[str] = (), labels: Mapping[str, str] = None) -> CommandEnvelope:
+        """Track a connected host and resolve its effective envelope once."""
+        with self._lock:
+            agent = _Agent(frozenset(groups), dict(labels or {}))
+            agent.effective = self._resolve(hostname, agent, time.time())
+            self._agents[hostname] = agent
+            return agent.effective
+
+    def remove_agent(self, hostname: str) -> None:
+        with self._lock:
+            self._agents.pop(hostname, None)
+
+    def apply(self, envelope: CommandEnvelope, hostnames: Iterable[str]) -> List[str]:
+        """
+        Store `envelope` and update the hosts it targets.
+        :param hostnames: connected hosts selected by the envelope target
+        :return: hosts whose effective envelope changed
+        """
+        with self._lock:
+            self._last_version = max(self._last_version, envelope.version)
+
+            if envelope.is_broadcast:
+                if not self._newer(self._broadcast, envelope):
+                    return []
+                self._broadcast = envelope
+                hostnames = list(self._agents)
+            else:
+                stored = False
+                for host in envelope.hosts:
+                    if self._newer(self._by_host.get(host), envelope):
+                        self._by_host[host] = envelope
+                        stored = True
+                for group in envelope.groups:
+                    if self._newer(self._by_group.get(group), envelope):
+                        self._by_group[group] = envelope
+                        stored = True
+                if envelope.labels and self._newer(self._by_labels.get(envelope.labels), envelope):
+                    self._by_labels[envelope.labels] = envelope
+                    stored = True
+                if not stored:
+                    return []
+
+            changed = []
+            for host in hostnames:
+                agent = self._agents.get(host)
+                if agent is not None and envelope.version > agent.effective.version:
+                    agent.effective = envelope
+                    changed.append(host)
+            return changed
+
+    def expire(self, now: float = None) -> List[str]:
+        """Drop expired envelopes; return hosts whose effective envelope changed."""
+        now = time.time() if now is None else now
+        with self._lock:
+            if self._broadcast.expired(now):
+                self._broadcast = NO_COMMAND
+            for index in (self._by_host, self._by_group, self._by_labels):
+                for key in [k for k, env in index.items() if env.expired(now)]:
+                    del index[key]
+
+            changed = []
+            for host, agent in self._agents.items():
+                if agent.effective.expired(now):
+                    agent.effective = self._resolve(host, agent, now)
+                    changed.append(host)
+            return changed
+
+    def _resolve(self, hostname: str, agent: _Agent, now: float) -> CommandEnvelope:
+        candidates = [self._broadcast, self._by_host.get(hostname, NO_COMMAND)]
+        candidates.extend(self._by_group.get(g, NO_COMMAND) for g in agent.groups)
+        candidates.extend(
+            env for selector, env in self._by_labels.items()
+            if all(agent.labels.get(k) == v for k, v in selector)
+        )
+        live = [env for env in candidates if not env.expired(now)]
+        return max(live, key=lambda env: env.version, default=NO_COMMAND)
+
+    @staticmethod
+    def _newer(current: Optional[CommandEnvelope], envelope: CommandEnvelope) -> bool:
+        return current is None or envelope.version > current.version
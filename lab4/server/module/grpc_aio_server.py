@@ -0,0 +1,95 @@
+import asyncio
+import functools
+import logging
+from concurrent import futures
+from typing import Sequence
+
+import grpc
+
+from module.grpc_server import MonitorService
+from module.kafka_consumer import KafkaConsumerClient
+from module.kafka_producer import KafkaProducerClient
+from module.produce_pipeline import OverloadPolicy, ProducePipeline
+from module.stream_registry import AsyncAgentStream
+
+
+class AsyncMonitorService(MonitorService):
+    """
+    grpc.aio version of MonitorService.
+
+    Each agent stream is a coroutine on one event loop instead of a pool
+    thread, so the number of connected agents is not capped by max_workers.
+    Records go through the non-blocking ProducePipeline; only the BLOCK
+    overload policy needs a thread so that a full queue never blocks the loop.
+    """
+
+    def __init__(
+        self,
+        producer: KafkaProducerClient,
+        consumer: KafkaConsumerClient,
+        pipeline: ProducePipeline = None,
+        backoff_ms: int = 5000,
+        key_fields: Sequence[str] = ("hostname",),
+        send_workers: int = 2,
+    ) -> None:
+        super().__init__(producer, consumer, pipeline, backoff_ms, key_fields)
+        self.logger = logging.getLogger(__name__)
+        self._send_executor = futures.ThreadPoolExecutor(
+            max_workers=send_workers, thread_name_prefix="kafka-send"
+        )
+
+    async def CommandStream(self, request_iterator, context):
+        async for reply in self._serve_async(request_iterator, context, self._sample_to_message):
+            yield reply
+
+    async def BatchStream(self, request_iterator, context):
+        async for reply in self._serve_async(request_iterator, context, self._batch_to_message):
+            yield reply
+
+    async def _serve_async(self, request_iterator, context, to_message):
+        loop = asyncio.get_running_loop()
+        stream = AsyncAgentStream(loop, *self._stream_identity(context))
+        if stream.hostname:
+            self._attach(stream)
+
+        reader = asyncio.create_task(self._consume_frames_async(request_iterator, stream, to_message))
+
+        try:
+            while True:
+                reply = await stream.outbox.get()
+                if reply is None:
+                    break
+                yield reply
+
+        except asyncio.CancelledError:
+            raise
+
+        except Exception as e:
+            self.logger.error(f"Error in stream of {stream.hostname}: {e}")
+            context.set_code(grpc.StatusCode.INTERNAL)
+            context.set_details(str(e))
+            raise
+
+        finally:
+            reader.cancel()
+            self._detach(stream)
+
+    async def _consume_frames_async(self, request_iterator, stream: AsyncAgentStream, to_message) -> None:
+        try:
+            async for frame in request_iterator:
+                if self.pipeline.overload_policy == OverloadPolicy.BLOCK:
+                    await asyncio.get_running_loop().run_in_executor(
+                        self._send_executor,
+                        functools.partial(self._handle_frame, frame, stream, to_message),
+                    )
+                else:
+                    self._handle_frame(frame, stream, to_message)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            self.logger.error(f"Error reading stream of {stream.hostname}: {e}")
+        finally:
+            stream.close()
+
+    def close(self) -> None:
+        self._send_executor.shutdown(wait=True)
@@ -0,0 +1,53 @@
+import os
+from typing import Any, List, Mapping, Tuple
+
+import grpc
+
+COMPRESSION = {
+    "none": grpc.Compression.NoCompression,
+    "gzip": grpc.Compression.Gzip,
+    "deflate": grpc.Compression.Deflate,
+}
+
+
+def parse_compression(name: str) -> grpc.Compression:
+    """"gzip" -> grpc.Compression.Gzip; unknown names fail at startup."""
+    try:
+        return COMPRESSION[(name or "none").lower()]
+    except KeyError:
+        raise ValueError(f"Unknown gRPC compression: {name} (expected one of {', '.join(COMPRESSION)})")
+
+
+def server_options(env: Mapping[str, str] = os.environ) -> List[Tuple[str, Any]]:
+    """
+    gRPC server options from the environment.
+
+    Keepalive: the server pings each connection every
+    GRPC_KEEPALIVE_TIME_MS (default 60s) and drops it when no ack comes
+    within GRPC_KEEPALIVE_TIMEOUT_MS (default 20s); 0 disables it. Agent
+    pings are accepted down to GRPC_MIN_PING_INTERVAL_MS (default 10s),
+    which must not exceed the agents' own keepalive time.
+    Optional: GRPC_MAX_CONCURRENT_STREAMS (per connection),
+    GRPC_MAX_RECEIVE_MB (largest accepted message, gRPC default 4),
+    GRPC_HTTP2_BDP_PROBE (0/1) and GRPC_HTTP2_LOOKAHEAD_BYTES (initial
+    per-stream flow-control window).
+    """
+    options: List[Tuple[str, Any]] = [
+        ("grpc.http2.min_ping_interval_without_data_ms", int(env.get("GRPC_MIN_PING_INTERVAL_MS", "10000"))),
+        ("grpc.keepalive_permit_without_calls", 1),
+    ]
+    keepalive_ms = int(env.get("GRPC_KEEPALIVE_TIME_MS", "60000"))
+    if keepalive_ms > 0:
+        options += [
+            ("grpc.keepalive_time_ms", keepalive_ms),
+            ("grpc.keepalive_timeout_ms", int(env.get("GRPC_KEEPALIVE_TIMEOUT_MS", "20000"))),
+        ]
+    if env.get("GRPC_MAX_CONCURRENT_STREAMS"):
+        options.append(("grpc.max_concurrent_streams", int(env["GRPC_MAX_CONCURRENT_STREAMS"])))
+    if env.get("GRPC_MAX_RECEIVE_MB"):
+        options.append(("grpc.max_receive_message_length", int(float(env["GRPC_MAX_RECEIVE_MB"]) * 1024 * 1024)))
+    if env.get("GRPC_HTTP2_BDP_PROBE"):
+        options.append(("grpc.http2.bdp_probe", int(env["GRPC_HTTP2_BDP_PROBE"])))
+    if env.get("GRPC_HTTP2_LOOKAHEAD_BYTES"):
+        options.append(("grpc.http2.lookahead_bytes", int(env["GRPC_HTTP2_LOOKAHEAD_BYTES"])))
+    return options
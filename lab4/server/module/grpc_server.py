@@ -1,13 +1,24 @@
 from generated.monitor_pb2_grpc import (
     MonitorServiceServicer,
 )
-from generated.monitor_pb2 import CommandRequest, CommandResponse
+from generated.monitor_pb2 import CommandResponse, MetricBatch
 import grpc
 from google.protobuf.json_format import MessageToJson
 import logging
 from module.kafka_producer import KafkaProducerClient
 from module.kafka_consumer import KafkaConsumerClient
+from module.produce_pipeline import ProducePipeline
+from module.command_table import CommandEnvelope, CommandTable
+from module.stream_registry import (
+    GROUPS_METADATA,
+    HOSTNAME_METADATA,
+    LABELS_METADATA,
+    AgentStream,
+    StreamRegistry,
+)
 import threading
+import time
+from typing import Iterable, Optional, Sequence
 
 
 class MetricType:
@@ -18,14 +29,59 @@ class MetricType:
     PROCESS_COUNT = "process_count"
 
 
+def sample_value(sample: CommandResponse):
+    """
+    Native value of a sample: number, dict of sub-values, or the legacy
+    string payload sent by older agents.
+    """
+    kind = sample.WhichOneof("typed_value")
+    if kind is not None:
+        return getattr(sample, kind)
+    if sample.fields:
+        return dict(sample.fields)
+    return sample.value
+
+
+def _timestamp_field(message) -> dict:
+    """
+    {"timestamp_ns": int} from newer agents; older ones only send the
+    "%Y-%m-%d %H:%M:%S" string, which is forwarded as "timestamp".
+    """
+    if message.timestamp_ns:
+        return {"timestamp_ns": message.timestamp_ns}
+    return {"timestamp": message.timestamp}
+
+
 class MonitorService(MonitorServiceServicer):
     def __init__(
-        self, producer: KafkaProducerClient, consumer: KafkaConsumerClient
+        self,
+        producer: KafkaProducerClient,
+        consumer: KafkaConsumerClient,
+        pipeline: ProducePipeline = None,
+        backoff_ms: int = 5000,
+        key_fields: Sequence[str] = ("hostname",),
     ) -> None:
+        """
+        :param key_fields: Message fields joined into the Kafka record key;
+                           hostname (always put first) keeps every host on one partition
+        """
         self.logger = logging.getLogger(__name__)
         self.producer = producer
         self.consumer = consumer
-        self.received_commands = []
+        # Handlers never call the producer directly: records go through a
+        # bounded queue drained by background senders.
+        self.pipeline = pipeline if pipeline is not None else ProducePipeline(producer)
+        self.backoff_ms = backoff_ms
+        key_fields = tuple(key_fields) or ("hostname",)
+        if "hostname" in key_fields:
+            # The producer partitions composite keys by their first field
+            key_fields = ("hostname",) + tuple(f for f in key_fields if f != "hostname")
+        self.key_fields = key_fields
+
+        # Live agent streams; commands are pushed to them as soon as they arrive
+        self.registry = StreamRegistry()
+        # Versioned commands and the effective command of every connected host
+        self.commands = CommandTable()
 
         t = threading.Thread(
             target=consumer.start_consuming, args=(self.handler_command,), daemon=True
@@ -33,35 +89,174 @@ class MonitorService(MonitorServiceServicer):
 
         t.start()
 
+        threading.Thread(target=self._expire_commands, daemon=True).start()
+
     def CommandStream(self, request_iterator, context):
+        # Legacy: one CommandResponse per metric
+        return self._serve(request_iterator, context, self._sample_to_message)
 
-        try:
-            for request in request_iterator:
-                request: CommandResponse
-                logging.info(MessageToJson(request, indent=2))
-
-                self.producer.send_message(
-                    topic="monitor_metrics",
-                    message={
-                        "timestamp": request.timestamp,
-                        "hostname": request.hostname,
-                        "metric": request.metric,
-                        "value": request.value,
-                    },
-                )
-
-                yield CommandRequest(commandList=self.received_commands)
+    def BatchStream(self, request_iterator, context):
+        # One MetricBatch per agent tick -> one Kafka record
+        return self._serve(request_iterator, context, self._batch_to_message)
 
-        except grpc.RpcError as e:
-            self.logger.error(f"RPC error in CommandStream: {e}")
-            raise
+    def _serve(self, request_iterator, context, to_message):
+        """
+        Requests are read on a separate thread while this generator only
+        relays the stream outbox, so a command push reaches the agent
+        immediately instead of waiting for its next frame.
+        """
+        stream = AgentStream(*self._stream_identity(context))
+        if stream.hostname:
+            self._attach(stream)
+        context.add_callback(stream.close)
+
+        reader = threading.Thread(
+            target=self._consume_frames,
+            args=(request_iterator, stream, to_message),
+            daemon=True,
+        )
+        reader.start()
+
+        try:
+            while True:
+                reply = stream.outbox.get()
+                if reply is None:
+                    break
+                yield reply
 
         except Exception as e:
-            self.logger.error(f"Error in CommandStream: {e}")
+            self.logger.error(f"Error in stream of {stream.hostname}: {e}")
             context.set_code(grpc.StatusCode.INTERNAL)
             context.set_details(str(e))
             raise
 
-    def handler_command(self, commmands):
+        finally:
+            self._detach(stream)
+
+    def _consume_frames(self, request_iterator, stream: AgentStream, to_message) -> None:
+        try:
+            for frame in request_iterator:
+                self._handle_frame(frame, stream, to_message)
+        except grpc.RpcError as e:
+            self.logger.error(f"RPC error in stream of {stream.hostname}: {e}")
+        except Exception as e:
+            self.logger.error(f"Error reading stream of {stream.hostname}: {e}")
+        finally:
+            stream.close()
+
+    def _handle_frame(self, frame, stream: AgentStream, to_message) -> None:
+        if self.logger.isEnabledFor(logging.DEBUG):
+            # Formatting the frame costs more than handling it
+            self.logger.debug(MessageToJson(frame, indent=2))
+
+        if not stream.hostname:
+            # Older agents do not send metadata: learn the host from the first frame
+            stream.hostname = frame.hostname
+            self._attach(stream)
+
+        message = to_message(frame)
+        if message is not None and not self._publish(message, stream.hostname):
+            stream.push_backoff(self.backoff_ms)
+
+    def _attach(self, stream: AgentStream) -> None:
+        self.registry.register(stream)
+        envelope = self.commands.add_agent(stream.hostname, stream.groups, stream.labels)
+        stream.offer_commands(list(envelope.metrics), envelope.version)
+
+    def _detach(self, stream: AgentStream) -> None:
+        if self.registry.unregister(stream):
+            self.commands.remove_agent(stream.hostname)
+
+    @staticmethod
+    def _stream_identity(context):
+        metadata = dict(context.invocation_metadata() or ())
+        hostname = metadata.get(HOSTNAME_METADATA) or None
+        groups = [g.strip() for g in metadata.get(GROUPS_METADATA, "").split(",") if g.strip()]
+        labels = dict(
+            pair.strip().split("=", 1)
+            for pair in metadata.get(LABELS_METADATA, "").split(",")
+            if "=" in pair
+        )
+        return hostname, groups, labels
+
+    def _publish(self, message: dict, hostname: str) -> bool:
+        """Queue a record for Kafka; False means the agent should back off."""
+        return self.pipeline.submit("monitor_metrics", message, key=self._record_key(message, hostname))
+
+    def _record_key(self, message: dict, hostname: str) -> str:
+        """
+        Kafka key from `key_fields`, e.g. "web-1" or "web-1|cpu". Fields a
+        message does not have (a batch has no "metric") are skipped; the
+        hostname falls back to the stream's so it always leads the key.
+        """
+        if self.key_fields == ("hostname",):
+            return message.get("hostname") or hostname
+        values = dict(message, hostname=message.get("hostname") or hostname)
+        parts = [str(values[field]) for field in self.key_fields if values.get(field) not in (None, "")]
+        return "|".join(parts) or hostname
+
+    @staticmethod
+    def _sample_to_message(request: CommandResponse) -> dict:
+        message = _timestamp_field(request)
+        message.update(
+            hostname=request.hostname,
+            metric=request.metric,
+            value=sample_value(request),
+            unit=request.unit,
+        )
+        return message
+
+    @staticmethod
+    def _batch_to_message(batch: MetricBatch) -> Optional[dict]:
+        if not batch.samples and not batch.unchanged:
+            # Heartbeat: nothing to forward
+            return None
+        samples = []
+        for sample in batch.samples:
+            item = {
+                "metric": sample.metric,
+                "value": sample_value(sample),
+                "unit": sample.unit,
+            }
+            if sample.timestamp_ns or sample.timestamp:
+                # Spool replay merges several ticks: each sample keeps its own time
+                item.update(_timestamp_field(sample))
+            samples.append(item)
+        message = _timestamp_field(batch)
+        message.update(hostname=batch.hostname, samples=samples)
+        if batch.unchanged:
+            # Deadband on the agent: these metrics kept their last sent value
+            message["unchanged"] = list(batch.unchanged)
+        return message
+
+    def handler_command(self, commmands, timestamp_ms: Optional[int] = None):
+        """
+        Kafka `commands` message: a command envelope (see CommandEnvelope),
+        or the older bare metric list / {"metrics", "hosts", "groups"} dict.
+        :param timestamp_ms: Kafka record timestamp, versions the older formats
+        """
         self.logger.info(f"[MonitorService] Received commands: {commmands}")
-        self.received_commands = commmands
+
+        # Only unversioned messages take a fallback version (it advances the sequence)
+        fallback = 0 if CommandEnvelope.is_versioned(commmands) else self.commands.next_version(timestamp_ms)
+        envelope = CommandEnvelope.from_message(commmands, fallback)
+        streams = self.registry.streams_for(envelope.hosts, envelope.groups, envelope.labels)
+        changed = self.commands.apply(envelope, {stream.hostname for stream in streams})
+        self._push(streams)
+        self.logger.info(
+            f"[MonitorService] Command version {envelope.version} is effective on {len(changed)} host(s)"
+        )
+
+    def _push(self, streams: Iterable[AgentStream]) -> None:
+        for stream in streams:
+            envelope = self.commands.effective(stream.hostname)
+            stream.offer_commands(list(envelope.metrics), envelope.version)
+
+    def _expire_commands(self, interval: float = 1.0) -> None:
+        """Drop commands whose TTL ran out and push the fallback to their hosts."""
+        while True:
+            time.sleep(interval)
+            changed = self.commands.expire()
+            if changed:
+                self._push(self.registry.streams_for(hosts=changed))
+                self.logger.info(f"[MonitorService] Commands expired on {len(changed)} host(s)")
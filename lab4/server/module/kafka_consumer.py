@@ -1,17 +1,19 @@
 from __future__ import annotations
 
-import json
-from typing import Any, Dict, Callable
-from kafka import KafkaConsumer
+from typing import Any, Dict, Callable, Optional
+from kafka import KafkaConsumer, TopicPartition
 import logging
 
+from .serializer import deserialize
+
 
 class KafkaConsumerClient:
     """
     Wrapper around kafka-python KafkaConsumer.
     Features:
-    - JSON deserialization
-    - consumer groups
+    - JSON / msgpack deserialization (auto-detected per record)
+    - consumer groups, or (group_id=None) every partition of the topic
+      assigned manually, read from `auto_offset_reset` and never committed
     - callback processing
     """
 
@@ -19,32 +21,51 @@ class KafkaConsumerClient:
         self,
         topic: str,
         brokers: str = "localhost:9092",
-        group_id: str = "default-group",
+        group_id: Optional[str] = "default-group",
         auto_offset_reset: str = "latest",
         enable_auto_commit: bool = True,
     ):
         self.topic = topic
 
+        if group_id is not None:
+            self.consumer = KafkaConsumer(
+                topic,
+                bootstrap_servers=brokers,
+                group_id=group_id,
+                auto_offset_reset=auto_offset_reset,  # "earliest" or "latest"
+                enable_auto_commit=enable_auto_commit,
+                value_deserializer=deserialize,
+            )
+            return
+
         self.consumer = KafkaConsumer(
-            topic,
             bootstrap_servers=brokers,
-            group_id=group_id,
-            auto_offset_reset=auto_offset_reset,  # "earliest" or "latest"
-            enable_auto_commit=enable_auto_commit,
-            value_deserializer=lambda v: json.loads(v.decode("utf-8")),
+            group_id=None,
+            auto_offset_reset=auto_offset_reset,
+            enable_auto_commit=False,
+            value_deserializer=deserialize,
         )
+        partitions = self.consumer.partitions_for_topic(topic)
+        if not partitions:
+            self.consumer.close()
+            raise RuntimeError(f"Topic {topic} has no partitions (not created yet?)")
+        # Partitions added to the topic later are only picked up on restart
+        self.consumer.assign([TopicPartition(topic, p) for p in sorted(partitions)])
+        if auto_offset_reset == "earliest":
+            self.consumer.seek_to_beginning()
 
-    def start_consuming(self, callback: Callable[[Dict[str, Any]], None]):
+    def start_consuming(self, callback: Callable[[Dict[str, Any], int], None]):
         """
         Start consuming forever.
-        :param callback: function that receives each decoded message.
+        :param callback: function that receives each decoded message and
+                         its record timestamp (epoch ms, -1 if unknown).
         """
         logging.info(f"[Kafka] Starting consumer for topic: {self.topic}")
 
         for message in self.consumer:
             try:
-                value = message.value  # already JSON dict
-                callback(value)
+                value = message.value  # already decoded
+                callback(value, message.timestamp)
             except Exception as e:
                 logging.error(f"[Kafka] Error processing message: {e}")
 
@@ -1,5 +1,9 @@
+from typing import Optional
+
 from kafka import KafkaProducer
-import json
+from kafka.partitioner.default import murmur2
+
+from .serializer import get_serializer
 
 
 class KafkaProducerClient:
@@ -8,23 +12,51 @@ class KafkaProducerClient:
         broker_addr: str,
         linger_ms: int = 5,
         retries: int = 3,
+        codec: str = "json",
     ) -> None:
         """
         :param broker_addr: Kafka bootstrap servers
         :param linger_ms: Batch delay for better throughput
         :param retries: Retry count for failed sends
+        :param codec: Value codec, "json" (legacy) or "msgpack" (see serializer.py)
         """
+        ordering = {}
+        if "enable_idempotence" not in KafkaProducer.DEFAULT_CONFIG:
+            # Without idempotence a retried batch can overtake a later one,
+            # breaking per-key ordering
+            ordering["max_in_flight_requests_per_connection"] = 1
+
         self.producer = KafkaProducer(
             bootstrap_servers=broker_addr,
             linger_ms=linger_ms,
             retries=retries,
-            value_serializer=lambda v: json.dumps(v).encode("utf-8"),
+            value_serializer=get_serializer(codec),
+            **ordering,
         )
 
-    def send_message(self, topic: str, message: dict) -> None:
-        future = self.producer.send(topic, value=message)
+    def send_message(self, topic: str, message: dict, key: Optional[str] = None) -> None:
+        """
+        :param key: Record key; records with the same key go to the same
+                    partition, in order. None spreads records over partitions.
+                    A composite key ("web-1|cpu") is partitioned by its first
+                    field only, so all records of that field share a partition.
+        """
+        partition = None
+        if key is not None and "|" in key:
+            partition = self._partition(topic, key.split("|", 1)[0])
+        future = self.producer.send(
+            topic,
+            value=message,
+            key=key.encode("utf-8") if key is not None else None,
+            partition=partition,
+        )
         return future
 
+    def _partition(self, topic: str, key: str) -> int:
+        """Partition the default partitioner would give a record keyed `key`."""
+        partitions = sorted(self.producer.partitions_for(topic))
+        return partitions[(murmur2(key.encode("utf-8")) & 0x7FFFFFFF) % len(partitions)]
+
     def close(self) -> None:
         self.producer.flush()
         self.producer.close()
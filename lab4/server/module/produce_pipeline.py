@@ -0,0 +1,180 @@
+import logging
+import queue
+import threading
+import time
+from typing import Any, Dict, List, Optional, Tuple
+
+from module.kafka_producer import KafkaProducerClient
+
+
+class OverloadPolicy:
+    DROP_OLDEST = "drop_oldest"  # evict the oldest queued record
+    BLOCK = "block"  # block the caller until there is room
+    BACKOFF = "backoff"  # evict the oldest record and tell the agent to slow down
+
+
+class ProducePipeline:
+    """
+    Bounded, sharded Kafka produce queue between the gRPC handlers and the broker.
+
+    Handlers call submit() and return immediately; one sender thread per
+    shard drains its queue in batches and hands records to the Kafka
+    producer. Records with the same key (hostname) always land on the same
+    shard, so per-host ordering is preserved. Delivery results are counted
+    in `stats` instead of being dropped silently.
+    """
+
+    def __init__(
+        self,
+        producer: KafkaProducerClient,
+        shards: int = 4,
+        queue_size: int = 10000,
+        batch_size: int = 500,
+        overload_policy: str = OverloadPolicy.DROP_OLDEST,
+        stats_interval: float = 60.0,
+    ) -> None:
+        """
+        :param producer: Kafka producer used by the sender threads
+        :param shards: Number of queues / sender threads
+        :param queue_size: Total capacity, split evenly across shards
+        :param batch_size: Max records a sender takes from its queue per round
+        :param overload_policy: One of OverloadPolicy
+        :param stats_interval: Seconds between stats log lines (0 disables)
+        """
+        if overload_policy not in (
+            OverloadPolicy.DROP_OLDEST,
+            OverloadPolicy.BLOCK,
+            OverloadPolicy.BACKOFF,
+        ):
+            raise ValueError(f"Unknown overload policy: {overload_policy}")
+
+        self.logger = logging.getLogger(__name__)
+        self.producer = producer
+        self.batch_size = batch_size
+        self.overload_policy = overload_policy
+
+        shards = max(1, shards)
+        per_shard = max(1, queue_size // shards)
+        self._queues: List[queue.Queue] = [queue.Queue(maxsize=per_shard) for _ in range(shards)]
+        self._next_shard = 0
+
+        self.stats: Dict[str, int] = {
+            "enqueued": 0,
+            "sent": 0,
+            "failed": 0,
+            "dropped": 0,
+            "overloaded": 0,
+        }
+        self._stats_lock = threading.Lock()
+        self._running = True
+        self._stopped = threading.Event()
+
+        # Only the sender threads are joined on close(); the stats thread
+        # wakes up through `_stopped`
+        self._threads = [
+            threading.Thread(target=self._drain, args=(q,), name=f"kafka-sender-{i}", daemon=True)
+            for i, q in enumerate(self._queues)
+        ]
+        for t in self._threads:
+            t.start()
+        if stats_interval > 0:
+            threading.Thread(target=self._report, args=(stats_interval,), name="kafka-stats", daemon=True).start()
+
+    def submit(self, topic: str, message: Any, key: Optional[str] = None) -> bool:
+        """
+        Queue a record for sending.
+        :return: False when the queue was full and the caller should ask the
+                 agent to back off (BACKOFF policy only), True otherwise.
+        """
+        q = self._shard_for(key)
+        item = (topic, message, key)
+
+        if self.overload_policy == OverloadPolicy.BLOCK:
+            q.put(item)
+            self._count("enqueued")
+            return True
+
+        overloaded = False
+        while True:
+            try:
+                q.put_nowait(item)
+                break
+            except queue.Full:
+                overloaded = True
+                try:
+                    q.get_nowait()
+                    self._count("dropped")
+                except queue.Empty:
+                    pass
+
+        self._count("enqueued")
+        if overloaded:
+            self._count("overloaded")
+            return self.overload_policy != OverloadPolicy.BACKOFF
+        return True
+
+    def qsize(self) -> int:
+        return sum(q.qsize() for q in self._queues)
+
+    def snapshot(self) -> Dict[str, int]:
+        with self._stats_lock:
+            stats = dict(self.stats)
+        stats["queued"] = self.qsize()
+        return stats
+
+    def close(self, timeout: float = 10.0) -> None:
+        """Stop accepting work, drain what is queued and flush the producer."""
+        self._running = False
+        self._stopped.set()
+        deadline = time.monotonic() + timeout
+        for t in self._threads:
+            t.join(max(0.0, deadline - time.monotonic()))
+        self.producer.close()
+
+    def _shard_for(self, key: Optional[str]) -> queue.Queue:
+        if key is not None:
+            return self._queues[hash(key) % len(self._queues)]
+        # No key: round-robin (a benign race here only affects balance)
+        self._next_shard = (self._next_shard + 1) % len(self._queues)
+        return self._queues[self._next_shard]
+
+    def _drain(self, q: queue.Queue) -> None:
+        while self._running or not q.empty():
+            try:
+                batch: List[Tuple[str, Any, Optional[str]]] = [q.get(timeout=0.5)]
+            except queue.Empty:
+                continue
+
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(q.get_nowait())
+                except queue.Empty:
+                    break
+
+            for topic, message, key in batch:
+                try:
+                    future = self.producer.send_message(topic=topic, message=message, key=key)
+                    future.add_callback(self._on_delivered)
+                    future.add_errback(self._on_failed)
+                except Exception as e:
+                    self._count("failed")
+                    self.logger.error(f"[ProducePipeline] Send to {topic} failed: {e}")
+
+    def _on_delivered(self, _metadata) -> None:
+        self._count("sent")
+
+    def _on_failed(self, exc) -> None:
+        self._count("failed")
+        self.logger.error(f"[ProducePipeline] Delivery failed: {exc}")
+
+    def _count(self, name: str, n: int = 1) -> None:
+        with self._stats_lock:
+            self.stats[name] += n
+
+    def _report(self, interval: float) -> None:
+        last = None
+        while not self._stopped.wait(interval):
+            stats = self.snapshot()
+            if stats != last:
+                self.logger.info(f"[ProducePipeline] {stats}")
+                last = stats
@@ -0,0 +1,153 @@
+import asyncio
+import queue
+import threading
+from typing import Dict, Iterable, List, Mapping, Optional, Set, Tuple
+
+from generated.monitor_pb2 import CommandRequest
+
+# gRPC metadata sent by the agent when it opens a stream
+HOSTNAME_METADATA = "x-monitor-hostname"
+GROUPS_METADATA = "x-monitor-groups"
+LABELS_METADATA = "x-monitor-labels"  # "zone=a,tier=web"
+
+
+class AgentStream:
+    """
+    Server side of one connected agent stream.
+
+    Everything the server sends to the agent (command pushes, backoff
+    hints) goes through `outbox`, which the gRPC handler drains. Pushes
+    can therefore come from any thread, e.g. the Kafka commands consumer.
+    """
+
+    def __init__(
+        self,
+        hostname: Optional[str] = None,
+        groups: Iterable[str] = (),
+        labels: Mapping[str, str] = None,
+    ) -> None:
+        self.hostname = hostname
+        self.groups = frozenset(groups)
+        self.labels = dict(labels or {})
+        self.last_sent: List[str] = []
+        self.last_version = 0
+        self._lock = threading.Lock()
+        self.outbox = self._make_outbox()
+
+    def _make_outbox(self):
+        return queue.Queue()
+
+    def _put(self, item) -> None:
+        self.outbox.put(item)
+
+    def offer_commands(self, commands: List[str], version: int = 0) -> None:
+        """Push `commands` unless this agent already has that version."""
+        with self._lock:
+            if version == self.last_version:
+                return
+            self.last_sent = list(commands)
+            self.last_version = version
+            self._put(CommandRequest(commandList=self.last_sent, version=version))
+
+    def push_backoff(self, backoff_ms: int) -> None:
+        with self._lock:
+            self._put(
+                CommandRequest(
+                    commandList=self.last_sent,
+                    backoff_ms=backoff_ms,
+                    version=self.last_version,
+                )
+            )
+
+    def close(self) -> None:
+        """Wake the handler up so it can finish the RPC."""
+        self._put(None)
+
+
+class AsyncAgentStream(AgentStream):
+    """AgentStream whose outbox is an asyncio.Queue owned by `loop`."""
+
+    def __init__(
+        self,
+        loop: asyncio.AbstractEventLoop,
+        hostname: Optional[str] = None,
+        groups: Iterable[str] = (),
+        labels: Mapping[str, str] = None,
+    ) -> None:
+        self.loop = loop
+        super().__init__(hostname, groups, labels)
+
+    def _make_outbox(self):
+        return asyncio.Queue()
+
+    def _put(self, item) -> None:
+        self.loop.call_soon_threadsafe(self.outbox.put_nowait, item)
+
+
+class StreamRegistry:
+    """Live agent streams indexed by hostname, host group and label."""
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        self._by_host: Dict[str, Set[AgentStream]] = {}
+        self._by_group: Dict[str, Set[AgentStream]] = {}
+        self._by_label: Dict[Tuple[str, str], Set[AgentStream]] = {}
+
+    def register(self, stream: AgentStream) -> None:
+        with self._lock:
+            self._by_host.setdefault(stream.hostname, set()).add(stream)
+            for group in stream.groups:
+                self._by_group.setdefault(group, set()).add(stream)
+            for label in stream.labels.items():
+                self._by_label.setdefault(label, set()).add(stream)
+
+    def unregister(self, stream: AgentStream) -> bool:
+        """
+        :return: True when this was the last stream of its host
+        """
+        with self._lock:
+            self._discard(self._by_host, stream.hostname, stream)
+            for group in stream.groups:
+                self._discard(self._by_group, group, stream)
+            for label in stream.labels.items():
+                self._discard(self._by_label, label, stream)
+            return stream.hostname not in self._by_host
+
+    def streams_for(
+        self,
+        hosts: Iterable[str] = (),
+        groups: Iterable[str] = (),
+        labels: Iterable[Tuple[str, str]] = (),
+    ) -> List[AgentStream]:
+        """
+        Streams of the given hosts/groups, plus streams carrying every label
+        in `labels`; every stream when all three are empty.
+        """
+        hosts, groups, labels = list(hosts), list(groups), list(labels)
+        with self._lock:
+            if not hosts and not groups and not labels:
+                return [s for streams in self._by_host.values() for s in streams]
+
+            selected: Set[AgentStream] = set()
+            for host in hosts:
+                selected.update(self._by_host.get(host, ()))
+            for group in groups:
+                selected.update(self._by_group.get(group, ()))
+            if labels:
+                selected.update(
+                    set.intersection(*(self._by_label.get(label, set()) for label in labels))
+                )
+            return list(selected)
+
+    def __len__(self) -> int:
+        with self._lock:
+            return sum(len(streams) for streams in self._by_host.values())
+
+    @staticmethod
+    def _discard(index: Dict, key, stream: AgentStream) -> None:
+        streams = index.get(key)
+        if streams is None:
+            return
+        streams.discard(stream)
+        if not streams:
+            del index[key]